@@ -22,6 +22,10 @@ Example call:
     export DIDIP_ROOT=. FSDB_ROOT=~/tmp/data/1000CV
     PYTHONPATH="${HOME}/htr/didipcv/src/:${DIDIP_ROOT}/apps/ddpa_lines" ${DIDIP_ROOT}/apps/ddpa_lines/bin/ddp_line_detect -img_paths "${FSDB_ROOT}"/*/*/d9ae9ea49832ed79a2238c2d87cd0765/*seals.crops/*OldText*.jpg
 
+On a large archive, let the script read the paths lazily instead (no shell expansion):
+
+    find "${FSDB_ROOT}" -path '*seals.crops/*OldText*.jpg' | ${DIDIP_ROOT}/apps/ddpa_lines/bin/ddp_line_detect -img_list=- -workers 16
+
 
 Output formats: The segmentation output is a Python dictionary object, that can be converted to PageXML with Kraken's serializer, or dumpde into a JSON file. Additionally, the associated, local seglib library allows for saving the resulting polygons into a 3D tensor, that can then be used for extracting metrics as well as the line crops (bounding boxes) and their corresponding polygon mask. Note that Kraken's CNN model only predicts the baselines; the polygons are extrapolated from them in a second step.
 
@@ -36,7 +40,14 @@ p = {
         "preview_delay": 0,
         "dry_run": False,
         "just_show": False,
-        "output_format": [("xml", "json", "pt"), "Segmentation output: xml=<Page XML>, json=<JSON file>, tensor=<a (4,H,W) label map where each pixel can store up to 4 labels (for overlapping polygons)"],
+        "output_format": [set(["xml"]), "Segmentation output(s), any combination of: xml=<Page XML>, json=<JSON file>, pt=<a (4,H,W) label map where each pixel can store up to 4 labels (for overlapping polygons), as a pickled tensor>, pmap=<the same map, in a compressed container with per-label access>; all formats are written from a single segmentation pass"],
+        "pmap_uncompressed": [False, "Store the pmap output uncompressed: a larger file, that holds the dense map and is memory-mapped (instead of read) when loaded"],
+        "workers": [1, "Number of worker processes (each of them holds its own copy of the model)"],
+        "threads": [0, "Total number of Torch intra-op threads, split evenly among the workers (0 = as many as CPU cores)"],
+        "img_list": ["", "A file that lists the input images, one path per line ('-img_list=-' for stdin); paths are read lazily, as they come (takes precedence over -img_paths)"],
+        "img_glob": ["", "A recursive glob pattern (eg. '${FSDB_ROOT}/**/*.seals.crops/*OldText*.jpg', quoted), expanded lazily by the script itself (takes precedence over -img_paths)"],
+        "lookahead": [0, "Number of queued paths among which the largest image is dispatched first (0 = 2 x workers)"],
+        "force": [False, "Re-segment every image, even those whose outputs are complete and up to date (as recorded in the output folder's manifest)"],
 }
 
 
@@ -48,6 +59,18 @@ from kraken.lib import vgsl
 from PIL import Image, ImageDraw
 from pathlib import Path
 import torch
+import time
+import os
+import glob
+import heapq
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import tempfile
+import json
+from contextlib import contextmanager
+from typing import Optional, Tuple, Dict, Iterator, Iterable, List
 
 sys.path.append( str( Path(__file__).parents[1] ) )
 
@@ -57,59 +80,530 @@ import vizlib
 import re
 
 
+OUTPUT_FORMATS = ('xml', 'json', 'pt', 'pmap')
+
+MANIFEST_NAME = 'manifest.json'
+# max. number of output folder manifests kept in memory at any time
+MANIFEST_CACHE_SIZE = 64
+
+
+def load_model( model_path: str ) -> vgsl.TorchVGSLModel:
+    """
+    Load the segmentation model; meant to be called once per run, since deserializing
+    the model may cost more than segmenting a small crop.
+
+    Args:
+        model_path (str): path of the Kraken model file.
+
+    Output:
+        vgsl.TorchVGSLModel: the model, ready for inference.
+    """
+    if not Path( model_path ).exists():
+        raise FileNotFoundError("Cound not find model file", model_path)
+    return vgsl.TorchVGSLModel.load_model( model_path )
+
+
+def output_location( path: str, appname: str ) -> Tuple[Path, str]:
+    """
+    Output folder and file stem for a given input image.
+
+    Args:
+        path (str): path of the input image.
+        appname (str): the app's name, used in the output folder name.
+
+    Output:
+        tuple: a pair (output folder, file stem).
+    """
+    # output folder name stem is the Id part of the input image folder
+    new_img_dir_stem = re.sub(r'\..+', '',  Path( path ).parent.name )
+    return (Path( path ).parents[1].joinpath( f'{new_img_dir_stem}.{appname}.lines' ), Path( path ).stem)
+
+
+@contextmanager
+def atomic_output( output_file_path: Path, mode: str='w' ):
+    """
+    Write into a temporary file of the same folder, that is renamed into the final output
+    only once it is complete: a killed process never leaves a half-written output behind.
+
+    Args:
+        output_file_path (Path): the final output path.
+        mode (str): file mode ('w' or 'wb').
+
+    Output:
+        file: a file object, to be written into.
+    """
+    fd, tmp_path = tempfile.mkstemp( dir=output_file_path.parent, prefix=f'.{output_file_path.name}.', suffix='.tmp' )
+    try:
+        with os.fdopen( fd, mode ) as tmp_file:
+            yield tmp_file
+        os.replace( tmp_path, output_file_path )
+    except BaseException:
+        if os.path.exists( tmp_path ):
+            os.unlink( tmp_path )
+        raise
+
+
+def load_manifest( output_dir: Path ) -> Dict[str, dict]:
+    """
+    Load the manifest of an output folder, that records for every input image the input's
+    and the model's hashes, the output format and the completion status.
+
+    Args:
+        output_dir (Path): the output folder.
+
+    Output:
+        dict: a dictionary with image file stems as keys (empty if no manifest exists yet).
+    """
+    manifest_path = output_dir.joinpath( MANIFEST_NAME )
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open( manifest_path, 'r' ) as manifest_file:
+            return json.load( manifest_file )
+    except ValueError:
+        # unreadable manifest: everything is redone
+        return {}
+
+
+def save_manifest( output_dir: Path, manifest: Dict[str, dict] ) -> None:
+    """
+    Store the manifest of an output folder (atomically).
+
+    Args:
+        output_dir (Path): the output folder.
+        manifest (dict): a dictionary with image file stems as keys.
+    """
+    output_dir.mkdir( exist_ok=True )
+    with atomic_output( output_dir.joinpath( MANIFEST_NAME )) as manifest_file:
+        json.dump( manifest, manifest_file, indent=2, sort_keys=True )
+
+
+# manifests already loaded, indexed by output folder (least recently used first)
+_manifests: 'OrderedDict[Path, dict]' = OrderedDict()
+
+def get_manifest( output_dir: Path ) -> Dict[str, dict]:
+    """
+    Return the manifest of an output folder, from a small LRU cache, so that memory stays flat
+    however many output folders a run touches (manifests are always stored right after an update).
+
+    Args:
+        output_dir (Path): the output folder.
+
+    Output:
+        dict: a dictionary with image file stems as keys.
+    """
+    if output_dir in _manifests:
+        _manifests.move_to_end( output_dir )
+    else:
+        _manifests[ output_dir ] = load_manifest( output_dir )
+        if len( _manifests ) > MANIFEST_CACHE_SIZE:
+            _manifests.popitem( last=False )
+    return _manifests[ output_dir ]
+
+
+def is_up_to_date( entry: Optional[dict], output_dir: Path, input_hash: str, model_hash: str, output_formats: List[str] ) -> bool:
+    """
+    Check whether a manifest entry describes a completed segmentation, obtained from the same
+    input and the same model, whose output is still there.
+
+    Args:
+        entry (dict): the manifest entry for the image (or None).
+        output_dir (Path): the output folder.
+        input_hash (str): the current hash of the input image.
+        model_hash (str): the current hash of the model.
+        output_formats (List[str]): the requested output formats.
+
+    Output:
+        bool: True if the image does not need to be segmented again.
+    """
+    if entry is None or entry.get('status') != 'done':
+        return False
+    if entry.get('input_sha256') != input_hash or entry.get('model_sha256') != model_hash:
+        return False
+    # a previous run may have produced more formats than requested now
+    done_formats = entry.get('output_format', [])
+    if isinstance( done_formats, str ):
+        done_formats = [ done_formats ]
+    if not set( output_formats ) <= set( done_formats ):
+        return False
+    return all( output_dir.joinpath( output ).exists() for output in entry.get('outputs', []) )
+
+
+def segment_image( path: str, model: vgsl.TorchVGSLModel, args ) -> float:
+    """
+    Segment a single image with an already loaded model and store the output.
+
+    Args:
+        path (str): path of the input image.
+        model (vgsl.TorchVGSLModel): the segmentation model.
+        args: the script's parameters.
+
+    Output:
+        float: the time spent on this image (in seconds).
+    """
+    start = time.perf_counter()
+
+    output_dir, stem = output_location( path, args.appname )
+
+    with Image.open( path, 'r' ) as img:
+
+        if args.just_show:
+            # only look for existing map (container first, then legacy tensor)
+            for map_file_path in (output_dir.joinpath(f'{stem}.pmap'), output_dir.joinpath(f'{stem}.pt')):
+                if map_file_path.exists():
+                    # dense maps are memory-mapped, compressed ones decompressed label by label
+                    polygon_map = seglib.load_polygon_map( map_file_path, sparse=seglib.is_compressed_polygon_map_file( map_file_path ), mmap=True )
+                    Image.fromarray( vizlib.display_polygon_set( img, polygon_map ) ).show()
+                    break
+            return time.perf_counter() - start
+
+        output_dir.mkdir( exist_ok=True )
+
+        # one inference pass, whatever the number of output formats
+        segmentation_dict = blla.segment( img, model=model )
+
+        # PageXML output
+        if 'xml' in args.output_format:
+            output_file_path = output_dir.joinpath( f'{stem}.xml' )
+            page = serialization.serialize_segmentation(
+                segmentation_dict, image_name=img.filename,
+                image_size=img.size, template='pagexml')
+
+            with atomic_output( output_file_path ) as fp:
+                fp.write( page )
+            print("Segmentation output saved in {}".format( output_file_path ))
+
+        # JSON file
+        if 'json' in args.output_format:
+            output_file_path = output_dir.joinpath( f'{stem}.json' )
+            with atomic_output( output_file_path ) as fp:
+                json.dump( segmentation_dict, fp )
+            print("Segmentation output saved in {}".format( output_file_path ))
+
+        # store the segmentation into a 3D polygon-map
+        if 'pt' in args.output_format or 'pmap' in args.output_format:
+            polygon_map = seglib.polygon_map_from_img_segmentation_dict( img, segmentation_dict )
+            if 'pt' in args.output_format:
+                output_file_path = output_dir.joinpath( f'{stem}.pt' )
+                with atomic_output( output_file_path, 'wb' ) as fp:
+                    torch.save( polygon_map, fp )
+                print("Segmentation output saved in {}".format( output_file_path ))
+            if 'pmap' in args.output_format:
+                output_file_path = output_dir.joinpath( f'{stem}.pmap' )
+                with atomic_output( output_file_path, 'wb' ) as fp:
+                    seglib.save_polygon_map( polygon_map, fp, compressed=not args.pmap_uncompressed )
+                print("Segmentation output saved in {}".format( output_file_path ))
 
-if __name__ == "__main__":
+    return time.perf_counter() - start
 
-    args, _ = fargv.fargv( p )
 
-    for path in list( args.img_paths ):
-        print( path )
+def image_pixel_count( path: str ) -> int:
+    """
+    Image size, as read from the file header (used for scheduling large images first).
 
-        stem = Path( path ).stem
-        # output folder name stem is the Id part of the input image folder
-        new_img_dir_stem = re.sub(r'\..+', '',  Path( path ).parent.name )
-        output_dir = Path( path ).parents[1].joinpath( f'{new_img_dir_stem}.{args.appname}.lines' )
+    Args:
+        path (str): path of the input image.
 
+    Output:
+        int: the number of pixels in the image, or -1 if the header cannot be read.
+    """
+    try:
         with Image.open( path, 'r' ) as img:
+            return img.size[0] * img.size[1]
+    except Exception:
+        return -1
+
+
+def threads_per_worker( thread_count: int, worker_count: int ) -> int:
+    """
+    Split the intra-op thread budget among the workers, so that they do not oversubscribe the CPU.
+
+    Args:
+        thread_count (int): total number of threads (0 = number of CPU cores).
+        worker_count (int): number of worker processes.
+
+    Output:
+        int: the number of Torch threads each worker may use (at least 1).
+    """
+    if thread_count <= 0:
+        thread_count = os.cpu_count() or 1
+    return max(1, thread_count // max(1, worker_count))
+
+
+# per-process state, set once by the pool initializer
+_worker_model = None
+_worker_args = None
+
+def init_worker( args, thread_count: int ) -> None:
+    """
+    Pool initializer: each worker loads its own model and limits its own thread count.
+
+    Args:
+        args: the script's parameters.
+        thread_count (int): number of Torch threads for this worker.
+    """
+    global _worker_model, _worker_args
+    torch.set_num_threads( thread_count )
+    _worker_args = args
+    if not args.just_show:
+        _worker_model = load_model( args.model_path )
+
+
+def worker_ready() -> bool:
+    """
+    Probe task: it only runs once a worker has gone through its initializer.
+
+    Output:
+        bool: True.
+    """
+    return True
+
+
+def segment_image_safe( path: str, model: Optional[vgsl.TorchVGSLModel]=None, args=None ) -> Tuple[str, Optional[float], Optional[str]]:
+    """
+    Segment a single image, without letting a failure (corrupt or oversized image, ...) escape:
+    the error is returned instead, so that it can be logged while the rest of the batch goes on.
+
+    Args:
+        path (str): path of the input image.
+        model (vgsl.TorchVGSLModel): the segmentation model (default: the worker's model).
+        args: the script's parameters (default: the worker's parameters).
+
+    Output:
+        tuple: a triplet (path, elapsed time or None, error message or None).
+    """
+    if args is None:
+        model, args = _worker_model, _worker_args
+    try:
+        return (path, segment_image( path, model, args ), None)
+    except Exception as e:
+        return (path, None, '{}: {}'.format( type(e).__name__, e ))
+
+
+def record_status( path: str, input_hash: str, model_hash: str, args, status: str ) -> None:
+    """
+    Update (and store) the manifest entry of an input image.
+
+    Args:
+        path (str): path of the input image.
+        input_hash (str): hash of the input image.
+        model_hash (str): hash of the model.
+        args: the script's parameters.
+        status (str): 'done' or 'failed'.
+    """
+    output_dir, stem = output_location( path, args.appname )
+    manifest = get_manifest( output_dir )
+    manifest[ stem ] = {
+            'input': str( path ),
+            'input_sha256': input_hash,
+            'model_sha256': model_hash,
+            'output_format': sorted( args.output_format ),
+            'outputs': [ f'{stem}.{fmt}' for fmt in sorted( args.output_format ) ] if status == 'done' else [],
+            'status': status,
+    }
+    save_manifest( output_dir, manifest )
+
+
+def iter_img_paths( args ) -> Iterator[str]:
+    """
+    Yield the input image paths lazily, from a list file, stdin, or a recursive glob pattern, so that
+    processing starts on the first path and memory stays flat however large the corpus is; fall back
+    on the (shell-expanded) -img_paths set.
+
+    Args:
+        args: the script's parameters.
+
+    Output:
+        Iterator[str]: image paths.
+    """
+    if not (args.img_list or args.img_glob):
+        yield from args.img_paths
+        return
+    if args.img_list:
+        list_file = sys.stdin if args.img_list == '-' else open( args.img_list, 'r' )
+        try:
+            for line in list_file:
+                path = line.strip()
+                if path:
+                    yield path
+        finally:
+            if list_file is not sys.stdin:
+                list_file.close()
+    if args.img_glob:
+        yield from glob.iglob( args.img_glob, recursive=True )
+
+
+def largest_first( paths: Iterable[str], lookahead: int ) -> Iterator[str]:
+    """
+    Reorder a stream of image paths, so that among the next <lookahead> queued paths, the largest
+    image comes first (large images are dispatched early, and the run does not end with a straggler).
+
+    Args:
+        paths (Iterable[str]): image paths.
+        lookahead (int): size of the reordering buffer (1 = no reordering).
+
+    Output:
+        Iterator[str]: image paths.
+    """
+    if lookahead <= 1:
+        # no reordering: no image header to read
+        yield from paths
+        return
+    heap, counter = [], itertools.count()
+    for path in paths:
+        heapq.heappush( heap, (-image_pixel_count( path ), next(counter), path) )
+        if len( heap ) >= lookahead:
+            yield heapq.heappop( heap )[2]
+    while heap:
+        yield heapq.heappop( heap )[2]
 
-            output_file_path = output_dir.joinpath( f'{stem}.{args.output_format}' )
 
-            if args.just_show:
-                # only look for existing tensor map
-                map_file_path = output_dir.joinpath(f'{stem}.pt')
-                if map_file_path.exists():
-                    polygon_map_chw = torch.load( map_file_path ) 
-                    Image.fromarray( vizlib.display_polygon_set( img, polygon_map_chw ) ).show()
-                continue
-
-            output_dir.mkdir( exist_ok=True )
-
-            if not Path( args.model_path ).exists():
-                raise FileNotFoundError("Cound not find model file", args.model_path)
-            model = vgsl.TorchVGSLModel.load_model( args.model_path )
-
-            segmentation_dict = blla.segment( img, model=model )
+if __name__ == "__main__":
 
-            # PageXML output
-            if args.output_format == 'xml':
-                output_file_path = output_dir.joinpath( f'{stem}.xml' )
-                page = serialization.serialize_segmentation(
-                    segmentation_dict, image_name=img.filename,
-                    image_size=img.size, template='pagexml')
+    args, _ = fargv.fargv( p )
 
-                with open( output_file_path, 'w' ) as fp:
-                    fp.write( page )
+    args.output_format = sorted( set( args.output_format ))
+    unknown_formats = set( args.output_format ) - set( OUTPUT_FORMATS )
+    if unknown_formats:
+        raise ValueError("Unknown output format(s): {} (valid formats: {})".format( ', '.join( sorted(unknown_formats) ), ', '.join( OUTPUT_FORMATS )))
 
-            # JSON file
-            elif args.output_format == 'json':
-                output_file_path = output_dir.joinpath( f'{stem}.json' )
-                json.dumps( segmentation_dict, output_file_path )
+    lookahead = args.lookahead if args.lookahead > 0 else (2*args.workers if args.workers > 1 else 1)
+    img_paths = largest_first( iter_img_paths( args ), lookahead )
 
-            # store the segmentation into a 3D polygon-map
-            elif args.output_format == 'pt':
-                output_file_path = output_dir.joinpath( f'{stem}.pt' )
-                polygon_map = seglib.polygon_map_from_img_segmentation_dict( img, segmentation_dict )
-                torch.save( polygon_map, output_file_path )
-                print("Segmentation output saved in {}".format( output_file_path ))
+    model_hash = ''
+    if not args.just_show:
+        model_hash = seglib.file_sha256( args.model_path ) if Path( args.model_path ).exists() else ''
 
+    skipped = 0
 
+    def pending_img_paths( paths: Iterable[str] ) -> Iterator[Tuple[str, str]]:
+        """ Skip the images that are already done (same input, same model, same format). """
+        global skipped
+        for path in paths:
+            if args.just_show:
+                yield (path, '')
+                continue
+            try:
+                input_hash = seglib.file_sha256( path )
+            except OSError:
+                # let the segmentation step report the error
+                input_hash = ''
+            output_dir, stem = output_location( path, args.appname )
+            if not args.force and is_up_to_date( get_manifest( output_dir ).get( stem ), output_dir, input_hash, model_hash, args.output_format ):
+                skipped += 1
+                continue
+            yield (path, input_hash)
+
+    batch_start = time.perf_counter()
+    img_count, failed = 0, []
+    load_time = 0.0
+
+    def handle_result( path: str, input_hash: str, elapsed: Optional[float], error: Optional[str] ) -> None:
+        global img_count
+        if not args.just_show:
+            record_status( path, input_hash, model_hash, args, 'failed' if error is not None else 'done' )
+        if error is not None:
+            print("{}: failed ({})".format( path, error ), file=sys.stderr)
+            failed.append( path )
+            return
+        img_count += 1
+        print("{}: {:.2f}s ({:.2f} img/s)".format( path, elapsed, 1/elapsed if elapsed else float('inf') ))
+
+    if args.workers > 1:
+        # each worker holds its own model; intra-op threads are split among workers
+        thread_count = threads_per_worker( args.threads, args.workers )
+        print("Starting {} workers ({} thread(s) each)".format( args.workers, thread_count ))
+
+        def start_executor() -> ProcessPoolExecutor:
+            """ Start a pool, and check that its workers can be initialized: if they cannot, no pool will do, and the run stops. """
+            new_executor = ProcessPoolExecutor( args.workers, initializer=init_worker, initargs=(args, thread_count) )
+            try:
+                new_executor.submit( worker_ready ).result()
+            except BrokenProcessPool:
+                new_executor.shutdown( wait=True )
+                print("Worker initialization failed (see the error above): aborting", file=sys.stderr)
+                sys.exit(2)
+            return new_executor
+
+        if not args.just_show:
+            # a missing or unloadable model fails here, once, instead of breaking every pool
+            load_model( args.model_path )
+
+        def collect( futures: Iterable ) -> List[Tuple[str, str]]:
+            """ Handle completed segmentations; return the images whose worker died (eg. out of memory), which breaks the pool. """
+            suspects = []
+            for future in futures:
+                path, input_hash = in_flight.pop( future )
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    suspects.append( (path, input_hash) )
+                    continue
+                handle_result( path, input_hash, *result[1:] )
+            return suspects
+
+        def restart_executor( suspects: List[Tuple[str, str]] ) -> None:
+            """
+            Start a new pool, in place of a broken one. Any of the images that were in flight may have killed the worker:
+            each of them is segmented again, alone in the new pool, and only an image that breaks it again is a failure.
+            """
+            global executor
+            suspects = suspects + collect( list( in_flight ))
+            executor.shutdown( wait=True )
+            print("A worker process died: restarting {} workers, and retrying {} image(s) one at a time".format( args.workers, len( suspects )), file=sys.stderr)
+            executor = start_executor()
+            for path, input_hash in suspects:
+                try:
+                    result = executor.submit( segment_image_safe, path ).result()
+                except BrokenProcessPool as e:
+                    handle_result( path, input_hash, None, 'worker process died ({})'.format( e ))
+                    executor.shutdown( wait=True )
+                    executor = start_executor()
+                    continue
+                handle_result( path, input_hash, *result[1:] )
+
+        executor = start_executor()
+        try:
+            # bounded submission: only a few paths are in flight at any time
+            in_flight = {}
+            for path, input_hash in pending_img_paths( img_paths ):
+                if len( in_flight ) >= 2*args.workers:
+                    done, _ = wait( in_flight, return_when=FIRST_COMPLETED )
+                    suspects = collect( done )
+                    if suspects:
+                        restart_executor( suspects )
+                try:
+                    in_flight[ executor.submit( segment_image_safe, path ) ] = (path, input_hash)
+                except BrokenProcessPool:
+                    # the pool broke since the last wait
+                    restart_executor( [] )
+                    in_flight[ executor.submit( segment_image_safe, path ) ] = (path, input_hash)
+            suspects = collect( list( in_flight ))
+            if suspects:
+                restart_executor( suspects )
+        finally:
+            executor.shutdown( wait=True )
+    else:
+        if args.threads > 0:
+            torch.set_num_threads( args.threads )
+        # the model is loaded once (on the first image to be processed), and kept warm for the whole batch
+        model = None
+        for path, input_hash in pending_img_paths( img_paths ):
+            if model is None and not args.just_show:
+                load_start = time.perf_counter()
+                model = load_model( args.model_path )
+                load_time = time.perf_counter() - load_start
+                print("Model {} loaded in {:.2f}s".format( args.model_path, load_time ))
+                batch_start = time.perf_counter()
+            print( path )
+            handle_result( path, input_hash, *segment_image_safe( path, model, args )[1:] )
+
+    if skipped:
+        print("Skipped {} image(s) whose outputs are up to date".format( skipped ))
+    batch_time = time.perf_counter() - batch_start
+    if img_count:
+        print("Processed {} images in {:.2f}s: {:.2f}s/img, {:.2f} img/s (+ {:.2f}s for loading the model once)".format(
+            img_count, batch_time, batch_time/img_count, img_count/batch_time if batch_time else float('inf'), load_time ))
+    if failed:
+        print("{} image(s) could not be processed:\n{}".format( len(failed), '\n'.join( failed )), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+Evaluate line segmentations against a ground truth, over a whole corpus: pages are spread
+over a pool of worker processes, and only the per-page scores travel back to the main process.
+
+Input:
+    A list of (image, prediction, GT) triplets, one per line, tab-separated; prediction and GT
+    are segmentation files, either JSON (Kraken's segmentation dictionary) or PageXML ('.xml').
+
+Output:
+    - a per-page table (TSV): line counts, TP, FP, FN, Jaccard and F1 (line-based), pixel IU and matched pixel IU
+    - corpus totals: micro-averaged (from the summed counts) and macro-averaged (mean of the per-page scores)
+
+Example call:
+
+    paste <(ls ${FSDB_ROOT}/*/*/*/*.img.jpg) <(ls ${FSDB_ROOT}/*/*/*/*.lines.pred.json) <(ls ${FSDB_ROOT}/*/*/*/*.lines.gt.xml) \\
+        | PYTHONPATH="${DIDIP_ROOT}/apps/ddpa_lines" ${DIDIP_ROOT}/apps/ddpa_lines/bin/ddp_line_eval -page_list=- -workers 16 -output_file eval.tsv
+
+Segmentations can also be read from stores built with ddp_segpack (-pred_store, -gt_store), instead of
+being parsed from individual files.
+
+Modes: 'pixel' renders both segmentations on the page and counts the FG pixels only (as computed by seglib.get_mask());
+'geometric' computes the polygons' areas directly, without any rendering nor FG mask (much cheaper).
+"""
+
+
+p = {
+        "page_list": ["-", "A file that lists the pages to evaluate, one tab-separated (image, prediction, GT) triplet per line ('-page_list=-' for stdin)"],
+        "mode": [("pixel", "geometric"), "Metrics: pixel=<FG pixels of the rendered polygons>, geometric=<polygon areas, no FG mask>"],
+        "threshold": [.5, "Precision and recall threshold for a pred/GT match to count as a TP"],
+        "workers": [1, "Number of worker processes"],
+        "threads": [0, "Total number of Torch intra-op threads, split evenly among the workers (0 = as many as CPU cores)"],
+        "output_file": ["", "Per-page table (TSV); default: stdout"],
+        "summary_file": ["", "If provided, store the corpus totals into this JSON file"],
+        "pred_store": ["", "If provided, a segmentation store (see ddp_segpack) where predictions are read from: the triplets' second field is then a page name in the store"],
+        "gt_store": ["", "If provided, a segmentation store (see ddp_segpack) where GT segmentations are read from: the triplets' third field is then a page name in the store"],
+}
+
+
+import sys
+import fargv
+from pathlib import Path
+from PIL import Image
+import numpy as np
+import torch
+import time
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple, Dict, Iterator, Iterable, List, TextIO
+
+sys.path.append( str( Path(__file__).parents[1] ) )
+
+
+import seglib
+from ddp_line_detect import threads_per_worker
+
+
+COLUMNS = ('page', 'lines_pred', 'lines_gt', 'TP', 'FP', 'FN', 'Jaccard', 'F1', 'pixel_IU', 'matched_pixel_IU', 'seconds')
+
+# counts that are summed over the corpus, for the micro-averaged scores
+COUNT_FIELDS = ('TP', 'FP', 'FN', 'intersection', 'union')
+# scores that are averaged over the pages, for the macro-averaged scores
+SCORE_FIELDS = ('Jaccard', 'F1', 'pixel_IU', 'matched_pixel_IU')
+
+
+def iter_page_triplets( page_list: str ) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yield the (image, prediction, GT) triplets lazily, from a list file or from stdin.
+
+    Args:
+        page_list (str): path of the list file ('-' for stdin).
+
+    Output:
+        Iterator[Tuple[str,str,str]]: (image, prediction, GT) path triplets.
+    """
+    list_file = sys.stdin if page_list == '-' else open( page_list, 'r' )
+    try:
+        for line in list_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len( fields ) != 3:
+                raise ValueError("Expected a tab-separated (image, prediction, GT) triplet: {}".format( line ))
+            yield tuple( fields )
+    finally:
+        if list_file is not sys.stdin:
+            list_file.close()
+
+
+# stores opened so far, in this process
+_stores: Dict[str, seglib.SegmentationStore] = {}
+
+
+def read_segmentation( segmentation: str, store_path: str='' ) -> dict:
+    """
+    Read a segmentation dictionary, from a file or from a segmentation store.
+
+    Args:
+        segmentation (str): path of a segmentation file (JSON or PageXML), or page name in the store.
+        store_path (str): if not empty, the store's folder.
+
+    Output:
+        dict: a segmentation dictionary.
+    """
+    if not store_path:
+        return seglib.segmentation_dict_from_file( segmentation, as_arrays=True )
+    if store_path not in _stores:
+        _stores[ store_path ] = seglib.SegmentationStore( store_path )
+    return _stores[ store_path ][ segmentation ]
+
+
+def page_metrics( img_path: str, pred_path: str, gt_path: str, mode: str, pred_store: str='', gt_store: str='' ) -> Tuple[np.ndarray, int, int]:
+    """
+    Compute the metrics matrix of a single page.
+
+    Args:
+        img_path (str): path of the page image.
+        pred_path (str): path of the predicted segmentation (JSON or PageXML), or its name in the prediction store.
+        gt_path (str): path of the GT segmentation (JSON or PageXML), or its name in the GT store.
+        mode (str): 'pixel' or 'geometric'.
+        pred_store (str): if not empty, the store the predictions are read from.
+        gt_store (str): if not empty, the store the GT segmentations are read from.
+
+    Output:
+        tuple: a triplet (metrics matrix, predicted line count, GT line count); if either segmentation
+               has no line, the matrix is all zeros (no intersecting pair).
+    """
+    segmentation_dict_pred, segmentation_dict_gt = read_segmentation( pred_path, pred_store ), read_segmentation( gt_path, gt_store )
+    line_count_pred, line_count_gt = len( segmentation_dict_pred['lines'] ), len( segmentation_dict_gt['lines'] )
+    if not line_count_pred or not line_count_gt:
+        return (np.zeros( (line_count_pred, line_count_gt, 4), dtype='float32' ), line_count_pred, line_count_gt)
+    with Image.open( img_path, 'r' ) as img:
+        if mode == 'geometric':
+            # only the page size is needed (read from the file header)
+            metrics = seglib.polygon_geometric_metrics_from_segmentation_dicts( segmentation_dict_pred, segmentation_dict_gt, img.size )
+        else:
+            polygon_chw_pred, polygon_chw_gt = [ seglib.polygon_map_from_img_segmentation_dict( img, d ) for d in (segmentation_dict_pred, segmentation_dict_gt) ]
+            metrics = seglib.polygon_pixel_metrics_from_polygon_maps_and_mask( polygon_chw_pred, polygon_chw_gt, seglib.get_mask( img ))
+    return (metrics, line_count_pred, line_count_gt)
+
+
+def evaluate_page( triplet: Tuple[str, str, str], mode: str, threshold: float, pred_store: str='', gt_store: str='' ) -> Tuple[Tuple[str, str, str], Optional[dict], Optional[str]]:
+    """
+    Evaluate a single page, without letting a failure (missing or unreadable file, ...) escape: the error
+    is returned instead, so that it can be logged while the rest of the corpus goes on.
+
+    Args:
+        triplet (Tuple[str,str,str]): (image, prediction, GT) paths.
+        mode (str): 'pixel' or 'geometric'.
+        threshold (float): precision and recall threshold for a TP match.
+        pred_store (str): if not empty, the store the predictions are read from.
+        gt_store (str): if not empty, the store the GT segmentations are read from.
+
+    Output:
+        tuple: a triplet (input triplet, page record or None, error message or None); the page record stores
+               the table's fields, as well as the raw counts needed for the micro-averaged scores. As on any other
+               page, TP, FP and FN are counted over the intersecting (pred, GT) pairs only: a page with no such pair
+               (e.g. no predicted line at all) has no TP, FP nor FN, and undefined (NaN) scores.
+    """
+    start = time.perf_counter()
+    try:
+        metrics, line_count_pred, line_count_gt = page_metrics( *triplet, mode, pred_store, gt_store )
+        # raw counts: the sums the pixel-based scores are computed from
+        intersecting = metrics[:,:,0] != 0
+        intersection, union = float( np.sum( metrics[:,:,0][ intersecting ] )), float( np.sum( metrics[:,:,1][ intersecting ] ))
+        if np.any( intersecting ):
+            TP, FP, FN, Jaccard, F1 = seglib.polygon_pixel_metrics_to_line_based_scores( metrics, threshold )
+            pixel_iu, matched_pixel_iu = seglib.polygon_pixel_metrics_to_pixel_based_scores( metrics )
+        else:
+            # same rule as seglib.polygon_pixel_metrics_to_line_based_scores(): nothing to count
+            TP, FP, FN, Jaccard, F1 = 0.0, 0.0, 0.0, float('nan'), float('nan')
+            pixel_iu, matched_pixel_iu = float('nan'), float('nan')
+        record = { 'page': triplet[0], 'lines_pred': line_count_pred, 'lines_gt': line_count_gt,
+                   'TP': float(TP), 'FP': float(FP), 'FN': float(FN), 'Jaccard': float(Jaccard), 'F1': float(F1),
+                   'pixel_IU': float(pixel_iu), 'matched_pixel_IU': float(matched_pixel_iu),
+                   'intersection': intersection, 'union': union }
+        record['seconds'] = time.perf_counter() - start
+        return (triplet, record, None)
+    except Exception as e:
+        return (triplet, None, '{}: {}'.format( type(e).__name__, e ))
+
+
+def init_worker( thread_count: int ) -> None:
+    """
+    Pool initializer: each worker limits its own thread count.
+
+    Args:
+        thread_count (int): number of Torch threads for this worker.
+    """
+    torch.set_num_threads( thread_count )
+
+
+class CorpusTotals:
+    """
+    Running totals over the evaluated pages: memory does not depend on the corpus size.
+    """
+    def __init__( self ):
+        self.page_count = 0
+        self.counts = { field: 0.0 for field in COUNT_FIELDS }
+        self.score_sums = { field: 0.0 for field in SCORE_FIELDS }
+        # pages whose score is defined, for each score
+        self.score_counts = { field: 0 for field in SCORE_FIELDS }
+
+    def add( self, record: dict ) -> None:
+        self.page_count += 1
+        for field in COUNT_FIELDS:
+            self.counts[ field ] += record[ field ]
+        for field in SCORE_FIELDS:
+            # undefined scores (no intersecting pair) are left out of the macro averages
+            if not np.isnan( record[ field ] ):
+                self.score_sums[ field ] += record[ field ]
+                self.score_counts[ field ] += 1
+
+    def summary( self ) -> Dict[str, dict]:
+        """
+        Micro-averaged scores (computed from the counts summed over all pages) and macro-averaged
+        scores (mean of the per-page scores, over the pages where they are defined).
+
+        Output:
+            dict: a dictionary with 'pages', 'counts', 'micro' and 'macro' entries.
+        """
+        TP, FP, FN = self.counts['TP'], self.counts['FP'], self.counts['FN']
+        micro = { 'Jaccard': TP / (TP+FP+FN) if TP+FP+FN else float('nan'),
+                  'F1': 2*TP / (2*TP+FP+FN) if TP+FP+FN else float('nan'),
+                  'pixel_IU': self.counts['intersection'] / self.counts['union'] if self.counts['union'] else float('nan') }
+        macro = { field: total / self.score_counts[ field ] if self.score_counts[ field ] else float('nan') for field, total in self.score_sums.items() }
+        return { 'pages': self.page_count, 'counts': dict( self.counts ), 'micro': micro, 'macro': macro }
+
+
+def write_row( output: TextIO, record: dict ) -> None:
+    """
+    Write a page record into the per-page table.
+
+    Args:
+        output (TextIO): the table's output stream.
+        record (dict): a page record, as returned by evaluate_page().
+    """
+    output.write( '\t'.join( str( record[ column ] ) if not isinstance( record[ column ], float ) else '{:.6g}'.format( record[ column ] ) for column in COLUMNS ) + '\n' )
+
+
+if __name__ == "__main__":
+
+    args, _ = fargv.fargv( p )
+
+    output = open( args.output_file, 'w' ) if args.output_file else sys.stdout
+    # totals go wherever the table does not
+    log = sys.stdout if args.output_file else sys.stderr
+
+    output.write( '\t'.join( COLUMNS ) + '\n' )
+
+    totals, failed = CorpusTotals(), []
+    start = time.perf_counter()
+
+    def handle_result( triplet: Tuple[str, str, str], record: Optional[dict], error: Optional[str] ) -> None:
+        if error is not None:
+            print("{}: failed ({})".format( triplet[0], error ), file=sys.stderr)
+            failed.append( triplet[0] )
+            return
+        write_row( output, record )
+        totals.add( record )
+
+    try:
+        if args.workers > 1:
+
+            def collect( futures: Iterable ) -> bool:
+                """ Handle evaluated pages; return True if a worker died (eg. out of memory), which breaks the pool. """
+                broken = False
+                for future in futures:
+                    triplet = in_flight.pop( future )
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        handle_result( triplet, None, 'worker process died ({})'.format( e ))
+                        continue
+                    handle_result( *result )
+                return broken
+
+            def restart_executor() -> None:
+                """ Give up the pages that were in flight in a broken pool, and start a new one. """
+                global executor
+                collect( list( in_flight ))
+                executor.shutdown( wait=True )
+                print("A worker process died: restarting {} workers".format( args.workers ), file=sys.stderr)
+                executor = ProcessPoolExecutor( args.workers, initializer=init_worker, initargs=(thread_count,) )
+
+            # intra-op threads are split among workers
+            thread_count = threads_per_worker( args.threads, args.workers )
+            executor = ProcessPoolExecutor( args.workers, initializer=init_worker, initargs=(thread_count,) )
+            try:
+                # bounded submission: only a few pages are in flight at any time
+                in_flight = {}
+                for triplet in iter_page_triplets( args.page_list ):
+                    if len( in_flight ) >= 2*args.workers:
+                        done, _ = wait( in_flight, return_when=FIRST_COMPLETED )
+                        if collect( done ):
+                            restart_executor()
+                    try:
+                        in_flight[ executor.submit( evaluate_page, triplet, args.mode, args.threshold, args.pred_store, args.gt_store ) ] = triplet
+                    except BrokenProcessPool:
+                        # the pool broke since the last wait
+                        restart_executor()
+                        in_flight[ executor.submit( evaluate_page, triplet, args.mode, args.threshold, args.pred_store, args.gt_store ) ] = triplet
+                collect( list( in_flight ))
+            finally:
+                executor.shutdown( wait=True )
+        else:
+            if args.threads > 0:
+                torch.set_num_threads( args.threads )
+            for triplet in iter_page_triplets( args.page_list ):
+                handle_result( *evaluate_page( triplet, args.mode, args.threshold, args.pred_store, args.gt_store ))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    summary = totals.summary()
+    summary['mode'], summary['threshold'] = args.mode, args.threshold
+
+    print("Evaluated {} pages in {:.2f}s ({:.2f} pages/s)".format( totals.page_count, elapsed, totals.page_count/elapsed if elapsed else float('inf') ), file=log)
+    for averaging in ('micro', 'macro'):
+        print("{}-averaged: {}".format( averaging.capitalize(), ', '.join( '{}={:.4f}'.format( k, v ) for k, v in summary[ averaging ].items() )), file=log)
+
+    if args.summary_file:
+        with open( args.summary_file, 'w' ) as summary_file:
+            json.dump( summary, summary_file, indent=2 )
+
+    if failed:
+        print("{} page(s) could not be evaluated:\n{}".format( len(failed), '\n'.join( failed )), file=sys.stderr)
+        sys.exit(1)
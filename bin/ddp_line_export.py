@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+"""
+Export the line crops of a corpus (typically: as HTR training data) into size-bounded tar shards, instead of
+millions of small image files: pages are processed in a pool of worker processes, and the shards are written
+in input order by the main process.
+
+Input:
+    A list of (image, segmentation) pairs, one per line, tab-separated; the segmentation is either a JSON file
+    (Kraken's segmentation dictionary) or a PageXML file ('.xml').
+
+Output (in the output folder):
+    - shards 'lines-000000.tar', 'lines-000001.tar', ...: for every line, 3 members sharing the same key
+      ('<page #>_<label #>'), namely the line crop ('<key>.img.png'), its polygon mask ('<key>.mask.png', 1 bit)
+      and a metadata record ('<key>.json': line_id, label, bbox (y_min, x_min, y_max, x_max), source page and
+      segmentation file);
+    - 'index.jsonl': one record per completed shard (name, pages, keys, size, and the pages that failed while
+      it was being written);
+    - 'export.json': the export's parameters.
+
+Example call:
+
+    paste <(ls ${FSDB_ROOT}/*/*/*/*.img.jpg) <(ls ${FSDB_ROOT}/*/*/*/*.lines.gt.xml) \\
+        | PYTHONPATH="${DIDIP_ROOT}/apps/ddpa_lines" ${DIDIP_ROOT}/apps/ddpa_lines/bin/ddp_line_export -page_list=- -workers 16 -output_dir htr_lines
+
+Shards are closed on page boundaries, and their content depends only on the input list and on the parameters:
+an interrupted export that is run again (with the same list and parameters) resumes after the last completed
+shard, and yields the same shards as an uninterrupted one. Pages that failed (missing image, unreadable
+segmentation, worker process killed by the page, ...) are not considered exported: a subsequent run retries
+them, and writes their lines into its new shards.
+"""
+
+
+p = {
+        "page_list": ["-", "A file that lists the pages to export, one tab-separated (image, segmentation) pair per line ('-page_list=-' for stdin)"],
+        "output_dir": ["", "The output folder (shards and index)"],
+        "shard_size": [256.0, "Maximum size of a shard, in MB (a single page larger than this makes a shard of its own)"],
+        "compress_level": [1, "PNG compression level of the line crops (0-9: higher is smaller and slower)"],
+        "workers": [1, "Number of worker processes"],
+}
+
+
+import sys
+import fargv
+from pathlib import Path
+from PIL import Image
+import numpy as np
+import io
+import os
+import time
+import json
+import tarfile
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple, Iterator, List
+
+sys.path.append( str( Path(__file__).parents[1] ) )
+
+
+import seglib
+
+
+INDEX_NAME = 'index.jsonl'
+PARAMETERS_NAME = 'export.json'
+SHARD_NAME = 'lines-{:06d}.tar'
+# tar member: header block, then data padded to a whole number of blocks
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+# end of archive: 2 empty blocks, then padding to a whole number of records
+TAR_RECORD_SIZE = tarfile.RECORDSIZE
+
+# a sample: key, and its members' (suffix, content) pairs
+Sample = Tuple[str, List[Tuple[str, bytes]]]
+
+
+def iter_page_pairs( page_list: str ) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the (image, segmentation) pairs lazily, from a list file or from stdin.
+
+    Args:
+        page_list (str): path of the list file ('-' for stdin).
+
+    Output:
+        Iterator[Tuple[str,str]]: (image, segmentation) path pairs.
+    """
+    list_file = sys.stdin if page_list == '-' else open( page_list, 'r' )
+    try:
+        for line in list_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len( fields ) != 2:
+                raise ValueError("Expected a tab-separated (image, segmentation) pair: {}".format( line ))
+            yield tuple( fields )
+    finally:
+        if list_file is not sys.stdin:
+            list_file.close()
+
+
+def encode_png( array: np.ndarray, compress_level: int ) -> bytes:
+    """
+    Encode an array as a PNG image.
+
+    Args:
+        array (np.ndarray): a (H,W,C) or (H,W) array (8-bit integers or booleans).
+        compress_level (int): zlib compression level.
+
+    Output:
+        bytes: the PNG file's content.
+    """
+    buffer = io.BytesIO()
+    Image.fromarray( array ).save( buffer, format='PNG', compress_level=compress_level )
+    return buffer.getvalue()
+
+
+def export_page( page_index: int, img_path: str, segmentation_path: str, compress_level: int ) -> Tuple[int, str, Optional[List[Sample]], Optional[str]]:
+    """
+    Extract and encode the line crops of a single page, without letting a failure escape: the error is
+    returned instead, so that it can be logged while the rest of the corpus goes on.
+
+    Args:
+        page_index (int): rank of the page in the input list (used in the sample keys).
+        img_path (str): path of the page image.
+        segmentation_path (str): path of the segmentation (JSON or PageXML).
+        compress_level (int): PNG compression level of the crops.
+
+    Output:
+        tuple: a quadruplet (page index, image path, samples or None, error message or None); lines that lie out
+               of the page are skipped.
+    """
+    try:
+        segmentation_dict = seglib.segmentation_dict_from_file( segmentation_path, as_arrays=True )
+        samples = []
+        with Image.open( img_path, 'r' ) as img:
+            for label, bbox, crop, mask in seglib.iter_labeled_line_images_from_img_segmentation_dict( img, segmentation_dict ):
+                if crop.size == 0:
+                    continue
+                key = '{:08d}_{:04d}'.format( page_index, label )
+                metadata = { 'key': key, 'line_id': segmentation_dict['lines'][label-1].get('line_id'), 'label': label,
+                             'bbox': [ int(c) for c in bbox ], 'page': img_path, 'segmentation': segmentation_path }
+                samples.append( (key, [ ('img.png', encode_png( crop, compress_level )),
+                                        ('mask.png', encode_png( mask if mask.ndim == 2 else mask[:,:,0], compress_level )),
+                                        ('json', json.dumps( metadata, sort_keys=True ).encode('utf-8')) ]))
+        return (page_index, img_path, samples, None)
+    except Exception as e:
+        return (page_index, img_path, None, '{}: {}'.format( type(e).__name__, e ))
+
+
+def samples_tar_size( samples: List[Sample] ) -> int:
+    """
+    Size that a list of samples takes in a tar file.
+
+    Args:
+        samples (List[Sample]): samples, as returned by export_page().
+
+    Output:
+        int: the size, in bytes.
+    """
+    return sum( TAR_BLOCK_SIZE + -(-len( content ) // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE for _, members in samples for _, content in members )
+
+
+def tar_file_size( members_size: int ) -> int:
+    """
+    Size of a tar file, from the size of its members.
+
+    Args:
+        members_size (int): the members' size (headers and padded data), as computed by samples_tar_size().
+
+    Output:
+        int: the size, in bytes, once the end-of-archive blocks and the padding are written.
+    """
+    return -(-(members_size + 2*TAR_BLOCK_SIZE) // TAR_RECORD_SIZE) * TAR_RECORD_SIZE
+
+
+class ShardWriter:
+    """
+    Write samples into consecutive tar shards: a shard is written into a temporary file, that is renamed
+    and recorded into the index only once complete. Tar headers carry no timestamp nor owner, so that
+    the same samples always yield the same shard.
+    """
+    def __init__( self, output_dir: Path, max_size: int, shard_count: int=0 ):
+        self.output_dir, self.max_size = output_dir, max_size
+        self.shard_count = shard_count
+        self.tar, self.tmp_path = None, None
+        self.size, self.keys, self.pages, self.failed = 0, [], [], []
+
+    def add_page( self, page_index: int, page: str, samples: List[Sample] ) -> None:
+        """
+        Add a page's samples to the current shard, or to a new one if they would not fit.
+
+        Args:
+            page_index (int): rank of the page in the input list.
+            page (str): the page's image path.
+            samples (List[Sample]): the page's samples.
+        """
+        page_size = samples_tar_size( samples )
+        if self.keys and tar_file_size( self.size + page_size ) > self.max_size:
+            self.close_shard()
+        # pages with no lines are recorded in the next non-empty shard
+        if self.tar is None and samples:
+            fd, self.tmp_path = tempfile.mkstemp( dir=self.output_dir, prefix='.', suffix='.tar.tmp' )
+            self.tar = tarfile.open( fileobj=os.fdopen( fd, 'wb' ), mode='w', format=tarfile.USTAR_FORMAT )
+        for key, members in samples:
+            for suffix, content in members:
+                info = tarfile.TarInfo( '{}.{}'.format( key, suffix ))
+                info.size, info.mode = len( content ), 0o644
+                self.tar.addfile( info, io.BytesIO( content ))
+            self.keys.append( key )
+        self.size += page_size
+        self.pages.append( (page_index, page) )
+
+    def add_failed_page( self, page_index: int, page: str ) -> None:
+        """
+        Record a page that could not be exported, in the current shard's record: it is retried by a resumed run.
+
+        Args:
+            page_index (int): rank of the page in the input list.
+            page (str): the page's image path.
+        """
+        self.failed.append( (page_index, page) )
+
+    def close_shard( self ) -> None:
+        """
+        Complete the current shard (if any) and record it into the index.
+        """
+        if self.tar is None:
+            # trailing pages with no lines: nothing to record (they are read again by a resumed run)
+            return
+        tar_file = self.tar.fileobj
+        self.tar.close()
+        tar_file.flush()
+        os.fsync( tar_file.fileno() )
+        tar_file.close()
+        os.chmod( self.tmp_path, 0o644 )
+        shard_name = SHARD_NAME.format( self.shard_count )
+        os.replace( self.tmp_path, self.output_dir.joinpath( shard_name ))
+        last_page = max( self.pages + self.failed )
+        record = { 'shard': shard_name, 'first_page': self.pages[0][0], 'last_page': last_page[0], 'last_page_path': last_page[1],
+                   'pages': [ page_index for page_index, _ in self.pages ], 'failed': [ page_index for page_index, _ in self.failed ],
+                   'samples': len( self.keys ), 'keys': self.keys, 'size': self.output_dir.joinpath( shard_name ).stat().st_size }
+        with open( self.output_dir.joinpath( INDEX_NAME ), 'a' ) as index_file:
+            index_file.write( json.dumps( record ) + '\n' )
+            index_file.flush()
+            os.fsync( index_file.fileno() )
+        self.shard_count += 1
+        self.tar, self.tmp_path = None, None
+        self.size, self.keys, self.pages, self.failed = 0, [], [], []
+
+    def abort( self ) -> None:
+        """
+        Drop the current (incomplete) shard.
+        """
+        if self.tar is not None:
+            self.tar.fileobj.close()
+            os.unlink( self.tmp_path )
+            self.tar = None
+
+
+def load_index( output_dir: Path ) -> List[dict]:
+    """
+    Read the records of the completed shards; a truncated last record (from an interrupted run) is dropped
+    from the index, as well as the temporary files of the shards that were being written.
+
+    Args:
+        output_dir (Path): the output folder.
+
+    Output:
+        List[dict]: shard records, in shard order.
+    """
+    for tmp_path in output_dir.glob('.*.tar.tmp'):
+        tmp_path.unlink()
+    index_path = output_dir.joinpath( INDEX_NAME )
+    if not index_path.exists():
+        return []
+    records, lines = [], []
+    with open( index_path, 'r' ) as index_file:
+        for line in index_file:
+            try:
+                records.append( json.loads( line ))
+                lines.append( line )
+            except ValueError:
+                break
+    if ''.join( lines ) != index_path.read_text():
+        index_path.write_text( ''.join( lines ))
+    return records
+
+
+def pages_to_retry( records: List[dict] ) -> set:
+    """
+    Pages that failed in a previous run, and have not been exported since.
+
+    Args:
+        records (List[dict]): shard records, as returned by load_index().
+
+    Output:
+        set: the ranks of the pages to retry.
+    """
+    exported, failed = set(), set()
+    for record in records:
+        exported.update( record.get('pages', []) )
+        failed.update( record.get('failed', []) )
+    return failed - exported
+
+
+def check_parameters( output_dir: Path, parameters: dict ) -> None:
+    """
+    Record the export's parameters in the output folder, or check them against a previous run's: a
+    resumed export must use the same ones, for its shards to match an uninterrupted export's.
+
+    Args:
+        output_dir (Path): the output folder.
+        parameters (dict): the parameters that determine the shards' content.
+    """
+    parameters_path = output_dir.joinpath( PARAMETERS_NAME )
+    if parameters_path.exists():
+        with open( parameters_path, 'r' ) as parameters_file:
+            previous = json.load( parameters_file )
+        if previous != parameters:
+            raise ValueError("Export parameters {} differ from the previous run's ({}): use another output folder.".format( parameters, previous ))
+        return
+    with open( parameters_path, 'w' ) as parameters_file:
+        json.dump( parameters, parameters_file, indent=2 )
+
+
+if __name__ == "__main__":
+
+    args, _ = fargv.fargv( p )
+
+    if not args.output_dir:
+        print("An output folder is needed (-output_dir)", file=sys.stderr)
+        sys.exit(1)
+    output_dir = Path( args.output_dir )
+    output_dir.mkdir( parents=True, exist_ok=True )
+    check_parameters( output_dir, { 'shard_size': args.shard_size, 'compress_level': args.compress_level } )
+
+    # resume after the last completed shard, and retry the pages that failed before it
+    records = load_index( output_dir )
+    last_record = max( records, key=lambda r: r['last_page'] ) if records else None
+    first_page = last_record['last_page']+1 if records else 0
+    retried_pages = pages_to_retry( records )
+    writer = ShardWriter( output_dir, int( args.shard_size * 2**20 ), len( records ))
+
+    start = time.perf_counter()
+    exported, failed = [], []
+
+    def page_pairs() -> Iterator[Tuple[int, str, str]]:
+        for page_index, (img_path, segmentation_path) in enumerate( iter_page_pairs( args.page_list )):
+            if page_index < first_page:
+                if page_index == first_page-1 and img_path != last_record['last_page_path']:
+                    raise ValueError("Page #{} is not the one recorded in the index ({}): the page list has changed.".format( page_index, img_path ))
+                if page_index not in retried_pages:
+                    continue
+            yield (page_index, img_path, segmentation_path)
+
+    def handle_result( page_index: int, img_path: str, samples: Optional[List[Sample]], error: Optional[str] ) -> None:
+        if error is not None:
+            print("{}: failed ({})".format( img_path, error ), file=sys.stderr)
+            failed.append( img_path )
+            writer.add_failed_page( page_index, img_path )
+            return
+        writer.add_page( page_index, img_path, samples )
+        exported.append( len( samples ))
+
+    def collect_first() -> None:
+        """ Handle the oldest page in flight: results are consumed in input order. """
+        try:
+            result = in_flight[0][1].result()
+        except BrokenProcessPool:
+            restart_executor()
+            return
+        in_flight.popleft()
+        handle_result( *result )
+
+    def restart_executor() -> None:
+        """
+        Start a new pool, in place of a broken one. Any of the pages that were in flight may have killed the worker
+        (eg. out of memory): each of them is exported again, alone in the new pool, and only a page that breaks it
+        again is a failure. Pages completed before the pool broke keep their result.
+        """
+        global executor
+        executor.shutdown( wait=True )
+        executor = ProcessPoolExecutor( args.workers )
+        while in_flight:
+            (page_index, img_path, segmentation_path), future = in_flight.popleft()
+            if future.exception() is None:
+                handle_result( *future.result() )
+                continue
+            try:
+                handle_result( *executor.submit( export_page, page_index, img_path, segmentation_path, args.compress_level ).result() )
+            except BrokenProcessPool as e:
+                handle_result( page_index, img_path, None, 'worker process died ({})'.format( e ))
+                executor.shutdown( wait=True )
+                executor = ProcessPoolExecutor( args.workers )
+
+    try:
+        if args.workers > 1:
+            executor = ProcessPoolExecutor( args.workers )
+            try:
+                # bounded submission: (page, future) pairs
+                in_flight = deque()
+                for page in page_pairs():
+                    if len( in_flight ) >= 2*args.workers:
+                        collect_first()
+                    try:
+                        future = executor.submit( export_page, *page, args.compress_level )
+                    except BrokenProcessPool:
+                        # the pool broke since the last wait
+                        restart_executor()
+                        future = executor.submit( export_page, *page, args.compress_level )
+                    in_flight.append( (page, future) )
+                while in_flight:
+                    collect_first()
+            finally:
+                executor.shutdown( wait=True )
+        else:
+            for page_index, img_path, segmentation_path in page_pairs():
+                handle_result( *export_page( page_index, img_path, segmentation_path, args.compress_level ))
+        writer.close_shard()
+    except BaseException:
+        writer.abort()
+        raise
+
+    elapsed = time.perf_counter() - start
+    sample_count = sum( exported )
+    print("Exported {} lines into {} shard(s) in {:.2f}s ({:.1f} lines/s)".format( sample_count, writer.shard_count, elapsed, sample_count/elapsed if elapsed else float('inf') ), file=sys.stderr)
+
+    if failed:
+        print("{} page(s) could not be exported:\n{}".format( len(failed), '\n'.join( failed )), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+Pack the segmentation files (JSON or PageXML) of a corpus into a single, columnar store, so that evaluation
+or crop-extraction runs read a few memory-mapped arrays instead of re-parsing thousands of small files.
+
+Input:
+    A list of segmentation files, one per line; a line may also be a tab-separated (name, file) pair,
+    where the name is the key the page is stored under (default: the file path itself).
+
+Output:
+    A store folder (see seglib.save_segmentation_store()), to be read with seglib.SegmentationStore.
+
+Example call:
+
+    ls ${FSDB_ROOT}/*/*/*/*.lines.gt.xml \\
+        | PYTHONPATH="${DIDIP_ROOT}/apps/ddpa_lines" ${DIDIP_ROOT}/apps/ddpa_lines/bin/ddp_segpack -file_list=- -workers 16 -output_dir gt.segstore
+
+Since pages are stored under their file path by default, the triplet list fed to ddp_line_eval can be used
+as such with the resulting store (see its -gt_store and -pred_store options).
+"""
+
+
+p = {
+        "file_list": ["-", "A file that lists the segmentation files, one per line ('-file_list=-' for stdin)"],
+        "output_dir": ["", "The store's folder"],
+        "workers": [1, "Number of worker processes (for parsing)"],
+}
+
+
+import sys
+import fargv
+from pathlib import Path
+import time
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Iterable, Tuple, List
+
+sys.path.append( str( Path(__file__).parents[1] ) )
+
+
+import seglib
+
+
+def iter_named_files( file_list: str ) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the (name, file) pairs lazily, from a list file or from stdin.
+
+    Args:
+        file_list (str): path of the list file ('-' for stdin).
+
+    Output:
+        Iterator[Tuple[str,str]]: (page name, segmentation file) pairs.
+    """
+    list_file = sys.stdin if file_list == '-' else open( file_list, 'r' )
+    try:
+        for line in list_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len( fields ) > 2:
+                raise ValueError("Expected a segmentation file or a tab-separated (name, file) pair: {}".format( line ))
+            yield (fields[0], fields[-1])
+    finally:
+        if list_file is not sys.stdin:
+            list_file.close()
+
+
+def parse_named_files( named_files: List[Tuple[str, str]] ) -> List[Tuple[str, dict]]:
+    """
+    Parse a batch of segmentation files.
+
+    Args:
+        named_files (List[Tuple[str,str]]): (page name, segmentation file) pairs.
+
+    Output:
+        List[Tuple[str,dict]]: (page name, segmentation dictionary) pairs, in the same order.
+    """
+    return [ (name, seglib.segmentation_dict_from_file( segmentation_file, as_arrays=True )) for name, segmentation_file in named_files ]
+
+
+def iter_named_pages( named_files: Iterable[Tuple[str, str]], workers: int=1, batch_size: int=8 ) -> Iterator[Tuple[str, dict]]:
+    """
+    Parse the segmentation files lazily, as they are listed, in a pool of worker processes: only a few
+    batches are in flight at any time, and pages come out in the input order.
+
+    Args:
+        named_files (Iterable[Tuple[str,str]]): (page name, segmentation file) pairs.
+        workers (int): number of worker processes (1: files are parsed in the current process).
+        batch_size (int): number of files sent to a worker at a time.
+
+    Output:
+        Iterator[Tuple[str,dict]]: (page name, segmentation dictionary) pairs.
+    """
+    named_files = iter( named_files )
+    batches = iter( lambda: list( itertools.islice( named_files, batch_size )), [] )
+    if workers <= 1:
+        for batch in batches:
+            yield from parse_named_files( batch )
+        return
+    with ProcessPoolExecutor( workers ) as executor:
+        in_flight = deque()
+        for batch in batches:
+            if len( in_flight ) >= 2*workers:
+                yield from in_flight.popleft().result()
+            in_flight.append( executor.submit( parse_named_files, batch ))
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+if __name__ == "__main__":
+
+    args, _ = fargv.fargv( p )
+
+    if not args.output_dir:
+        print("An output folder is needed (-output_dir)", file=sys.stderr)
+        sys.exit(1)
+
+    start = time.perf_counter()
+    page_count = seglib.save_segmentation_store( args.output_dir, iter_named_pages( iter_named_files( args.file_list ), args.workers ))
+
+    print("Packed {} pages into {} in {:.2f}s".format( page_count, args.output_dir, time.perf_counter()-start ), file=sys.stderr)
@@ -12,18 +12,57 @@ from torch import Tensor
 
 import numpy as np
 import numpy.ma as ma
-from typing import List, Tuple, Callable, Optional, Dict, Union, Mapping, Any
+from typing import List, Tuple, Callable, Optional, Dict, Union, Mapping, Any, BinaryIO, Iterable, Iterator
 import itertools
+import struct
+import zlib
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from functools import partial
+import weakref
 
 
 __LABEL_SIZE__=8
 
+# polygon map container (see save_polygon_map()): magic string, then header size
+__POLYGON_MAP_MAGIC__=b'DDPPMAP\x01'
+__POLYGON_MAP_PREAMBLE__=struct.Struct('<8sI')
+# uncompressed containers: the dense block starts on a page boundary, for memory-mapping
+__POLYGON_MAP_ALIGNMENT__=4096
+
+# disk cache (see enable_cache()): bump the version whenever a cached computation changes
+__CACHE_VERSION__='1'
+
+# segmentation store (see save_segmentation_store())
+__SEGMENTATION_STORE_VERSION__=1
+__SEGMENTATION_STORE_POINT_FILES__={ 'baseline': 'baselines.npy', 'boundary': 'boundaries.npy' }
+
+# binarization results kept in memory (see get_mask())
+__MASK_CACHE_SIZE__=8
+
 """
 Functions for segmentation output management
 
 + storing polygons on tensors (from dictionaries or pageXML outputs)
 + computing IoU and F1 scores over GT/predicted label maps
 
+A polygon map comes in two forms:
+
++ dense: a 4-channel (4,H,W) tensor of unsigned bytes, where each pixel stores up to 4 labels
++ sparse: a dictionary that stores, for each label, its bounding box and a cropped array of channel
+  codes (see polygon_map_to_sparse()); it converts losslessly from and to the dense form, while
+  its size and the work it takes scale with the polygons' area, not the page's.
+
+On disk, a polygon map is best stored in a compressed container (see save_polygon_map()), from
+which single labels can be read; maps pickled as tensors (.pt) remain readable.
+
+The functions that read their input from files (*_from_img_json_files(), *_from_img_xml_files())
+can store their polygon maps, masks and label statistics in an opt-in disk cache (see enable_cache()),
+so that evaluating several models against the same GT does not rasterize it again.
+
 A note about types:
 
 + PageXML or JSON: initial input (typically: from segmentation framework) 
@@ -47,7 +86,8 @@ def polygon_map_from_img_json_files(  img: str, segmentation_json: str) -> Tenso
         Tensor: the polygons rendered as a 4-channel image (a tensor).
     """
     with Image.open(img, 'r') as img_wh, open( segmentation_json, 'r' ) as json_file:
-        return polygon_map_from_img_segmentation_dict( img_wh, json.load( json_file ))
+        segmentation_dict = json.load( json_file )
+        return cached_computation( 'polygon_map', img, segmentation_dict, lambda: polygon_map_from_img_segmentation_dict( img_wh, segmentation_dict ))
 
 
 def polygon_map_from_img_xml_files( img: str, page_xml: str ) -> Tensor:
@@ -64,8 +104,8 @@ def polygon_map_from_img_xml_files( img: str, page_xml: str ) -> Tensor:
     """
 
     with Image.open( img ) as input_img:
-        segmentation_dict = segmentation_dict_from_xml( page_xml )
-        return polygon_map_from_img_segmentation_dict( input_img, segmentation_dict)
+        segmentation_dict = segmentation_dict_from_xml( page_xml, as_arrays=True )
+        return cached_computation( 'polygon_map', img, segmentation_dict, lambda: polygon_map_from_img_segmentation_dict( input_img, segmentation_dict))
 
 
 def polygon_map_from_img_segmentation_dict( img_wh: Image.Image, segmentation_dict: dict ) -> Tensor:
@@ -93,12 +133,13 @@ def polygon_map_from_img_segmentation_dict( img_wh: Image.Image, segmentation_di
     # (fillPoly() only accepts signed integers - risk of overflow is non-existent)
     mask_size = img_wh.size[::-1]
     label_map = np.zeros( mask_size, dtype='int32' )
+    # labels stored so far (duplicate checks without scanning the map)
+    label_index = np.zeros( 256, dtype='bool' )
 
-    # rendering polygons
+    # rendering polygons (each of them within its own bounding box)
     for lbl, polyg in enumerate( polygon_boundaries ):
-        points = np.array(polyg)[:,::-1] # x <-> y
-        polyg_mask = ski.draw.polygon2mask( mask_size, points )
-        apply_polygon_mask_to_map( label_map, polyg_mask, lbl+1 )
+        window, polyg_mask = polygon_bbox_mask( polyg, mask_size )
+        apply_polygon_mask_to_map( label_map[ window ], polyg_mask, lbl+1, label_index, (window[0].start, window[1].start) )
 
     #Image.fromarray( label_map ).show()
 
@@ -122,7 +163,8 @@ def line_binary_mask_from_img_json_files(img: str, segmentation_json: str ) -> T
         Tensor: a flat boolean tensor with size (H,W)
     """
     with Image.open(img, 'r') as img_wh, open( segmentation_json, 'r' ) as json_file:
-        return line_binary_mask_from_img_segmentation_dict( img_wh, json.load( json_file ))
+        segmentation_dict = json.load( json_file )
+        return cached_computation( 'line_mask', img, segmentation_dict, lambda: line_binary_mask_from_img_segmentation_dict( img_wh, segmentation_dict ))
 
 def line_binary_mask_from_img_xml_files(img: str, page_xml: str ) -> Tensor:
     """
@@ -137,8 +179,8 @@ def line_binary_mask_from_img_xml_files(img: str, page_xml: str ) -> Tensor:
         Tensor: a flat boolean tensor with size (H,W)
     """
     with Image.open(img, 'r') as img_wh:
-        segmentation_dict = segmentation_dict_from_xml( page_xml )
-        return line_binary_mask_from_img_segmentation_dict( img_wh, segmentation_dict )
+        segmentation_dict = segmentation_dict_from_xml( page_xml, as_arrays=True )
+        return cached_computation( 'line_mask', img, segmentation_dict, lambda: line_binary_mask_from_img_segmentation_dict( img_wh, segmentation_dict ))
 
 
 def line_binary_mask_from_img_segmentation_dict(img_wh: Image.Image, segmentation_dict: dict ) -> Tensor:
@@ -162,11 +204,10 @@ def line_binary_mask_from_img_segmentation_dict(img_wh: Image.Image, segmentatio
     mask_size = img_wh.size[::-1]
     page_mask_hw = np.zeros( mask_size, dtype='bool')
 
-    # rendering polygons
+    # rendering polygons (each of them within its own bounding box)
     for lbl, polyg in enumerate( polygon_boundaries ):
-        points = np.array( polyg )[:,::-1]
-        polyg_mask = ski.draw.polygon2mask( mask_size, points )
-        page_mask_hw += polyg_mask
+        window, polyg_mask = polygon_bbox_mask( polyg, mask_size )
+        page_mask_hw[ window ] |= polyg_mask
 
     return torch.tensor( page_mask_hw )
 
@@ -184,7 +225,7 @@ def line_images_from_img_xml_files(img: str, page_xml: str ) -> List[Tuple]:
         list: a list of pairs (<line image BB>: np.ndarray, mask: np.ndarray)
     """
     with Image.open(img, 'r') as img_wh:
-        segmentation_dict = segmentation_dict_from_xml( page_xml )
+        segmentation_dict = segmentation_dict_from_xml( page_xml, as_arrays=True )
         return line_images_from_img_segmentation_dict( img_wh, segmentation_dict )
 
 
@@ -205,69 +246,254 @@ def line_images_from_img_json_files( img: str, segmentation_json: str ) -> List[
 
 def line_images_from_img_segmentation_dict(img_wh: Image.Image, segmentation_dict: dict ) -> List[Tuple]:
     """
-    From a segmentation dictionary describing polygons, return a boolean mask where any pixel belonging
-    to a polygon is 1 and the other pixels 0.
+    From a segmentation dictionary describing polygons, return a list of pairs (<line cropped BB>, <polygon mask>).
+    Each polygon is rasterized within its own bounding box, clipped to the page: memory needed for a line
+    does not depend on the page's size, and polygons that extend past the page edges yield the part of the
+    line that lies within the page (an empty crop if the polygon lies out of the page).
 
     Args:
-        img_whc (Image.Image): the input image (needed for the size information).
+        img_whc (Image.Image): the input image.
         segmentation_dict (dict): a dictionary, typically constructed from a JSON file.
 
     Output:
-        list: a list of pairs (<line image BB>: np.ndarray, mask: np.ndarray)
+        list: a list of pairs (<line image BB>: np.ndarray, mask: np.ndarray); crops are copies of their box only
+              (no page-sized array is built); masks are boolean, with as many channels as the image.
     """
     polygon_boundaries = [ line['boundary'] for line in segmentation_dict['lines'] ]
-    img_hwc = np.asarray( img_wh )
 
     pairs_line_bb_and_mask = []# [None] * len(polygon_boundaries)
 
     for lbl, polyg in enumerate( polygon_boundaries ):
 
-        # polygon's points ( x <-> y )
-        points = np.array( polyg )[:,::-1]
-        page_polyg_mask = ski.draw.polygon2mask( img_hwc.shape, points ) # np.ndarray (H,W,C)
-        y_min, x_min, y_max, x_max = np.min( points[:,0] ), np.min( points[:,1] ), np.max( points[:,0] ), np.max( points[:,1] )
+        # polygon rendered within its bounding box only
+        window, polyg_mask = polygon_bbox_mask( polyg, img_wh.size[::-1] )
         # crop both img and mask
-        line_bbox = img_hwc[y_min:y_max+1, x_min:x_max+1]
+        line_bbox = image_window( img_wh, window )
         # note: mask has as many channels as the original image
-        bb_label_mask = page_polyg_mask[y_min:y_max+1, x_min:x_max+1]
+        bb_label_mask = np.repeat( polyg_mask[:,:,None], line_bbox.shape[2], axis=2 ) if line_bbox.ndim == 3 else polyg_mask
 
         #pairs_line_bb_and_mask[lbl]=( line_bbox, bb_label_mask )
         pairs_line_bb_and_mask.append( (line_bbox, bb_label_mask) )
 
     return pairs_line_bb_and_mask
 
-def line_images_from_img_polygon_map(img_wh: Image.Image, polygon_map_chw: Tensor) -> List[Tuple]:
+def line_images_from_img_polygon_map(img_wh: Image.Image, polygon_map_chw: Union[Tensor, dict]) -> List[Tuple]:
     """
-    From a tensor storing polygons, return a boolean mask where any pixel belonging
-    to a polygon is 1 and the other pixels 0.
+    From a tensor storing polygons, return a list of pairs (<line cropped BB>, <polygon mask>), one for each
+    label present in the map, in label order. A dense map is read in a single pass (see polygon_map_to_sparse()),
+    that yields every label's bounding box and pixels at once.
 
     Args:
-        img_whc (Image.Image): the input image (needed for the size information).
+        img_whc (Image.Image): the input image.
+        polygon_map_chw (Union[Tensor,dict]): a 4-channel polygon map, or a sparse map.
+
+    Output:
+        list: a list of pairs (<line image BB>: np.ndarray, mask: np.ndarray); crops are copies of their box only
+              (no page-sized array is built); masks are boolean, with 3 channels (whatever the image's).
+    """
+    sparse_map = polygon_map_to_sparse( polygon_map_chw )
+
+    pairs_line_bb_and_mask = []
+
+    for lbl in sorted( sparse_map['labels'] ):
+        entry = sparse_map['labels'][ lbl ]
+        line_bbox = image_window( img_wh, sparse_label_window( entry ))
+        label_mask = entry['channels'] != 0
+        bb_label_mask = np.repeat( label_mask[:,:,None], 3, axis=2 )
+        pairs_line_bb_and_mask.append( (line_bbox, bb_label_mask) )
+
+    return pairs_line_bb_and_mask
+
+
+def iter_labeled_line_images_from_img_xml_files( img: str, page_xml: str, labels: Optional[Iterable[int]]=None ) -> Iterator[Tuple[int, Tuple[int,int,int,int], np.ndarray, np.ndarray]]:
+    """
+    Lazy, labeled variant of line_images_from_img_xml_files(): see iter_labeled_line_images_from_img_segmentation_dict().
+
+    Args:
+        img (str): the input image's file path
+        page_xml (str): a Page XML file describing the lines.
+        labels (Iterable[int]): if provided, the labels (1-based line indices) of the lines to extract.
+
+    Output:
+        Iterator[tuple]: quadruplets (label, (y_min, x_min, y_max, x_max), <line image BB>: np.ndarray, mask: np.ndarray)
+    """
+    segmentation_dict = segmentation_dict_from_xml( page_xml, as_arrays=True )
+    with Image.open(img, 'r') as img_wh:
+        yield from iter_labeled_line_images_from_img_segmentation_dict( img_wh, segmentation_dict, labels )
+
+
+def iter_labeled_line_images_from_img_json_files( img: str, segmentation_json: str, labels: Optional[Iterable[int]]=None ) -> Iterator[Tuple[int, Tuple[int,int,int,int], np.ndarray, np.ndarray]]:
+    """
+    Lazy, labeled variant of line_images_from_img_json_files(): see iter_labeled_line_images_from_img_segmentation_dict().
+
+    Args:
+        img (str): the input image's file path
+        segmentation_json (str): path of a JSON file
+        labels (Iterable[int]): if provided, the labels (1-based line indices) of the lines to extract.
+
+    Output:
+        Iterator[tuple]: quadruplets (label, (y_min, x_min, y_max, x_max), <line image BB>: np.ndarray, mask: np.ndarray)
+    """
+    with open( segmentation_json, 'r' ) as json_file:
+        segmentation_dict = json.load( json_file )
+    with Image.open(img, 'r') as img_wh:
+        yield from iter_labeled_line_images_from_img_segmentation_dict( img_wh, segmentation_dict, labels )
+
+
+def iter_labeled_line_images_from_img_segmentation_dict( img_wh: Image.Image, segmentation_dict: dict, labels: Optional[Iterable[int]]=None ) -> Iterator[Tuple[int, Tuple[int,int,int,int], np.ndarray, np.ndarray]]:
+    """
+    Lazy, labeled variant of line_images_from_img_segmentation_dict(): lines are cropped and rasterized one at a time,
+    as they are consumed. Unlike the list function, that returns (crop, mask) pairs, each item carries the line's
+    label and bounding box as well: (label, bbox, crop, mask). Each crop is a copy of its box only (no page-sized array is built), so that a line's
+    buffers are released as soon as the consumer is done with it.
+
+    Args:
+        img_wh (Image.Image): the input image.
         segmentation_dict (dict): a dictionary, typically constructed from a JSON file.
+        labels (Iterable[int]): if provided, the labels (1-based line indices) of the lines to extract;
+                                labels with no matching line are ignored.
 
     Output:
-        list: a list of pairs (<line image BB>: np.ndarray, mask: np.ndarray)
+        Iterator[tuple]: quadruplets (label, (y_min, x_min, y_max, x_max), <line image BB>: np.ndarray, mask: np.ndarray),
+                         in label order; a line that lies out of the page has an empty crop.
     """
+    lines = segmentation_dict['lines']
+    selected_labels = range(1, len(lines)+1) if labels is None else sorted( set( labels ).intersection( range(1, len(lines)+1) ))
 
-    max_label = torch.max( polygon_map_chw )
-    img_hwc = np.array( img_wh )
+    for lbl in selected_labels:
+        window, polyg_mask = polygon_bbox_mask( lines[lbl-1]['boundary'], img_wh.size[::-1] )
+        line_bbox = image_window( img_wh, window )
+        bb_label_mask = np.repeat( polyg_mask[:,:,None], line_bbox.shape[2], axis=2 ) if line_bbox.ndim == 3 else polyg_mask
+        yield (lbl, (window[0].start, window[1].start, window[0].stop-1, window[1].stop-1), line_bbox, bb_label_mask)
 
-    pairs_line_bb_and_mask = []# [None] * max_label
 
-    for lbl in range(1, max_label+1 ):
-        page_label_mask_hw = retrieve_polygon_mask_from_map( polygon_map_chw, lbl )
+def iter_labeled_line_images_from_img_polygon_map( img_wh: Image.Image, polygon_map_chw: Union[Tensor, dict], labels: Optional[Iterable[int]]=None ) -> Iterator[Tuple[int, Tuple[int,int,int,int], np.ndarray, np.ndarray]]:
+    """
+    Lazy, labeled variant of line_images_from_img_polygon_map(): lines are cropped one at a time, as they are consumed,
+    each crop being a copy of its box only. Unlike the list function, that returns (crop, mask) pairs, each item
+    is a (label, bbox, crop, mask) quadruplet.
 
-        # BB of non-zero pixels
-        non_zero_ys, non_zero_xs = page_label_mask_hw.numpy().nonzero()
-        y_min, x_min, y_max, x_max = np.min(non_zero_ys), np.min(non_zero_xs), np.max(non_zero_ys), np.max(non_zero_xs)
-        line_bbox = img_hwc[y_min:y_max+1, x_min:x_max+1]
+    Args:
+        img_wh (Image.Image): the input image.
+        polygon_map_chw (Union[Tensor,dict]): a 4-channel polygon map, or a sparse map.
+        labels (Iterable[int]): if provided, the labels of the lines to extract; labels that are not
+                                in the map are ignored.
 
-        bb_label_mask = expand_flat_tensor_to_n_channels(page_label_mask_hw[y_min:y_max+1, x_min:x_max+1], 3)
+    Output:
+        Iterator[tuple]: quadruplets (label, (y_min, x_min, y_max, x_max), <line image BB>: np.ndarray, mask: np.ndarray),
+                         in label order.
+    """
+    sparse_map = polygon_map_to_sparse( polygon_map_chw )
+    selected_labels = sorted( sparse_map['labels'] ) if labels is None else sorted( set( labels ).intersection( sparse_map['labels'] ))
 
-        #pairs_line_bb_and_mask[ lbl-1 ]=(line_bbox, bb_label_mask) 
-        pairs_line_bb_and_mask.append( (line_bbox, bb_label_mask) )
+    for lbl in selected_labels:
+        entry = sparse_map['labels'][ lbl ]
+        line_bbox = image_window( img_wh, sparse_label_window( entry ))
+        label_mask = entry['channels'] != 0
+        bb_label_mask = np.repeat( label_mask[:,:,None], 3, axis=2 )
+        yield (lbl, tuple( entry['bbox'] ), line_bbox, bb_label_mask)
+
+
+def image_window( img_wh: Image.Image, window: Tuple[slice, slice] ) -> np.ndarray:
+    """
+    Crop a window out of an image, as an array: the same as np.asarray( img_wh )[ window ], without
+    converting the whole page.
+
+    Args:
+        img_wh (Image.Image): an image.
+        window (Tuple[slice,slice]): a pair of (row, col) slices, within the image's boundaries.
+
+    Output:
+        np.ndarray: a (H',W',C) array (or (H',W') for single-channel images).
+    """
+    rows, cols = window
+    return np.asarray( img_wh.crop( (cols.start, rows.start, cols.stop, rows.stop) ))
 
-    return pairs_line_bb_and_mask
+
+def polygon_bbox_mask( polygon: Union[List[List[int]], np.ndarray], map_shape: Tuple[int, int] ) -> Tuple[Tuple[slice, slice], np.ndarray]:
+    """
+    Rasterize a polygon within its bounding box (clipped to the map's boundaries) only, instead of
+    allocating a page-sized mask for every polygon: the result is the same as with
+    ski.draw.polygon2mask( map_shape, points ), cropped to the window.
+
+    Args:
+        polygon (Union[list, np.ndarray]): a sequence of (x,y) points.
+        map_shape (Tuple[int,int]): the (H,W) shape of the target map.
+
+    Output:
+        tuple: a pair (window, mask), where window is a pair of (row, col) slices over the map and
+               mask is a boolean array with the window's shape (empty if the polygon lies out of the map).
+    """
+    points = np.asarray( polygon )
+    xs, ys = points[:,0], points[:,1]
+    y_min, x_min = max(0, int(np.floor( np.min(ys) ))), max(0, int(np.floor( np.min(xs) )))
+    y_max, x_max = min(map_shape[0]-1, int(np.ceil( np.max(ys) ))), min(map_shape[1]-1, int(np.ceil( np.max(xs) )))
+    if y_min > y_max or x_min > x_max:
+        return ((slice(0,0), slice(0,0)), np.zeros((0,0), dtype='bool'))
+
+    bbox_shape = (y_max-y_min+1, x_max-x_min+1)
+    window = (slice(y_min, y_max+1), slice(x_min, x_max+1))
+    # integer vertices (the usual case): exact scanline fill
+    if np.issubdtype( points.dtype, np.integer ):
+        return (window, integer_polygon_mask( xs-x_min, ys-y_min, bbox_shape ))
+    # same point-in-polygon test as on the full page, with the coordinates shifted to the window
+    rows, cols = ski.draw.polygon( ys-y_min, xs-x_min, bbox_shape )
+    mask = np.zeros( bbox_shape, dtype='bool' )
+    mask[ rows, cols ] = True
+
+    return (window, mask)
+
+
+def integer_polygon_mask( xs: np.ndarray, ys: np.ndarray, shape: Tuple[int, int] ) -> np.ndarray:
+    """
+    Rasterize a polygon with integer vertices, with the same result as ski.draw.polygon() (pixels on the
+    boundary included), but row by row: instead of testing every pixel against every edge, the crossings of
+    each row with the edges are computed once, and the pixels' parities are read from their running count.
+    skimage's test casts two rays from each pixel (rightward and leftward): a pixel is kept if either ray
+    crosses the boundary an odd number of times, or if it is a vertex. With integer vertices, the crossing
+    abscissas are rationals whose floor and ceiling are computed exactly.
+
+    Args:
+        xs (np.ndarray): the vertices' x-coordinates (integers, possibly out of the map).
+        ys (np.ndarray): the vertices' y-coordinates (integers, possibly out of the map).
+        shape (Tuple[int,int]): the (H,W) shape of the mask.
+
+    Output:
+        np.ndarray: a (H,W) boolean mask.
+    """
+    height, width = shape
+    xs, ys = np.asarray( xs, dtype='int64' ), np.asarray( ys, dtype='int64' )
+    # edge i goes from vertex i-1 to vertex i
+    xs_prev, ys_prev = np.roll( xs, 1 ), np.roll( ys, 1 )
+    y_low, y_high = np.minimum( ys, ys_prev ), np.maximum( ys, ys_prev )
+
+    parities = []
+    # rightward ray crosses edges over rows [y_low, y_high), leftward ray over rows (y_low, y_high]
+    for rightward, first_rows, last_rows in ((True, y_low, y_high-1), (False, y_low+1, y_high)):
+        first_rows, last_rows = np.maximum( first_rows, 0 ), np.minimum( last_rows, height-1 )
+        spans = np.where( y_low < y_high, np.maximum( last_rows-first_rows+1, 0 ), 0 )
+        # one (edge, row) pair for every row that an edge crosses
+        edges = np.repeat( np.arange( len(xs) ), spans )
+        rows = np.repeat( first_rows - np.cumsum( spans ) + spans, spans ) + np.arange( spans.sum() )
+        # crossing abscissa num/den, with den > 0
+        y0, y1 = ys[ edges ]-rows, ys_prev[ edges ]-rows
+        num, den = xs[ edges ]*y1 - xs_prev[ edges ]*y0, y1-y0
+        num, den = np.where( den < 0, -num, num ), np.abs( den )
+        # rightward: pixels x < ceil(num/den) see the crossing; leftward: pixels x >= floor(num/den)+1
+        bounds = np.clip( -(-num // den) if rightward else num // den + 1, 0, width )
+        positions, counts = np.unique( rows*(width+1)+bounds, return_counts=True )
+        toggles = np.zeros( height*(width+1), dtype='uint8' )
+        toggles[ positions ] = counts & 1
+        toggles = toggles.reshape( height, width+1 )
+        if rightward:
+            parities.append( np.bitwise_xor.accumulate( toggles[:,::-1], axis=1 )[:,::-1][:,1:] )
+        else:
+            parities.append( np.bitwise_xor.accumulate( toggles, axis=1 )[:,:width] )
+
+    mask = (parities[0] | parities[1]).astype('bool')
+    on_map = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    mask[ ys[ on_map ], xs[ on_map ] ] = True
+    return mask
 
 
 def expand_flat_tensor_to_n_channels( t_hw: Tensor, n: int ) -> np.ndarray:
@@ -287,61 +513,271 @@ def expand_flat_tensor_to_n_channels( t_hw: Tensor, n: int ) -> np.ndarray:
     t_hwc = t_hw.reshape( t_hw.shape+(1,)).expand(-1,-1,n)
     return t_hwc.numpy()
 
-def segmentation_dict_from_xml(page: str) -> Dict[str,Union[str,List[Any]]]:
+def segmentation_dict_from_xml(page: str, as_arrays: bool=False) -> Dict[str,Union[str,List[Any]]]:
     """
     Given a pageXML file name, return a JSON dictionary describing the lines.
 
+    The file is parsed incrementally: lines are extracted as soon as they are read and then dropped from
+    the tree, so that memory does not grow with the page's size. Any version of the PAGE schema is accepted
+    (elements are matched by local name, whatever their namespace).
+
     Args:
         page (str): path of a PageXML file
+        as_arrays (bool): if True, points are stored as (N,2) integer arrays, instead of lists of [x,y]
+            pairs (faster to build and to rasterize, but not JSON-serializable).
 
     Output:
         dict: a dictionary of the form
 
-        {"text_direction": ..., "type": "baselines", "lines": [{"tags": ..., "baseline": [ ... ]}]}
+        {"text_direction": ..., "type": "baselines", "lines": [{"line_id": ..., "baseline": [[x1,y1], ...], "boundary": [[x1,y1], ...]}]}
 
     """
     direction = {'0.0': 'horizontal-lr', '0.1': 'horizontal-rl', '1.0': 'vertical-td', '1.1': 'vertical-bu'}
 
     page_dict: Dict[str, Union['str', List[Any]]] = { 'type': 'baselines' }
 
-    with open( page, 'r' ) as page_file:
-        page_tree = ET.parse( page_file )
-        ns = { 'pc': "http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15"}
-        page_root = page_tree.getroot()
-
-
-        textRegionElement = page_root.find('.//pc:TextRegion', ns) 
-        if textRegionElement is not None:
-            orientation = textRegionElement.get( 'orientation' )
-            if orientation is not None:
-                page_dict['text_direction'] = direction[ orientation ]
-
-        lines_object = []
-        for line in page_root.findall('.//pc:TextLine', ns):
-            line_id = line.get('id')
-            baseline_elt = line.find('./pc:Baseline', ns)
-            if baseline_elt is None:
-                continue
-            bl_points = baseline_elt.get('points')
-            if bl_points is None:
-                continue
-            baseline_points = [ [ int(p) for p in pt.split(',') ] for pt in bl_points.split(' ') ]
-            coord_elt = line.find('./pc:Coords', ns)
-            if coord_elt is None:
-                continue
-            c_points = coord_elt.get('points')
-            if c_points is None:
-                continue
-            polygon_points = [ [ int(p) for p in pt.split(',') ] for pt in c_points.split(' ') ]
-
-            lines_object.append( {'line_id': line_id, 'baseline': baseline_points, 'boundary': polygon_points} )
-
-        page_dict['lines'] = lines_object
+    lines_object = []
+    # open elements: the last one is the parent of the element being closed
+    element_stack = []
+    region_seen = False
+    for event, elt in ET.iterparse( page, events=('start', 'end') ):
+        if event == 'start':
+            element_stack.append( elt )
+            # text direction: from the first region only
+            if not region_seen and _xml_local_name( elt.tag ) == 'TextRegion':
+                region_seen = True
+                orientation = elt.get( 'orientation' )
+                if orientation is not None:
+                    page_dict['text_direction'] = direction[ orientation ]
+            continue
+
+        element_stack.pop()
+        local_name = _xml_local_name( elt.tag )
+        if local_name == 'TextLine':
+            line_dict = _line_dict_from_xml_element( elt, as_arrays )
+            if line_dict is not None:
+                lines_object.append( line_dict )
+        # lines and regions are not needed anymore once read
+        if local_name in ('TextLine', 'TextRegion') and element_stack:
+            element_stack[-1].remove( elt )
+
+    page_dict['lines'] = lines_object
 
     return page_dict 
 
 
-def apply_polygon_mask_to_map(label_map: np.ndarray, polygon_mask: np.ndarray, label: int) -> None:
+def segmentation_dicts_from_xml_files( pages: Iterable[str], workers: int=1, chunksize: int=8, as_arrays: bool=False ) -> Iterator[Dict[str,Union[str,List[Any]]]]:
+    """
+    Parse many PageXML files, in a pool of worker processes.
+
+    Args:
+        pages (Iterable[str]): paths of PageXML files.
+        workers (int): number of worker processes (1: files are parsed in the current process).
+        chunksize (int): number of files sent to a worker at a time.
+        as_arrays (bool): if True, points are stored as arrays (see segmentation_dict_from_xml()).
+
+    Output:
+        Iterator[dict]: segmentation dictionaries (see segmentation_dict_from_xml()), in the same order as the input files.
+    """
+    parse = partial( segmentation_dict_from_xml, as_arrays=as_arrays )
+    if workers <= 1:
+        yield from map( parse, pages )
+        return
+    with ProcessPoolExecutor( workers ) as executor:
+        yield from executor.map( parse, pages, chunksize=chunksize )
+
+
+def _xml_local_name( tag: str ) -> str:
+    """
+    Strip the namespace from an element's tag.
+
+    Args:
+        tag (str): a tag, of the form '{namespace}name' or 'name'.
+
+    Output:
+        str: the local name.
+    """
+    return tag.rpartition('}')[2]
+
+
+def _line_dict_from_xml_element( line: ET.Element, as_arrays: bool=False ) -> Optional[Dict[str, Any]]:
+    """
+    Read the id, baseline and boundary of a PageXML TextLine element.
+
+    Args:
+        line (ET.Element): a TextLine element.
+        as_arrays (bool): if True, points are returned as (N,2) arrays; otherwise, as lists of [x,y] pairs.
+
+    Output:
+        dict: a line dictionary, or None if the line lacks a baseline or a boundary.
+    """
+    baseline_points, polygon_points = None, None
+    for child in line:
+        local_name = _xml_local_name( child.tag )
+        if local_name == 'Baseline' and baseline_points is None:
+            baseline_points = child.get('points')
+        elif local_name == 'Coords' and polygon_points is None:
+            polygon_points = child.get('points')
+    if baseline_points is None or polygon_points is None:
+        return None
+    baseline, boundary = points_to_array( baseline_points ), points_to_array( polygon_points )
+    if not as_arrays:
+        baseline, boundary = baseline.tolist(), boundary.tolist()
+    return { 'line_id': line.get('id'), 'baseline': baseline, 'boundary': boundary }
+
+
+def points_to_array( points: str ) -> np.ndarray:
+    """
+    Convert a PageXML 'points' attribute into an array of coordinates (parsed directly by Numpy).
+
+    Args:
+        points (str): a sequence of space-separated 'x,y' pairs.
+
+    Output:
+        np.ndarray: a (N,2) array of 32-bit integers.
+    """
+    coordinates = np.fromstring( points.replace(',', ' '), dtype='int32', sep=' ' )
+    # each pair has exactly one comma
+    if coordinates.size != 2*points.count(','):
+        raise ValueError("Malformed points attribute: '{}'".format( points ))
+    return coordinates.reshape(-1, 2)
+
+
+def segmentation_dict_from_file( segmentation_file: str, as_arrays: bool=False ) -> Dict[str,Union[str,List[Any]]]:
+    """
+    Read a segmentation dictionary from a JSON or a PageXML file, depending on the file's suffix.
+
+    Args:
+        segmentation_file (str): path of a JSON file or of a PageXML file ('.xml').
+        as_arrays (bool): if True, the points of a PageXML file are stored as arrays (see segmentation_dict_from_xml()).
+
+    Output:
+        dict: a segmentation dictionary (see polygon_map_from_img_segmentation_dict()).
+    """
+    if Path( segmentation_file ).suffix.lower() == '.xml':
+        return segmentation_dict_from_xml( segmentation_file, as_arrays )
+    with open( segmentation_file, 'r' ) as json_file:
+        return json.load( json_file )
+
+
+def save_segmentation_store( store_path: Union[str, Path], pages: Iterable[Tuple[str, dict]] ) -> int:
+    """
+    Pack the segmentation dictionaries of a corpus into a single, columnar store: a folder with
+
+    + 'baselines.npy', 'boundaries.npy': all points (flat (N,2) arrays of 32-bit integers);
+    + 'baseline_offsets.npy', 'boundary_offsets.npy': index of each line's first point (plus the total);
+    + 'line_offsets.npy': index of each page's first line (plus the total);
+    + 'store.json': page names and attributes ('type', 'text_direction'), line ids.
+
+    Other line attributes (tags, ...) are not stored. Fractional coordinates are rounded to the nearest
+    integer. The metadata are written last: an interrupted run leaves no readable store.
+
+    Args:
+        store_path (Union[str,Path]): the store's folder (created if needed).
+        pages (Iterable[Tuple[str,dict]]): pairs (page name, segmentation dictionary); names must be unique.
+
+    Output:
+        int: the number of pages stored.
+    """
+    store_path = Path( store_path )
+    store_path.mkdir( parents=True, exist_ok=True )
+
+    points = { 'baseline': [], 'boundary': [] }
+    point_counts = { 'baseline': [0], 'boundary': [0] }
+    line_counts, page_entries, line_ids = [0], [], []
+    for name, segmentation_dict in pages:
+        page_entries.append( { 'name': name, **{ k: segmentation_dict[k] for k in ('type', 'text_direction') if k in segmentation_dict } } )
+        for line in segmentation_dict['lines']:
+            line_ids.append( line.get('line_id') )
+            for kind in ('baseline', 'boundary'):
+                line_points = np.asarray( line.get( kind, [] )).reshape(-1, 2)
+                if line_points.dtype.kind == 'f':
+                    # rounded, not truncated
+                    line_points = np.rint( line_points )
+                line_points = line_points.astype('int32')
+                points[ kind ].append( line_points )
+                point_counts[ kind ].append( len( line_points ))
+        line_counts.append( len( segmentation_dict['lines'] ))
+
+    if len( set( p['name'] for p in page_entries )) != len( page_entries ):
+        raise ValueError("Page names in a segmentation store must be unique.")
+
+    for kind in ('baseline', 'boundary'):
+        np.save( store_path.joinpath( __SEGMENTATION_STORE_POINT_FILES__[ kind ] ), np.concatenate( points[ kind ] ) if points[ kind ] else np.zeros((0,2), dtype='int32') )
+        np.save( store_path.joinpath( kind + '_offsets.npy' ), np.cumsum( point_counts[ kind ], dtype='int64' ))
+    np.save( store_path.joinpath( 'line_offsets.npy' ), np.cumsum( line_counts, dtype='int64' ))
+    with open( store_path.joinpath( 'store.json' ), 'w' ) as metadata_file:
+        json.dump( { 'version': __SEGMENTATION_STORE_VERSION__, 'pages': page_entries, 'line_ids': line_ids }, metadata_file )
+
+    return len( page_entries )
+
+
+def is_segmentation_store( store_path: Union[str, Path] ) -> bool:
+    """
+    Check whether a path is a segmentation store (see save_segmentation_store()).
+
+    Args:
+        store_path (Union[str,Path]): a path.
+
+    Output:
+        bool: True if the path is a folder with the store's metadata file.
+    """
+    return Path( store_path ).joinpath( 'store.json' ).is_file()
+
+
+class SegmentationStore:
+    """
+    Random access to the pages of a segmentation store (see save_segmentation_store()). Pages
+    are returned as segmentation dictionaries whose points are views over the (memory-mapped)
+    arrays: they can be passed as such to the rasterization and metrics functions.
+    """
+    def __init__( self, store_path: Union[str, Path], mmap: bool=True ):
+        """
+        Args:
+            store_path (Union[str,Path]): the store's folder.
+            mmap (bool): if True (default), map the point arrays instead of reading them.
+        """
+        store_path = Path( store_path )
+        with open( store_path.joinpath( 'store.json' ), 'r' ) as metadata_file:
+            metadata = json.load( metadata_file )
+        if metadata['version'] != __SEGMENTATION_STORE_VERSION__:
+            raise ValueError("Unsupported segmentation store version: {}".format( metadata['version'] ))
+        self.pages, self.line_ids = metadata['pages'], metadata['line_ids']
+        self._page_index = { p['name']: i for i, p in enumerate( self.pages ) }
+        mmap_mode = 'r' if mmap else None
+        self._points = { kind: np.load( store_path.joinpath( __SEGMENTATION_STORE_POINT_FILES__[ kind ] ), mmap_mode=mmap_mode ) for kind in ('baseline', 'boundary') }
+        self._point_offsets = { kind: np.load( store_path.joinpath( kind + '_offsets.npy' )) for kind in ('baseline', 'boundary') }
+        self._line_offsets = np.load( store_path.joinpath( 'line_offsets.npy' ))
+
+    def __len__( self ) -> int:
+        return len( self.pages )
+
+    def __contains__( self, name: str ) -> bool:
+        return name in self._page_index
+
+    def __iter__( self ) -> Iterator[dict]:
+        return ( self[i] for i in range( len( self )))
+
+    def page_names( self ) -> List[str]:
+        return [ p['name'] for p in self.pages ]
+
+    def __getitem__( self, page: Union[int, str] ) -> dict:
+        """
+        Args:
+            page (Union[int,str]): the page's index or name.
+
+        Output:
+            dict: a segmentation dictionary, with (N,2) arrays as baselines and boundaries.
+        """
+        index = self._page_index[ page ] if isinstance( page, str ) else range( len( self ))[ page ]
+        page_dict = { k: v for k, v in self.pages[ index ].items() if k != 'name' }
+        page_dict['lines'] = [ { 'line_id': self.line_ids[ l ],
+                                 **{ kind: self._points[ kind ][ self._point_offsets[ kind ][l]:self._point_offsets[ kind ][l+1] ] for kind in ('baseline', 'boundary') } }
+                               for l in range( self._line_offsets[ index ], self._line_offsets[ index+1 ] ) ]
+        return page_dict
+
+
+def apply_polygon_mask_to_map(label_map: np.ndarray, polygon_mask: np.ndarray, label: int, label_index: Optional[np.ndarray]=None, origin: Tuple[int,int]=(0,0)) -> None:
     """
     In the segmentation map, label pixels matching a given polygon. Up to 4 labels
     can be stored on a single pixel. A label cannot be applied twice to the same 
@@ -355,6 +791,12 @@ def apply_polygon_mask_to_map(label_map: np.ndarray, polygon_mask: np.ndarray, l
                      Ex. #1. Applying label 4 on a pixel that already stores label 2 yields
                              2 << 8 + 4 = 0x204 = 8192
                      Ex. #2. Pixel 0x10403 stores labels [1, 4, 3]
+        label_index (np.ndarray): a 256-entry boolean array that tells which labels the map already
+                     stores (see array_label_index()); if provided, it is checked and updated instead
+                     of scanning the map for duplicates, which allows for passing a window of the map
+                     (the polygon's bounding box) instead of the whole map.
+        origin (Tuple[int,int]): when label_map is a window of a larger map, the (row, col) position
+                     of the window in that map, so that the positions reported in errors are page coordinates.
     """
     label_limit = 0xff
     max_three_polygon_label = 0xffffff
@@ -366,7 +808,7 @@ def apply_polygon_mask_to_map(label_map: np.ndarray, polygon_mask: np.ndarray, l
         raise OverflowError('Overflow: label value ({}) exceeds the limit ({}).'.format( label, label_limit ))
 
     # Handling duplicated labels:
-    if array_has_label(label_map, label):
+    if (label_index[ label ] if label_index is not None else array_has_label(label_map, label)):
         raise ValueError("The label map already contains a label with value ({})".format(label))
 
     # for every pixel in intersection...
@@ -375,7 +817,7 @@ def apply_polygon_mask_to_map(label_map: np.ndarray, polygon_mask: np.ndarray, l
     if np.any( label_map[ intersection_boolean_mask ] > max_three_polygon_label ):
         maxed_out_pixels = np.transpose(((label_map * intersection_boolean_mask) > max_three_polygon_label).nonzero())
         raise ValueError('Cannot store more than 4 polygons on the same pixel! Following positions maxed out: {}{}'.format(
-            repr([ (row,col) for (row,col) in maxed_out_pixels ][:5]),
+            repr([ (int(row)+origin[0], int(col)+origin[1]) for (row,col) in maxed_out_pixels ][:5]),
             ' ...' if len(maxed_out_pixels)>5 else ''))
     # ... shift it
     label_map[ intersection_boolean_mask ] <<= 8
@@ -383,6 +825,9 @@ def apply_polygon_mask_to_map(label_map: np.ndarray, polygon_mask: np.ndarray, l
     # only then add label to all pixels matching the polygon
     label_map += polygon_mask.astype( label_map.dtype ) * label
 
+    if label_index is not None:
+        label_index[ label ] = True
+
 
 def array_to_rgba_uint8( img_hw: np.ndarray ) -> Tensor:
     """
@@ -403,217 +848,1126 @@ def array_to_rgba_uint8( img_hw: np.ndarray ) -> Tensor:
     return img_chw
 
 
-def polygon_pixel_metrics_from_img_segmentation_dict(img: Image.Image, segmentation_dict_pred: dict, segmentation_dict_gt: dict, binary_mask: Optional[Tensor]=None) -> np.ndarray:
+def is_sparse_polygon_map( polygon_map: Union[Tensor, dict] ) -> bool:
     """
-    Compute a IoU matrix from an image and two dictionaries describing the segmentation's output (line polygons).
+    Tell a sparse polygon map from a dense one.
 
     Args:
-        img (Image.Image): the input page, needed for the size information and the binarization mask.
-        segmentation_dict_pred (dict): a dictionary, typically constructed from a JSON file.
-        segmentation_dict_gt (dict): a dictionary, typically constructed from a JSON file.
+        polygon_map (Union[Tensor,dict]): a dense (4-channel tensor) or sparse (dictionary) polygon map.
 
     Output:
-        np.ndarray: a 2D array, representing IoU values for each possible pair of polygons.
+        bool: True if the map is a sparse map.
     """
-    #polygon_img_gt: Tensor, polygon_img_pred: Tensor, mask: Tensor) -> Tensor:
-    polygon_chw_pred, polygon_chw_gt = [ polygon_map_from_img_segmentation_dict( img, d ) for d in (segmentation_dict_pred, segmentation_dict_gt) ]
+    return isinstance( polygon_map, dict ) and 'labels' in polygon_map and 'shape' in polygon_map
 
-    binary_mask = get_mask( img )
 
-    return polygon_pixel_metrics_from_polygon_maps_and_mask( polygon_chw_pred, polygon_chw_gt, binary_mask )
+def polygon_map_to_sparse( polygon_map_chw: Union[Tensor, dict] ) -> dict:
+    """
+    Convert a dense polygon map into a sparse one, in a single pass over the map. For each label,
+    the sparse map stores the bounding box and a cropped array of channel codes, where 0 means
+    'not covered' and c>0 means that the label is stored on channel c-1 of the dense map (which
+    makes the conversion lossless).
 
+    Args:
+        polygon_map_chw (Tensor): a 4-channel tensor of unsigned 8-bit integers (a sparse map is returned as it is).
+
+    Output:
+        dict: a dictionary of the form::
 
-def get_mask( img_whc: Image.Image, thresholding_alg: Callable=ski.filters.threshold_otsu ) -> Tensor:
+            { 'shape': (H, W),
+              'labels': { <label>: { 'bbox': (y_min, x_min, y_max, x_max), 'channels': <np.ndarray (h,w), uint8> },
+                          ... }}
     """
-    Compute a binary mask from an image, using the given thresholding algorithm: FG=1s, BG=0s
+    if is_sparse_polygon_map( polygon_map_chw ):
+        return polygon_map_chw
+    if len(polygon_map_chw.shape) != 3 or polygon_map_chw.shape[0] != 4 or polygon_map_chw.dtype is not torch.uint8:
+        raise TypeError("Wrong type: polygon map should be a 4-channel tensor of unsigned 8-bit integers.")
+
+    map_chw = polygon_map_chw.numpy()
+    height, width = map_chw.shape[1:]
+
+    # all non-zero positions, grouped by label (a stable radix sort, for bytes)
+    flat_positions = np.flatnonzero( map_chw )
+    labels = map_chw.reshape(-1)[ flat_positions ]
+    order = np.argsort( labels, kind='stable' )
+    flat_positions, labels = flat_positions[ order ], labels[ order ]
+    unique_labels, starts = np.unique( labels, return_index=True )
+    ends = np.append( starts[1:], len(labels) )
+
+    sparse_labels = {}
+    for lbl, start, end in zip( unique_labels, starts, ends ):
+        channels, pixels = np.divmod( flat_positions[start:end], height*width )
+        ys, xs = np.divmod( pixels, width )
+        y_min, x_min, y_max, x_max = int(np.min(ys)), int(np.min(xs)), int(np.max(ys)), int(np.max(xs))
+        channel_codes = np.zeros( (y_max-y_min+1, x_max-x_min+1), dtype='uint8' )
+        channel_codes[ ys-y_min, xs-x_min ] = channels+1
+        sparse_labels[ int(lbl) ] = { 'bbox': (y_min, x_min, y_max, x_max), 'channels': channel_codes }
+
+    return { 'shape': (int(height), int(width)), 'labels': sparse_labels }
+
+
+def sparse_to_polygon_map( sparse_map: dict ) -> Tensor:
+    """
+    Convert a sparse polygon map back into a dense, 4-channel map.
 
     Args:
-        img (PIL image): input image
+        sparse_map (dict): a sparse map, as built by polygon_map_to_sparse().
 
     Output:
-        Tensor: a binary map with FG pixels=1 and BG=0.
+        Tensor: a 4-channel (c,h,w) tensor of unsigned 8-bit integers.
     """
-    img_hwc= np.array( img_whc )
-    threshold = thresholding_alg( ski.color.rgb2gray( img_hwc ) if img_hwc.shape[2]>1 else img_hwc )*255
-    img_bin_hw = torch.tensor( (img_hwc < threshold)[:,:,0], dtype=torch.bool )
+    map_chw = np.zeros( (4,)+tuple(sparse_map['shape']), dtype='uint8' )
+    for lbl, entry in sparse_map['labels'].items():
+        y_min, x_min = entry['bbox'][:2]
+        ys, xs = entry['channels'].nonzero()
+        map_chw[ entry['channels'][ys, xs]-1, ys+y_min, xs+x_min ] = lbl
+    return torch.from_numpy( map_chw )
 
-    return img_bin_hw
 
-
-def polygon_pixel_metrics_from_polygon_maps_and_mask(polygon_chw_pred: Tensor, polygon_chw_gt: Tensor, binary_hw_mask: Optional[Tensor]=None, label_distance=0) -> np.ndarray:
+def sparse_label_window( entry: dict ) -> Tuple[slice, slice]:
     """
-    Compute pixel-based metrics from two tensors that each encode (potentially overlapping) polygons
-    and a FG mask.
+    Page window covered by a label of a sparse map.
 
     Args:
-        polygon_chw_gt (Tensor): a 4-channel image, where each position may store up to 3 overlapping labels
-                                 (one for each channel)
-        polygon_chw_pred (Tensor): a 4-channel image, where each position may store up to 3 overlapping labels
-                                   (one for each channel)
-        binary_hw_mask (Tensor): a boolean mask that selects the input image's FG pixel
+        entry (dict): a label entry of a sparse map.
 
     Output:
-        np.ndarray: metrics (intersection, union, precision, recall, f1) values for each possible pair of labels
-                    (i,j) with i ∈  map1 and j ∈ map2. Shared pixels in each map (i.e. overlapping polygons) have
-                    their weight decreased according to the number of polygons they vote for.
+        tuple: a pair of (row, col) slices.
     """
+    y_min, x_min, y_max, x_max = entry['bbox']
+    return (slice(y_min, y_max+1), slice(x_min, x_max+1))
 
-    if binary_hw_mask is None:
-        binary_hw_mask = torch.full( polygon_chw_gt.shape[1:], 1, dtype=torch.bool )
-    if binary_hw_mask.shape != polygon_chw_gt.shape[1:]:
-        raise TypeError("Wrong type: binary mask should have shape {}".format(polygon_chw_gt.shape[1:]))
 
-    if len(polygon_chw_gt.shape) != 3 or polygon_chw_gt.shape[0] != 4 or polygon_chw_gt.dtype is not torch.uint8:
-        raise TypeError("Wrong type: polygon GT map should be a 4-channel tensor of unsigned 8-bit integers.")
-    if len(polygon_chw_pred.shape) != 3 or polygon_chw_pred.shape[0] != 4 or polygon_chw_pred.dtype is not torch.uint8:
-        raise TypeError("Wrong type: polygon predicted map should be a 4-channel tensor of unsigned 8-bit integers.")
-    if polygon_chw_gt.shape != polygon_chw_pred.shape:
-        raise TypeError("Wrong type: both maps should have the same shape (instead: {} and {}).".format( polygon_chw_gt.shape, polygon_chw_pred.shape ))
+def bbox_intersection( bbox_1: Tuple[int,int,int,int], bbox_2: Tuple[int,int,int,int] ) -> Optional[Tuple[int,int,int,int]]:
+    """
+    Intersection of two bounding boxes.
 
-    polygon_chw_fg_pred, polygon_chw_fg_gt = [ polygon_img * binary_hw_mask for polygon_img in (polygon_chw_pred, polygon_chw_gt) ]
-    
-    metrics = polygon_pixel_metrics_two_maps( polygon_chw_fg_pred, polygon_chw_fg_gt, label_distance )
+    Args:
+        bbox_1 (tuple): a (y_min, x_min, y_max, x_max) box (inclusive bounds).
+        bbox_2 (tuple): a (y_min, x_min, y_max, x_max) box (inclusive bounds).
 
-    return metrics
+    Output:
+        tuple: the (y_min, x_min, y_max, x_max) intersection, or None if the boxes do not overlap.
+    """
+    y_min, x_min = max( bbox_1[0], bbox_2[0] ), max( bbox_1[1], bbox_2[1] )
+    y_max, x_max = min( bbox_1[2], bbox_2[2] ), min( bbox_1[3], bbox_2[3] )
+    if y_min > y_max or x_min > x_max:
+        return None
+    return (y_min, x_min, y_max, x_max)
 
-def retrieve_polygon_mask_from_map( label_map_chw: Tensor, label: int) -> Tensor:
+
+def bbox_relative_window( bbox: Tuple[int,int,int,int], reference_bbox: Tuple[int,int,int,int] ) -> Tuple[slice, slice]:
     """
-    From a label map (that may have compound pixels representing polygon intersections),
-    compute a binary mask that covers _all_ pixels for the label, whether they belong to an
-    intersection or not.
+    Window of a box, expressed in the coordinates of a (larger) reference box.
 
     Args:
-        label_map_chw (Tensor): a 4-channel tensor, where each pixel can store up to 4 labels.
-        label (int): the label to be selected.
+        bbox (tuple): a (y_min, x_min, y_max, x_max) box, included in the reference box.
+        reference_bbox (tuple): a (y_min, x_min, y_max, x_max) box.
 
     Output:
-        Tensor: a flat, boolean mask for the polygon of choice.
+        tuple: a pair of (row, col) slices.
     """
-    if len(label_map_chw.shape) != 3 and label_map_chw.shape[0] != 4:
-        raise TypeError("Wrong type: label map should be a 4-channel tensor (shape={} instead).".format( label_map_chw.shape ))
-    polygon_mask_hw = torch.sum( label_map_chw==label, dim=0).type(torch.bool)
-
-    return polygon_mask_hw
+    return (slice( bbox[0]-reference_bbox[0], bbox[2]-reference_bbox[0]+1 ),
+            slice( bbox[1]-reference_bbox[1], bbox[3]-reference_bbox[1]+1 ))
 
 
-def array_has_label( label_map_hw: np.ndarray, label: int ) -> bool:
+def candidate_label_pairs( bboxes_1: Dict[int, Tuple[int,int,int,int]], bboxes_2: Optional[Dict[int, Tuple[int,int,int,int]]]=None ) -> List[Tuple[int,int]]:
     """
-    From a flat label map (as generated from a segmentation dictionary) where each pixel can store up to 3 values,
-    test whether a given polygon has been stored already.
+    Find the pairs of labels whose bounding boxes overlap, with a sweep along the y axis: boxes are
+    visited by increasing top coordinate, and each box is only compared with the boxes of the other
+    set that are still 'open' (i.e. that extend below its top). For a page of text lines, that are
+    stacked vertically, this is close to linear in the number of lines, whatever their numbering.
 
     Args:
-            label_map_hw (np.ndarray): a 2D map, where each 32-bit integer store up to 4 labels.
-            label (int): the label to be checked for.
+        bboxes_1 (dict): a dictionary of (y_min, x_min, y_max, x_max) boxes (inclusive bounds), indexed by label.
+        bboxes_2 (dict): another dictionary of boxes; if None, look for overlapping pairs within the first set.
+
     Output:
-            bool: True if map already stores the given label; False otherwise.
+        List[Tuple[int,int]]: the pairs (l1, l2) of labels whose boxes overlap, with l1 from the first set and
+                              l2 from the second (or l1 < l2, within a single set), in no particular order.
     """
-    if len(label_map_hw.shape) > 2:
-        raise TypeError("Map should be a flat map of integers.")
+    single_set = bboxes_2 is None
+    boxes = [ (bbox[0], 0, lbl, bbox) for lbl, bbox in bboxes_1.items() ]
+    if not single_set:
+        boxes += [ (bbox[0], 1, lbl, bbox) for lbl, bbox in bboxes_2.items() ]
+    boxes.sort( key=lambda b: (b[0], b[1]) )
+
+    open_boxes, pairs = ([], []), []
+    for y_min, side, lbl, bbox in boxes:
+        other_side = side if single_set else 1-side
+        # boxes that end above the current top cannot overlap any of the boxes to come
+        open_boxes[ other_side ][:] = [ (l, b) for (l, b) in open_boxes[ other_side ] if b[2] >= y_min ]
+        for other_lbl, other_bbox in open_boxes[ other_side ]:
+            if other_bbox[1] <= bbox[3] and bbox[1] <= other_bbox[3]:
+                if single_set:
+                    pairs.append( (min(lbl, other_lbl), max(lbl, other_lbl)) )
+                else:
+                    pairs.append( (lbl, other_lbl) if side == 0 else (other_lbl, lbl) )
+        open_boxes[ side ].append( (lbl, bbox) )
+    return pairs
+
+
+def sparse_polygon_map_apply_mask( sparse_map: dict, binary_hw_mask: Tensor ) -> dict:
+    """
+    Restrict a sparse polygon map to the pixels of a (FG) mask; labels that do not cover any
+    FG pixel are dropped. Channel codes are kept as they are, as for a dense map multiplied
+    by the mask.
 
-    label_cube_chw = np.moveaxis(label_map_hw.view('uint8').reshape(label_map_hw.shape+(-1,)), 2, 0)
-    return bool(np.any( label_cube_chw == label ))
+    Args:
+        sparse_map (dict): a sparse polygon map.
+        binary_hw_mask (Tensor): a flat boolean mask, with the same (H,W) shape as the map.
 
+    Output:
+        dict: a new sparse polygon map.
+    """
+    mask_hw = binary_hw_mask.numpy() if isinstance( binary_hw_mask, Tensor ) else np.asarray( binary_hw_mask )
+    masked_labels = {}
+    for lbl, entry in sparse_map['labels'].items():
+        channel_codes = entry['channels'] * mask_hw[ sparse_label_window( entry ) ]
+        if np.any( channel_codes ):
+            masked_labels[ lbl ] = { 'bbox': entry['bbox'], 'channels': channel_codes }
+    return { 'shape': sparse_map['shape'], 'labels': masked_labels }
 
 
-def polygon_pixel_metrics_two_maps( map_chw_1: Tensor, map_chw_2: Tensor, label_distance=5) -> np.ndarray:
+def sparse_polygon_map_depths( sparse_map: dict ) -> Dict[int, np.ndarray]:
     """
-    Provided two label maps that each encode (potentially overlapping) polygons, compute
-    for each possible pair of labels (i_pred, j_gt) with i ∈  map1 and j ∈  map2.
-    + intersection and union counts
-    + precision and recall
-
-    Shared pixels in each map (i.e. overlapping polygons) have their weight decreased according
-    to the number of polygons they vote for. 
+    For each label of a sparse map, compute the depth (i.e. how many polygons intersect) of the
+    pixels it covers, within its bounding box. Since the label stored first on a pixel has been
+    shifted to the highest channel, the depth of a pixel is the largest channel code among the
+    labels that cover it: only labels with overlapping boxes need to be compared.
 
     Args:
-        map_chw_1 (Tensor): the predicted map, i.e. a 4-channel map with labeled polygons, with potential overlaps.
-        map_hw_2 (Tensor): the GT map, i.e. a 4-channel map with labeled polygons, with potential overlaps.
+        sparse_map (dict): a sparse polygon map.
 
     Output:
-        np.ndarray: a 4 channel array, where each cell [i,j] stores respectively intersection and union counts,
-                    as well as precision and recall for a pair of labels [i,j].
+        dict: for each label, an array of depths with the shape of the label's box (0 where not covered).
     """
-    min_label_1, max_label_1 = int(torch.min( map_chw_1[ map_chw_1 > 0 ] ).item()), int(torch.max( map_chw_1 ).item())
-    min_label_2, max_label_2 = int(torch.min( map_chw_2[ map_chw_2 > 0 ] ).item()), int(torch.max( map_chw_2 ).item())
-    label2index_1 = { l:i for i,l in enumerate( range(min_label_1, max_label_1+1)) }
-    label2index_2 = { l:i for i,l in enumerate( range(min_label_2, max_label_2+1)) }
-
-    # 4 channels for the intersection and union counts, and the precision and recall scores, respectively
-    metrics_hwc = np.zeros(( max_label_1-min_label_1+1, max_label_2-min_label_2+1, 4), dtype='float32')
+    entries = sparse_map['labels']
+    depths = { lbl: entry['channels'].copy() for lbl, entry in entries.items() }
+    for lbl_1, lbl_2 in candidate_label_pairs( { lbl: entry['bbox'] for lbl, entry in entries.items() } ):
+        bbox_1, bbox_2 = entries[lbl_1]['bbox'], entries[lbl_2]['bbox']
+        overlap = bbox_intersection( bbox_1, bbox_2 )
+        window_1, window_2 = bbox_relative_window( overlap, bbox_1 ), bbox_relative_window( overlap, bbox_2 )
+        codes_1, codes_2 = entries[lbl_1]['channels'][ window_1 ], entries[lbl_2]['channels'][ window_2 ]
+        both = (codes_1 != 0) & (codes_2 != 0)
+        np.maximum( depths[lbl_1][ window_1 ], codes_2 * both, out=depths[lbl_1][ window_1 ] )
+        np.maximum( depths[lbl_2][ window_2 ], codes_1 * both, out=depths[lbl_2][ window_2 ] )
+    return depths
+
+
+def polygon_map_label_statistics( polygon_map: Union[Tensor, dict] ) -> Dict[int, dict]:
+    """
+    Per-label statistics of a polygon map: bounding box, pixel count and depth-weighted pixel count
+    (where a pixel shared by m polygons weighs 1/m, as in the metrics).
 
-    label_range_1, label_range_2 = range(min_label_1, max_label_1+1), range(min_label_2, max_label_2+1)
-    
-    # Factor out some computations
-    label_matrices_1={ l:retrieve_polygon_mask_from_map( map_chw_1, l) for l in label_range_1 }
-    label_matrices_2={ l:retrieve_polygon_mask_from_map( map_chw_2, l) for l in label_range_2 }
-    depth_1, depth_2 = map_to_depth( map_chw_1 ), map_to_depth( map_chw_2 )
-    max_depth = torch.max( depth_1, depth_2 ) # for each pixel, keep the largest depth value of the two maps
-    label_counts_1={ l:torch.sum(label_matrices_1[l]/depth_1).item() for l in label_range_1 }
-    label_counts_2={ l:torch.sum(label_matrices_2[l]/depth_2).item() for l in label_range_2 }
-
-    for lbl1, lbl2 in itertools.product(label_range_1, label_range_2):
-        # assume that labels beyond a given distance do not intersect
-        if label_distance > 0 and abs(lbl1-lbl2) > label_distance:
-            metrics_hwc[label2index_1[lbl1], label2index_2[lbl2]]=[ 0, label_counts_1[lbl1] + label_counts_2[lbl2], 0, 0 ]
-            continue
-        # Idea:
-        # + the intersection of a label 1 of depth m (where m = # of polygons that intersect on the pixel) with label 2
-        # of depth n has weight 1/max(m, n)
-        # + the union of a label-1 pixel of depth m with label-2 pixel of depth n has weight (1/m + 1/n)
-
-        # 1. Compute intersection boolean matrix
-        #print("1. Compute intersection boolean matrix, depth1 and depth2")
-        label_1_matrix, label_2_matrix = label_matrices_1[ lbl1 ], label_matrices_2[ lbl2 ]
-        intersection_mask = label_1_matrix * label_2_matrix
-
-        # 2. Compute the weighted intersection count of the two maps
-        #print("3. For each pixel, keep the largest depth value of the two maps")
-        intersection_count = torch.sum( intersection_mask / max_depth ).item()
-
-        # 3. Compute cardinalities |label 1| and |label 2| in map 1 and map 2, respectively
-        #print('4. Compute cardinalities |label 1| and |label 2| in map 1 and map 2, respectively')
-        label_1_count, label_2_count = label_counts_1[lbl1], label_counts_2[lbl2]
-
-        # 4. union = |label 1| + |label 2| - |label 1 ∩ label 2|
-        #print('5. union = |label 1| + |label 2| - |label 1 ∩ label 2|')
-        union_count = label_1_count + label_2_count - intersection_count
+    Args:
+        polygon_map (Union[Tensor,dict]): a dense (4-channel tensor) or sparse polygon map.
 
-        # 5. P = |label 1 ∩ label 2| / | label 2 |; R = |label 1 ∩ label 2| / | label 1 |
-        #print('6. P = |label 1 ∩ label 2| / | label 2 |; R = |label 1 ∩ label 2| / | label 1 |')
-        if label_1_count != 0:
-            # rows (label_1) assumed to be predictions
-            precision = intersection_count / label_1_count
-        if label_2_count != 0:
-            # cols (label_2) assumed to be GT
-            recall = intersection_count / label_2_count
+    Output:
+        dict: for each label, a dictionary with 'bbox', 'pixel_count', and 'weighted_count' entries.
+    """
+    sparse_map = polygon_map_to_sparse( polygon_map )
+    depths = sparse_polygon_map_depths( sparse_map )
+    statistics = {}
+    for lbl, entry in sparse_map['labels'].items():
+        covered = entry['channels'] != 0
+        statistics[ lbl ] = { 'bbox': tuple( entry['bbox'] ),
+                              'pixel_count': int( np.count_nonzero( covered )),
+                              'weighted_count': float( np.sum( 1.0/depths[lbl][ covered ] )) }
+    return statistics
+
+
+def label_statistics_from_img_json_files( img: str, segmentation_json: str ) -> Dict[int, dict]:
+    """
+    Per-label statistics (see polygon_map_label_statistics()) of the polygons described in a JSON file.
 
-        metrics_hwc[label2index_1[lbl1], label2index_2[lbl2]]=[ intersection_count, union_count, precision, recall ]
+    Args:
+        img (str): the input image's file path
+        segmentation_json (str): path of a JSON file
 
-    return metrics_hwc
+    Output:
+        dict: for each label, a dictionary with 'bbox', 'pixel_count', and 'weighted_count' entries.
+    """
+    with open( segmentation_json, 'r' ) as json_file:
+        segmentation_dict = json.load( json_file )
+    return cached_computation( 'label_statistics', img, segmentation_dict, lambda: polygon_map_label_statistics( polygon_map_from_img_json_files( img, segmentation_json )))
 
 
-def map_to_depth(map_chw: Tensor) -> Tensor:
+def label_statistics_from_img_xml_files( img: str, page_xml: str ) -> Dict[int, dict]:
     """
-    Compute depth of each pixel in the input map, i.e. how many polygons intersect on this pixel.
-    Note: 0-valued pixels have depth 1.
+    Per-label statistics (see polygon_map_label_statistics()) of the polygons described in a PageXML file.
 
     Args:
-        map_chw (Tensor): the input tensor (4 channels)
+        img (str): the input image's file path
+        page_xml (str): path of a PageXML file.
 
     Output:
-        Tensor: a tensor of integers, where each value represents the
-                number of intersecting polygons for the same position
-                in the input map.
+        dict: for each label, a dictionary with 'bbox', 'pixel_count', and 'weighted_count' entries.
     """
-    depth_map = torch.sum( map_chw != 0, dim=0)
-    depth_map[ depth_map == 0 ]=1
-
-    return depth_map
+    segmentation_dict = segmentation_dict_from_xml( page_xml, as_arrays=True )
+    return cached_computation( 'label_statistics', img, segmentation_dict, lambda: polygon_map_label_statistics( polygon_map_from_img_xml_files( img, page_xml )))
 
 
-def polygon_pixel_metrics_to_line_based_scores( metrics: np.ndarray, threshold: float=.5 ) -> Tuple[float, float, float, float, float]:
+def save_polygon_map( polygon_map: Union[Tensor, dict], file_path: Union[str, Path, BinaryIO], compression_level: int=6, compressed: bool=True ) -> None:
     """
-    Implement ICDAR 2017 evaluation metrics, as described in
+    Store a polygon map into a compact container file, laid out as follows:
+
+    + a preamble: 8-byte magic string and the header size (unsigned 32-bit integer, little-endian)
+    + a JSON header, with the map's shape, its label count and, for each label, its bounding box
+      as well as the offset and the size of its chunk
+    + one zlib-compressed chunk per label, that stores the label's cropped channel codes (see
+      polygon_map_to_sparse()), so that a single line can be read without decompressing the page.
+
+    An uncompressed container stores instead the dense (4,H,W) map as a single block, that starts
+    on a page boundary: such a file can be memory-mapped (see load_polygon_map()).
+
+    Args:
+        polygon_map (Union[Tensor,dict]): a dense (4-channel tensor) or sparse polygon map.
+        file_path (Union[str,Path,BinaryIO]): output file path (by convention: with a '.pmap' suffix), or a file object open for binary writing.
+        compression_level (int): zlib compression level (0-9).
+        compressed (bool): if False, store the dense map, uncompressed.
+    """
+    sparse_map = polygon_map_to_sparse( polygon_map )
+
+    chunks, label_index, offset = [], [], 0
+    for lbl in sorted( sparse_map['labels'] ):
+        entry = sparse_map['labels'][ lbl ]
+        if not compressed:
+            label_index.append( { 'label': lbl, 'bbox': list( entry['bbox'] ) })
+            continue
+        chunk = zlib.compress( np.ascontiguousarray( entry['channels'] ).tobytes(), compression_level )
+        label_index.append( { 'label': lbl, 'bbox': list( entry['bbox'] ), 'offset': offset, 'size': len(chunk) })
+        chunks.append( chunk )
+        offset += len(chunk)
+
+    header = json.dumps( { 'version': 1,
+                           'shape': list( sparse_map['shape'] ),
+                           'label_count': len( label_index ),
+                           'compression': 'zlib' if compressed else 'none',
+                           'labels': label_index } ).encode('utf-8')
+
+    if not compressed:
+        dense_map_chw = sparse_to_polygon_map( sparse_map ) if is_sparse_polygon_map( polygon_map ) else polygon_map
+        padding = -(__POLYGON_MAP_PREAMBLE__.size + len(header)) % __POLYGON_MAP_ALIGNMENT__
+        chunks = [ bytes( padding ), np.ascontiguousarray( dense_map_chw.numpy() ).tobytes() ]
+
+    if hasattr( file_path, 'write' ):
+        _write_polygon_map_file( file_path, header, chunks )
+        return
+    with open( file_path, 'wb' ) as map_file:
+        _write_polygon_map_file( map_file, header, chunks )
+
+
+def _write_polygon_map_file( map_file: BinaryIO, header: bytes, chunks: List[bytes] ) -> None:
+    """
+    Write the parts of a polygon map container.
+
+    Args:
+        map_file (BinaryIO): a file object, open for binary writing.
+        header (bytes): the encoded JSON header.
+        chunks (List[bytes]): the label chunks, in the order of the header's index.
+    """
+    map_file.write( __POLYGON_MAP_PREAMBLE__.pack( __POLYGON_MAP_MAGIC__, len(header) ))
+    map_file.write( header )
+    for chunk in chunks:
+        map_file.write( chunk )
+
+
+def is_polygon_map_file( file_path: Union[str, Path] ) -> bool:
+    """
+    Tell a polygon map container (as written by save_polygon_map()) from a legacy, pickled tensor.
+
+    Args:
+        file_path (Union[str,Path]): a polygon map file.
+
+    Output:
+        bool: True if the file is a polygon map container.
+    """
+    with open( file_path, 'rb' ) as map_file:
+        return map_file.read( len(__POLYGON_MAP_MAGIC__) ) == __POLYGON_MAP_MAGIC__
+
+
+def is_compressed_polygon_map_file( file_path: Union[str, Path] ) -> bool:
+    """
+    Tell a compressed polygon map container, whose labels are best read as a sparse map, from the files
+    that store a dense map (uncompressed containers, pickled tensors), that load_polygon_map() can memory-map.
+
+    Args:
+        file_path (Union[str,Path]): a polygon map file.
+
+    Output:
+        bool: True if the file is a compressed polygon map container.
+    """
+    if not is_polygon_map_file( file_path ):
+        return False
+    with open( file_path, 'rb' ) as map_file:
+        return read_polygon_map_header( map_file )['compression'] != 'none'
+
+
+def read_polygon_map_header( map_file ) -> dict:
+    """
+    Read the header of a polygon map container. The position of the data section (the chunks, or
+    the dense block of an uncompressed map) is stored in the returned dictionary as 'data_offset';
+    chunk offsets are relative to it.
+
+    Args:
+        map_file: a polygon map container, opened in binary mode.
+
+    Output:
+        dict: the file header (shape, label count, label index).
+    """
+    preamble = map_file.read( __POLYGON_MAP_PREAMBLE__.size )
+    if len( preamble ) != __POLYGON_MAP_PREAMBLE__.size:
+        raise ValueError("Not a polygon map file: {}".format( map_file.name ))
+    magic, header_size = __POLYGON_MAP_PREAMBLE__.unpack( preamble )
+    if magic != __POLYGON_MAP_MAGIC__:
+        raise ValueError("Not a polygon map file: {}".format( map_file.name ))
+    header = json.loads( map_file.read( header_size ).decode('utf-8') )
+    header['data_offset'] = __POLYGON_MAP_PREAMBLE__.size + header_size
+    if header['compression'] == 'none':
+        header['data_offset'] += -header['data_offset'] % __POLYGON_MAP_ALIGNMENT__
+    return header
+
+
+def _map_polygon_map_block( file_path: Union[str, Path], header: dict ) -> np.ndarray:
+    """
+    Memory-map the dense block of an uncompressed container. The mapping is copy-on-write: pages
+    are read from the page cache only when touched, and shared among all processes that map the
+    same file, as long as they do not write into them.
+
+    Args:
+        file_path (Union[str,Path]): an uncompressed polygon map container.
+        header (dict): the file header.
+
+    Output:
+        np.ndarray: a (4,H,W) array of unsigned bytes, backed by the file.
+    """
+    return np.memmap( file_path, dtype='uint8', mode='c', offset=header['data_offset'], shape=(4,)+tuple( header['shape'] ))
+
+
+def _read_polygon_map_chunk( map_file, header: dict, label_entry: dict ) -> dict:
+    """
+    Read and decompress the chunk of a single label (from an uncompressed map: read the label's
+    window only).
+
+    Args:
+        map_file: a polygon map container, opened in binary mode.
+        header (dict): the file header.
+        label_entry (dict): the label's entry in the header's index.
+
+    Output:
+        dict: a label entry of a sparse map (bounding box and channel codes).
+    """
+    y_min, x_min, y_max, x_max = label_entry['bbox']
+    if header['compression'] == 'none':
+        window_chw = _map_polygon_map_block( map_file.name, header )[:, y_min:y_max+1, x_min:x_max+1]
+        channel_codes = np.zeros( window_chw.shape[1:], dtype='uint8' )
+        for c in range(4):
+            channel_codes[ window_chw[c] == label_entry['label'] ] = c+1
+        return { 'bbox': tuple( label_entry['bbox'] ), 'channels': channel_codes }
+    map_file.seek( header['data_offset'] + label_entry['offset'] )
+    channel_codes = np.frombuffer( zlib.decompress( map_file.read( label_entry['size'] )), dtype='uint8' )
+    return { 'bbox': tuple( label_entry['bbox'] ),
+             'channels': channel_codes.reshape( (y_max-y_min+1, x_max-x_min+1) ).copy() }
+
+
+def load_polygon_map( file_path: Union[str, Path], sparse: bool=False, mmap: bool=False ) -> Union[Tensor, dict]:
+    """
+    Load a polygon map from a container file (see save_polygon_map()) or, for older outputs,
+    from a pickled tensor (.pt).
+
+    With mmap=True, an uncompressed container (or a .pt file in Torch's zip format) is not read
+    but memory-mapped: the returned tensor is a zero-copy view of the file, whose pages are only
+    read when touched, and shared by the worker processes that map the same file (eg. a GT map).
+    A compressed container cannot be mapped: it is decompressed as usual.
+
+    Args:
+        file_path (Union[str,Path]): a polygon map file.
+        sparse (bool): if True, return a sparse map; otherwise, a 4-channel tensor.
+        mmap (bool): if True, memory-map the map's data, when the file format allows it.
+
+    Output:
+        Union[Tensor,dict]: a dense (4-channel tensor) or sparse polygon map.
+    """
+    if not is_polygon_map_file( file_path ):
+        polygon_map_chw = None
+        if mmap:
+            try:
+                polygon_map_chw = torch.load( file_path, mmap=True )
+            except (RuntimeError, TypeError):
+                # legacy (non-zip) serialization, or Torch < 2.1 (no mmap keyword): cannot be mapped
+                pass
+        if polygon_map_chw is None:
+            polygon_map_chw = torch.load( file_path )
+        return polygon_map_to_sparse( polygon_map_chw ) if sparse else polygon_map_chw
+
+    with open( file_path, 'rb' ) as map_file:
+        header = read_polygon_map_header( map_file )
+        if header['compression'] == 'none':
+            if mmap:
+                polygon_map_chw = torch.from_numpy( _map_polygon_map_block( file_path, header ))
+            else:
+                map_file.seek( header['data_offset'] )
+                polygon_map_chw = torch.from_numpy( np.fromfile( map_file, dtype='uint8', count=4*header['shape'][0]*header['shape'][1] ).reshape( (4,)+tuple( header['shape'] )))
+            return polygon_map_to_sparse( polygon_map_chw ) if sparse else polygon_map_chw
+        sparse_map = { 'shape': tuple( header['shape'] ),
+                       'labels': { label_entry['label']: _read_polygon_map_chunk( map_file, header, label_entry ) for label_entry in header['labels'] }}
+    return sparse_map if sparse else sparse_to_polygon_map( sparse_map )
+
+
+def load_polygon_map_label( file_path: Union[str, Path], label: int ) -> Optional[dict]:
+    """
+    Load a single label from a polygon map container, by decompressing its chunk only.
+
+    Args:
+        file_path (Union[str,Path]): a polygon map container.
+        label (int): the label to be read.
+
+    Output:
+        dict: a label entry of a sparse map (bounding box and channel codes), or None if the map does not store the label.
+    """
+    with open( file_path, 'rb' ) as map_file:
+        header = read_polygon_map_header( map_file )
+        for label_entry in header['labels']:
+            if label_entry['label'] == label:
+                return _read_polygon_map_chunk( map_file, header, label_entry )
+    return None
+
+
+def retrieve_polygon_mask_from_file( file_path: Union[str, Path], label: int ) -> Tensor:
+    """
+    Same as retrieve_polygon_mask_from_map(), but reads the label's chunk only from a polygon map container.
+
+    Args:
+        file_path (Union[str,Path]): a polygon map container.
+        label (int): the label to be selected.
+
+    Output:
+        Tensor: a flat, boolean mask for the polygon of choice.
+    """
+    with open( file_path, 'rb' ) as map_file:
+        header = read_polygon_map_header( map_file )
+        labels = { label_entry['label']: _read_polygon_map_chunk( map_file, header, label_entry ) for label_entry in header['labels'] if label_entry['label'] == label }
+    return retrieve_polygon_mask_from_map( { 'shape': tuple( header['shape'] ), 'labels': labels }, label )
+
+
+def polygon_pixel_metrics_from_img_json_files( img: str, segmentation_json_pred: str, segmentation_json_gt: str ) -> np.ndarray:
+    """
+    Compute a IoU matrix from an image and two JSON files describing the segmentation's output (line polygons).
+
+    Args:
+        img (str): the input image's file path.
+        segmentation_json_pred (str): path of the predicted segmentation's JSON file.
+        segmentation_json_gt (str): path of the GT segmentation's JSON file.
+
+    Output:
+        np.ndarray: a 2D array, representing IoU values for each possible pair of polygons.
+    """
+    return polygon_pixel_metrics_from_img_file_and_segmentation_dicts( img, segmentation_dict_from_file( segmentation_json_pred, as_arrays=True ), segmentation_dict_from_file( segmentation_json_gt, as_arrays=True ))
+
+
+def polygon_pixel_metrics_from_img_xml_files( img: str, page_xml_pred: str, page_xml_gt: str ) -> np.ndarray:
+    """
+    Compute a IoU matrix from an image and two PageXML files describing the segmentation's output (line polygons).
+
+    Args:
+        img (str): the input image's file path.
+        page_xml_pred (str): path of the predicted segmentation's PageXML file.
+        page_xml_gt (str): path of the GT segmentation's PageXML file.
+
+    Output:
+        np.ndarray: a 2D array, representing IoU values for each possible pair of polygons.
+    """
+    return polygon_pixel_metrics_from_img_file_and_segmentation_dicts( img, segmentation_dict_from_file( page_xml_pred, as_arrays=True ), segmentation_dict_from_file( page_xml_gt, as_arrays=True ))
+
+
+def polygon_pixel_metrics_from_img_file_and_segmentation_dicts( img: str, segmentation_dict_pred: dict, segmentation_dict_gt: dict ) -> np.ndarray:
+    """
+    Same as polygon_pixel_metrics_from_img_segmentation_dict(), with an image file: maps and FG mask go through
+    the disk cache, if enabled (see enable_cache()).
+
+    Args:
+        img (str): the input image's file path.
+        segmentation_dict_pred (dict): a dictionary, typically constructed from a JSON file.
+        segmentation_dict_gt (dict): a dictionary, typically constructed from a JSON file.
+
+    Output:
+        np.ndarray: a 2D array, representing IoU values for each possible pair of polygons.
+    """
+    # the image is hashed once for its 3 cache entries
+    img_digest = file_sha256( img ) if _cache_config['dir'] is not None else None
+    with Image.open( img, 'r' ) as img_wh:
+        polygon_chw_pred, polygon_chw_gt = [ cached_computation( 'polygon_map', img, d, lambda d=d: polygon_map_from_img_segmentation_dict( img_wh, d ), img_digest )
+                                             for d in (segmentation_dict_pred, segmentation_dict_gt) ]
+        binary_mask = cached_computation( 'binary_mask', img, None, lambda: get_mask( img_wh ), img_digest )
+
+    return polygon_pixel_metrics_from_polygon_maps_and_mask( polygon_chw_pred, polygon_chw_gt, binary_mask )
+
+
+def polygon_pixel_metrics_from_img_segmentation_dict(img: Image.Image, segmentation_dict_pred: dict, segmentation_dict_gt: dict, binary_mask: Optional[Tensor]=None) -> np.ndarray:
+    """
+    Compute a IoU matrix from an image and two dictionaries describing the segmentation's output (line polygons).
+
+    Args:
+        img (Image.Image): the input page, needed for the size information and the binarization mask.
+        segmentation_dict_pred (dict): a dictionary, typically constructed from a JSON file.
+        segmentation_dict_gt (dict): a dictionary, typically constructed from a JSON file.
+        binary_mask (Tensor): a precomputed FG mask for the page (default: computed with get_mask()).
+
+    Output:
+        np.ndarray: a 2D array, representing IoU values for each possible pair of polygons.
+    """
+    #polygon_img_gt: Tensor, polygon_img_pred: Tensor, mask: Tensor) -> Tensor:
+    polygon_chw_pred, polygon_chw_gt = [ polygon_map_from_img_segmentation_dict( img, d ) for d in (segmentation_dict_pred, segmentation_dict_gt) ]
+
+    if binary_mask is None:
+        binary_mask = get_mask( img )
+
+    return polygon_pixel_metrics_from_polygon_maps_and_mask( polygon_chw_pred, polygon_chw_gt, binary_mask )
+
+
+# masks of the images still in use, with the binarization parameters (least recently used first)
+_mask_cache: 'OrderedDict[Tuple, Tensor]' = OrderedDict()
+
+def get_mask( img_whc: Image.Image, thresholding_alg: Union[Callable, str]=ski.filters.threshold_otsu, sampling_step: int=1, window_size: int=31, k: float=.2 ) -> Tensor:
+    """
+    Compute a binary mask from an image, using the given thresholding algorithm: FG=1s, BG=0s
+
+    + with a function (default: ski.filters.threshold_otsu()), a global threshold is computed on the 8-bit
+      grayscale page (see grayscale_uint8()), and applied to the first channel;
+    + with 'otsu', the page is converted into 8-bit grayscale in integer arithmetic, and the threshold
+      computed from its 256-bin histogram, optionally on a subsampled page (see otsu_threshold());
+    + with 'sauvola', each pixel is compared to a local threshold (see sauvola_threshold()), which copes
+      with uneven backgrounds (stains, shadows).
+
+    Masks are cached for the images still in use (an image is assumed not to change in place), so that
+    a page is binarized only once for several callers: each of them gets its own copy of the mask.
+
+    Args:
+        img (PIL image): input image
+        thresholding_alg (Union[Callable,str]): a thresholding function, or one of 'otsu' and 'sauvola'.
+        sampling_step (int): for 'otsu', compute the histogram on every n-th row and column only.
+        window_size (int): for 'sauvola', the side of the (square) neighbourhood of a pixel.
+        k (float): for 'sauvola', sensitivity to the neighbourhood's standard deviation.
+
+    Output:
+        Tensor: a binary map with FG pixels=1 and BG=0.
+    """
+    key = (id( img_whc ), thresholding_alg, sampling_step, window_size, k)
+    if key in _mask_cache:
+        _mask_cache.move_to_end( key )
+        return _mask_cache[ key ].clone()
+
+    if thresholding_alg == 'otsu':
+        gray_hw = grayscale_uint8( img_whc )
+        img_bin_hw = torch.from_numpy( gray_hw <= otsu_threshold( gray_hw, sampling_step ))
+    elif thresholding_alg == 'sauvola':
+        gray_hw = grayscale_uint8( img_whc )
+        img_bin_hw = torch.from_numpy( gray_hw <= sauvola_threshold( gray_hw, window_size, k ))
+    elif callable( thresholding_alg ):
+        img_hwc = np.asarray( img_whc )
+        # threshold on the 8-bit grayscale page, i.e. on the same scale as the pixels (dark class: <= t)
+        threshold = thresholding_alg( grayscale_uint8( img_whc ))
+        img_bin_hw = torch.from_numpy( img_hwc[:,:,0] <= threshold if img_hwc.ndim == 3 else img_hwc <= threshold )
+    else:
+        raise ValueError("Unknown thresholding algorithm: {}".format( thresholding_alg ))
+
+    _mask_cache[ key ] = img_bin_hw
+    if len( _mask_cache ) > __MASK_CACHE_SIZE__:
+        _mask_cache.popitem( last=False )
+    # entries go away with their image
+    weakref.finalize( img_whc, _mask_cache.pop, key, None )
+
+    return img_bin_hw.clone()
+
+
+def grayscale_uint8( img_whc: Image.Image ) -> np.ndarray:
+    """
+    Convert an image into 8-bit grayscale, in integer arithmetic (same luminance weights as
+    ski.color.rgb2gray(), in 16-bit fixed point), with no float intermediate.
+
+    Args:
+        img_whc (Image.Image): an image (alpha channel, if any, is ignored).
+
+    Output:
+        np.ndarray: a (H,W) array of 8-bit unsigned integers.
+    """
+    if img_whc.mode == 'L':
+        return np.asarray( img_whc )
+    if img_whc.mode not in ('RGB', 'RGBA'):
+        img_whc = img_whc.convert('RGB')
+    img_hwc = np.asarray( img_whc )
+    gray_hw = np.multiply( img_hwc[:,:,0], 13926, dtype='uint32' )
+    gray_hw += np.multiply( img_hwc[:,:,1], 46884, dtype='uint32' )
+    gray_hw += np.multiply( img_hwc[:,:,2], 4725, dtype='uint32' )
+    # rounding
+    gray_hw += 1<<15
+    gray_hw >>= 16
+    return gray_hw.astype('uint8')
+
+
+def otsu_threshold( gray_hw: np.ndarray, sampling_step: int=1 ) -> int:
+    """
+    Otsu threshold of an 8-bit grayscale image, computed from its 256-bin histogram (same result as
+    ski.filters.threshold_otsu() on the same image).
+
+    Args:
+        gray_hw (np.ndarray): a (H,W) array of 8-bit unsigned integers.
+        sampling_step (int): compute the histogram on every n-th row and column only (an estimate of the
+                             full-page threshold, at a fraction of the cost).
+
+    Output:
+        int: the threshold t (the dark class is made of the pixels <= t).
+    """
+    counts = np.bincount( gray_hw[::sampling_step, ::sampling_step].reshape(-1), minlength=256 ).astype('float64')
+    values = np.arange( 256, dtype='float64' )
+    weight_1, weight_2 = np.cumsum( counts ), np.cumsum( counts[::-1] )[::-1]
+    if weight_1[-1] == 0 or np.count_nonzero( counts ) == 1:
+        return int( np.argmax( counts ))
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        mean_1 = np.cumsum( counts * values ) / weight_1
+        mean_2 = ( np.cumsum( (counts * values)[::-1] ) / weight_2[::-1] )[::-1]
+    # between-class variance, for each threshold (empty classes have none)
+    variance_12 = np.nan_to_num( weight_1[:-1] * weight_2[1:] * (mean_1[:-1] - mean_2[1:])**2 )
+    return int( np.argmax( variance_12 ))
+
+
+def sauvola_threshold( gray_hw: np.ndarray, window_size: int=31, k: float=.2, r: float=128 ) -> np.ndarray:
+    """
+    Sauvola local thresholds of an 8-bit grayscale image: t = m * (1 + k * (s/r - 1)), where m and s are
+    the mean and standard deviation over the pixel's neighbourhood (clipped at the page's edges). Window
+    sums are read from integral images of 32-bit unsigned integers: wrapped-around sums still yield exact
+    window sums, as long as these fit into 32 bits.
+
+    Args:
+        gray_hw (np.ndarray): a (H,W) array of 8-bit unsigned integers.
+        window_size (int): the side of the (square) neighbourhood of a pixel (odd number, at most 257).
+        k (float): sensitivity to the standard deviation.
+        r (float): dynamic range of the standard deviation.
+
+    Output:
+        np.ndarray: a (H,W) array of thresholds (32-bit floats); the dark class is made of the pixels <= t.
+    """
+    if window_size > 257:
+        raise ValueError("Window size should be at most 257 (window sums of squares must fit into 32 bits).")
+    height, width = gray_hw.shape
+    radius = window_size // 2
+    y_0, y_1 = np.clip( np.arange( height )-radius, 0, height ), np.clip( np.arange( height )+radius+1, 0, height )
+    x_0, x_1 = np.clip( np.arange( width )-radius, 0, width ), np.clip( np.arange( width )+radius+1, 0, width )
+    counts = ((y_1-y_0)[:,None] * (x_1-x_0)[None,:]).astype('float32')
+
+    def window_sums( values_hw: np.ndarray ) -> np.ndarray:
+        integral = np.zeros( (height+1, width+1), dtype='uint32' )
+        np.cumsum( values_hw, axis=0, dtype='uint32', out=integral[1:,1:] )
+        np.cumsum( integral[1:,1:], axis=1, dtype='uint32', out=integral[1:,1:] )
+        sums = integral[ y_1[:,None], x_1[None,:] ]
+        sums -= integral[ y_0[:,None], x_1[None,:] ]
+        sums -= integral[ y_1[:,None], x_0[None,:] ]
+        sums += integral[ y_0[:,None], x_0[None,:] ]
+        return sums
+
+    # float32 from here on (a uint32 array divided by a float32 array would be float64)
+    means = window_sums( gray_hw ).astype('float32') / counts
+    squares_hw = np.square( gray_hw, dtype='uint32' )
+    variances = window_sums( squares_hw ).astype('float32') / counts - np.square( means )
+    deviations = np.sqrt( np.maximum( variances, 0 ))
+    return means * (1 + k * (deviations / r - 1))
+
+
+def polygon_pixel_metrics_from_polygon_maps_and_mask(polygon_chw_pred: Tensor, polygon_chw_gt: Tensor, binary_hw_mask: Optional[Tensor]=None, label_distance=0) -> np.ndarray:
+    """
+    Compute pixel-based metrics from two tensors that each encode (potentially overlapping) polygons
+    and a FG mask.
+
+    Args:
+        polygon_chw_gt (Tensor): a 4-channel image, where each position may store up to 3 overlapping labels
+                                 (one for each channel); a sparse map is accepted as well.
+        polygon_chw_pred (Tensor): a 4-channel image, where each position may store up to 3 overlapping labels
+                                   (one for each channel); a sparse map is accepted as well.
+        binary_hw_mask (Tensor): a boolean mask that selects the input image's FG pixel
+
+    Output:
+        np.ndarray: metrics (intersection, union, precision, recall, f1) values for each possible pair of labels
+                    (i,j) with i ∈  map1 and j ∈ map2. Shared pixels in each map (i.e. overlapping polygons) have
+                    their weight decreased according to the number of polygons they vote for.
+    """
+
+    if is_sparse_polygon_map( polygon_chw_pred ) or is_sparse_polygon_map( polygon_chw_gt ):
+        sparse_pred, sparse_gt = polygon_map_to_sparse( polygon_chw_pred ), polygon_map_to_sparse( polygon_chw_gt )
+        if tuple(sparse_pred['shape']) != tuple(sparse_gt['shape']):
+            raise TypeError("Wrong type: both maps should have the same shape (instead: {} and {}).".format( sparse_gt['shape'], sparse_pred['shape'] ))
+        if binary_hw_mask is not None:
+            if tuple(binary_hw_mask.shape) != tuple(sparse_gt['shape']):
+                raise TypeError("Wrong type: binary mask should have shape {}".format(sparse_gt['shape']))
+            sparse_pred, sparse_gt = [ sparse_polygon_map_apply_mask( m, binary_hw_mask ) for m in (sparse_pred, sparse_gt) ]
+        return polygon_pixel_metrics_two_sparse_maps( sparse_pred, sparse_gt, label_distance )
+
+    if binary_hw_mask is None:
+        binary_hw_mask = torch.full( polygon_chw_gt.shape[1:], 1, dtype=torch.bool )
+    if binary_hw_mask.shape != polygon_chw_gt.shape[1:]:
+        raise TypeError("Wrong type: binary mask should have shape {}".format(polygon_chw_gt.shape[1:]))
+
+    if len(polygon_chw_gt.shape) != 3 or polygon_chw_gt.shape[0] != 4 or polygon_chw_gt.dtype is not torch.uint8:
+        raise TypeError("Wrong type: polygon GT map should be a 4-channel tensor of unsigned 8-bit integers.")
+    if len(polygon_chw_pred.shape) != 3 or polygon_chw_pred.shape[0] != 4 or polygon_chw_pred.dtype is not torch.uint8:
+        raise TypeError("Wrong type: polygon predicted map should be a 4-channel tensor of unsigned 8-bit integers.")
+    if polygon_chw_gt.shape != polygon_chw_pred.shape:
+        raise TypeError("Wrong type: both maps should have the same shape (instead: {} and {}).".format( polygon_chw_gt.shape, polygon_chw_pred.shape ))
+
+    polygon_chw_fg_pred, polygon_chw_fg_gt = [ polygon_img * binary_hw_mask for polygon_img in (polygon_chw_pred, polygon_chw_gt) ]
+    
+    metrics = polygon_pixel_metrics_two_maps( polygon_chw_fg_pred, polygon_chw_fg_gt, label_distance )
+
+    return metrics
+
+def retrieve_polygon_mask_from_map( label_map_chw: Tensor, label: int) -> Tensor:
+    """
+    From a label map (that may have compound pixels representing polygon intersections),
+    compute a binary mask that covers _all_ pixels for the label, whether they belong to an
+    intersection or not.
+
+    Args:
+        label_map_chw (Tensor): a 4-channel tensor, where each pixel can store up to 4 labels (or a sparse map).
+        label (int): the label to be selected.
+
+    Output:
+        Tensor: a flat, boolean mask for the polygon of choice.
+    """
+    if is_sparse_polygon_map( label_map_chw ):
+        polygon_mask_hw = torch.zeros( tuple(label_map_chw['shape']), dtype=torch.bool )
+        if label in label_map_chw['labels']:
+            entry = label_map_chw['labels'][ label ]
+            polygon_mask_hw[ sparse_label_window( entry ) ] = torch.from_numpy( entry['channels'] != 0 )
+        return polygon_mask_hw
+    if len(label_map_chw.shape) != 3 and label_map_chw.shape[0] != 4:
+        raise TypeError("Wrong type: label map should be a 4-channel tensor (shape={} instead).".format( label_map_chw.shape ))
+    polygon_mask_hw = torch.sum( label_map_chw==label, dim=0).type(torch.bool)
+
+    return polygon_mask_hw
+
+
+def array_label_index( label_map_hw: np.ndarray ) -> np.ndarray:
+    """
+    From a flat label map (as generated from a segmentation dictionary), compute the set of labels
+    it stores, as a 256-entry boolean array, in a single scan. Once built, the index can be
+    passed to apply_polygon_mask_to_map(), that keeps it up to date.
+
+    Args:
+            label_map_hw (np.ndarray): a 2D map, where each 32-bit integer store up to 4 labels.
+    Output:
+            np.ndarray: a boolean array I, where I[l] is True if the map stores label l (I[0] is always False).
+    """
+    if len(label_map_hw.shape) > 2:
+        raise TypeError("Map should be a flat map of integers.")
+
+    label_index = np.bincount( np.ascontiguousarray( label_map_hw ).view('uint8').ravel(), minlength=256 ) > 0
+    label_index[0] = False
+    return label_index
+
+
+def array_has_label( label_map_hw: np.ndarray, label: int ) -> bool:
+    """
+    From a flat label map (as generated from a segmentation dictionary) where each pixel can store up to 3 values,
+    test whether a given polygon has been stored already.
+
+    Args:
+            label_map_hw (np.ndarray): a 2D map, where each 32-bit integer store up to 4 labels.
+            label (int): the label to be checked for.
+    Output:
+            bool: True if map already stores the given label; False otherwise.
+    """
+    if len(label_map_hw.shape) > 2:
+        raise TypeError("Map should be a flat map of integers.")
+
+    label_cube_chw = np.moveaxis(label_map_hw.view('uint8').reshape(label_map_hw.shape+(-1,)), 2, 0)
+    return bool(np.any( label_cube_chw == label ))
+
+
+
+def polygon_pixel_metrics_two_maps( map_chw_1: Tensor, map_chw_2: Tensor, label_distance=5) -> np.ndarray:
+    """
+    Provided two label maps that each encode (potentially overlapping) polygons, compute
+    for each possible pair of labels (i_pred, j_gt) with i ∈  map1 and j ∈  map2.
+    + intersection and union counts
+    + precision and recall
+
+    Shared pixels in each map (i.e. overlapping polygons) have their weight decreased according
+    to the number of polygons they vote for. 
+
+    Args:
+        map_chw_1 (Tensor): the predicted map, i.e. a 4-channel map with labeled polygons, with potential overlaps.
+        map_hw_2 (Tensor): the GT map, i.e. a 4-channel map with labeled polygons, with potential overlaps.
+        label_distance (int): if > 0, assume that labels beyond this distance do not intersect (for
+                              compatibility only: all pairs are computed in the same passes anyway).
+
+    Output:
+        np.ndarray: a 4 channel array, where each cell [i,j] stores respectively intersection and union counts,
+                    as well as precision and recall for a pair of labels [i,j].
+    """
+    if is_sparse_polygon_map( map_chw_1 ) or is_sparse_polygon_map( map_chw_2 ):
+        return polygon_pixel_metrics_two_sparse_maps( polygon_map_to_sparse( map_chw_1 ), polygon_map_to_sparse( map_chw_2 ), label_distance )
+
+    # Idea:
+    # + the intersection of a label 1 of depth m (where m = # of polygons that intersect on the pixel) with label 2
+    # of depth n has weight 1/max(m, n)
+    # + the union of a label-1 pixel of depth m with label-2 pixel of depth n has weight (1/m + 1/n)
+    # All counts are accumulated at once into joint histograms (one bin per pair of labels), over
+    # the pixels covered by both maps.
+    intersection_counts, label_counts_1, label_counts_2 = joint_label_histograms( map_chw_1, map_chw_2 )
+
+    # labels that are present have a non-zero count
+    labels_1, labels_2 = np.flatnonzero( label_counts_1 ), np.flatnonzero( label_counts_2 )
+    min_label_1, max_label_1 = int( np.min( labels_1 )), int( np.max( labels_1 ))
+    min_label_2, max_label_2 = int( np.min( labels_2 )), int( np.max( labels_2 ))
+
+    intersection_counts = intersection_counts[ min_label_1:max_label_1+1, min_label_2:max_label_2+1 ]
+    label_counts_1, label_counts_2 = label_counts_1[ min_label_1:max_label_1+1 ], label_counts_2[ min_label_2:max_label_2+1 ]
+
+    # assume that labels beyond a given distance do not intersect
+    if label_distance > 0:
+        label_range_1, label_range_2 = np.arange(min_label_1, max_label_1+1), np.arange(min_label_2, max_label_2+1)
+        intersection_counts[ np.abs( label_range_1[:,None] - label_range_2[None,:] ) > label_distance ] = 0
+
+    # union = |label 1| + |label 2| - |label 1 ∩ label 2|
+    union_counts = label_counts_1[:,None] + label_counts_2[None,:] - intersection_counts
+
+    # P = |label 1 ∩ label 2| / | label 1 |; R = |label 1 ∩ label 2| / | label 2 |
+    # (rows (label 1) assumed to be predictions, cols (label 2) assumed to be GT)
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        precisions = np.where( label_counts_1[:,None] != 0, intersection_counts / label_counts_1[:,None], 0 )
+        recalls = np.where( label_counts_2[None,:] != 0, intersection_counts / label_counts_2[None,:], 0 )
+
+    # 4 channels for the intersection and union counts, and the precision and recall scores, respectively
+    metrics_hwc = np.stack( [ intersection_counts, union_counts, precisions, recalls ], axis=2 ).astype('float32')
+
+    return metrics_hwc
+
+
+def joint_label_histograms( map_chw_1: Tensor, map_chw_2: Tensor ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute, in a few passes over the pixels, the depth-weighted intersection counts of all pairs of
+    labels of two maps, as well as the depth-weighted pixel counts of the labels in each map.
+    Since a label is stored at most once on any given pixel, every (channel 1, channel 2) pair of
+    a pixel contributes to a distinct bin of the joint histogram.
+
+    Args:
+        map_chw_1 (Tensor): a 4-channel map with labeled polygons, with potential overlaps.
+        map_chw_2 (Tensor): a 4-channel map with labeled polygons, with potential overlaps.
+
+    Output:
+        tuple: a triplet of float64 arrays (I, C1, C2), where I[i,j] is the weighted intersection count of
+               label i in map 1 and label j in map 2 (a 256x256 matrix), and C1[i] (resp. C2[j]) the weighted
+               pixel count of label i in map 1 (resp. of label j in map 2). Counts are accumulated in float64,
+               where the former per-label sums were float32 Torch sums: they may differ from those in the last
+               float32 digit, once the metrics are stored as float32 (see polygon_pixel_metrics_two_maps()).
+    """
+    label_count = 1 << __LABEL_SIZE__
+    flat_map_1, flat_map_2 = map_chw_1.reshape(4,-1).numpy(), map_chw_2.reshape(4,-1).numpy()
+    # depth, i.e. number of labels on each pixel (0 = not covered)
+    depth_1, depth_2 = [ sum( (flat_map[c] != 0).view('uint8') for c in range(4) ) for flat_map in (flat_map_1, flat_map_2) ]
+
+    # label counts: a pixel of depth m weighs 1/m for each of the labels it stores
+    label_counts = []
+    for flat_map, depth in ((flat_map_1, depth_1), (flat_map_2, depth_2)):
+        covered = np.flatnonzero( depth )
+        weights = 1.0/depth[ covered ]
+        counts = np.zeros( label_count )
+        # one channel at a time: the weights are shared by all channels
+        for c in range(4):
+            counts += np.bincount( flat_map[c, covered], weights=weights, minlength=label_count )
+        counts[0] = 0
+        label_counts.append( counts )
+
+    # intersection counts: only pixels covered in both maps matter
+    shared = np.flatnonzero( (depth_1 != 0) & (depth_2 != 0) )
+    weights = 1.0/np.maximum( depth_1[ shared ], depth_2[ shared ] )
+    labels_1, labels_2 = flat_map_1[:, shared].astype('int32'), flat_map_2[:, shared]
+    intersection_counts = np.zeros( label_count*label_count )
+    for c1, c2 in itertools.product( range(4), range(4) ):
+        valid = np.flatnonzero( (labels_1[c1] != 0) & (labels_2[c2] != 0) )
+        if len( valid ) == 0:
+            continue
+        pairs = labels_1[c1][ valid ] * label_count + labels_2[c2][ valid ]
+        intersection_counts += np.bincount( pairs, weights=weights[ valid ], minlength=label_count*label_count )
+
+    return (intersection_counts.reshape( label_count, label_count ), label_counts[0], label_counts[1])
+
+
+def polygon_pixel_metrics_two_sparse_maps( sparse_map_1: dict, sparse_map_2: dict, label_distance=0 ) -> np.ndarray:
+    """
+    Same as polygon_pixel_metrics_two_maps(), for sparse maps: intersections are only computed for
+    pairs of labels whose boxes overlap (see candidate_label_pairs()), over the boxes' intersection;
+    the union of two labels that do not overlap is the sum of their (depth-weighted) counts. The
+    result is exact, whatever the labels' numbering.
+
+    Args:
+        sparse_map_1 (dict): the predicted map, as a sparse map.
+        sparse_map_2 (dict): the GT map, as a sparse map.
+        label_distance (int): if > 0, assume that labels beyond this distance do not intersect.
+
+    Output:
+        np.ndarray: a 4 channel array, where each cell [i,j] stores respectively intersection and union counts,
+                    as well as precision and recall for a pair of labels [i,j].
+    """
+    entries_1, entries_2 = sparse_map_1['labels'], sparse_map_2['labels']
+    min_label_1, max_label_1 = min( entries_1 ), max( entries_1 )
+    min_label_2, max_label_2 = min( entries_2 ), max( entries_2 )
+
+    depths_1, depths_2 = sparse_polygon_map_depths( sparse_map_1 ), sparse_polygon_map_depths( sparse_map_2 )
+    # pixels shared by several polygons have their weight decreased accordingly
+    label_counts_1, label_counts_2 = np.zeros( max_label_1-min_label_1+1 ), np.zeros( max_label_2-min_label_2+1 )
+    for l in entries_1:
+        label_counts_1[ l-min_label_1 ] = np.sum( 1.0/depths_1[l][ entries_1[l]['channels'] != 0 ] )
+    for l in entries_2:
+        label_counts_2[ l-min_label_2 ] = np.sum( 1.0/depths_2[l][ entries_2[l]['channels'] != 0 ] )
+
+    # pairs that do not intersect: union is the sum of the counts, precision and recall are 0
+    metrics_hwc = np.zeros(( max_label_1-min_label_1+1, max_label_2-min_label_2+1, 4), dtype='float32')
+    metrics_hwc[:,:,1] = label_counts_1[:,None] + label_counts_2[None,:]
+
+    # pixel-level work is only done for pairs whose boxes overlap
+    candidate_pairs = candidate_label_pairs( { l: entry['bbox'] for l, entry in entries_1.items() },
+                                             { l: entry['bbox'] for l, entry in entries_2.items() })
+    for lbl1, lbl2 in candidate_pairs:
+        if label_distance > 0 and abs(lbl1-lbl2) > label_distance:
+            continue
+        overlap = bbox_intersection( entries_1[lbl1]['bbox'], entries_2[lbl2]['bbox'] )
+        label_1_count, label_2_count = label_counts_1[ lbl1-min_label_1 ], label_counts_2[ lbl2-min_label_2 ]
+
+        window_1, window_2 = bbox_relative_window( overlap, entries_1[lbl1]['bbox'] ), bbox_relative_window( overlap, entries_2[lbl2]['bbox'] )
+        intersection_mask = (entries_1[lbl1]['channels'][ window_1 ] != 0) & (entries_2[lbl2]['channels'][ window_2 ] != 0)
+        # intersection pixels weigh 1/max(m,n), where m and n are the pixel's depths in each map
+        max_depth = np.maximum( depths_1[lbl1][ window_1 ], depths_2[lbl2][ window_2 ] )
+        intersection_count = np.sum( 1.0/max_depth[ intersection_mask ] )
+        union_count = label_1_count + label_2_count - intersection_count
+        precision = intersection_count / label_1_count if label_1_count else 0
+        recall = intersection_count / label_2_count if label_2_count else 0
+
+        metrics_hwc[lbl1-min_label_1, lbl2-min_label_2]=[ intersection_count, union_count, precision, recall ]
+
+    return metrics_hwc
+
+
+def polygon_geometric_metrics_from_segmentation_dicts( segmentation_dict_pred: dict, segmentation_dict_gt: dict, page_wh: Optional[Tuple[int,int]]=None ) -> np.ndarray:
+    """
+    Raster-free counterpart of polygon_pixel_metrics_from_img_segmentation_dict(), for unmasked evaluation:
+    intersection and union areas are computed from the line boundaries themselves, by polygon clipping,
+    so that memory and time do not depend on the page size.
+
+    The depth-weighting rules of the pixel-based metrics apply to areas: both sets of polygons are
+    overlaid into elementary faces; a face covered by m polygons of the first set weighs 1/m in
+    their counts, and a face shared by m polygons of the first set and n polygons of the second set
+    weighs 1/max(m,n) in their intersections.
+
+    Args:
+        segmentation_dict_pred (dict): a dictionary, typically constructed from a JSON file.
+        segmentation_dict_gt (dict): a dictionary, typically constructed from a JSON file.
+        page_wh (Tuple[int,int]): if provided, the page's (width, height): polygons are clipped to the page,
+                                  as they are when rendered on a map.
+
+    Output:
+        np.ndarray: a 4 channel array, where each cell [i,j] stores respectively intersection and union areas,
+                    as well as precision and recall for lines i+1 (prediction) and j+1 (GT).
+    """
+    # optional dependencies: only needed for the geometric metrics
+    import shapely
+    import scipy.sparse
+
+    polygons_1, polygons_2 = [ [ line_polygon_geometry( line['boundary'], page_wh ) for line in d['lines'] ] for d in (segmentation_dict_pred, segmentation_dict_gt) ]
+
+    # elementary faces of the overlay, with the polygons that cover them
+    faces = polygon_overlay_faces( polygons_1 + polygons_2 )
+    face_areas, face_points = shapely.area( faces ), shapely.point_on_surface( faces )
+    incidences = []
+    for polygons in (polygons_1, polygons_2):
+        face_indices, polygon_indices = shapely.STRtree( polygons ).query( face_points, predicate='within' ) if len(faces) else (np.zeros(0, dtype='int64'),)*2
+        incidences.append( scipy.sparse.csr_matrix( (np.ones( len(face_indices) ), (face_indices, polygon_indices)), shape=(len(faces), len(polygons)) ))
+    depth_1, depth_2 = [ np.asarray( incidence.sum( axis=1 )).ravel() for incidence in incidences ]
+
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        weights_1 = np.where( depth_1 > 0, face_areas / depth_1, 0 )
+        weights_2 = np.where( depth_2 > 0, face_areas / depth_2, 0 )
+        weights_12 = np.where( (depth_1 > 0) & (depth_2 > 0), face_areas / np.maximum( depth_1, depth_2 ), 0 )
+    label_counts_1, label_counts_2 = incidences[0].T @ weights_1, incidences[1].T @ weights_2
+    intersection_counts = (incidences[0].T @ scipy.sparse.diags( weights_12 ) @ incidences[1]).toarray()
+
+    union_counts = label_counts_1[:,None] + label_counts_2[None,:] - intersection_counts
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        precisions = np.where( label_counts_1[:,None] != 0, intersection_counts / label_counts_1[:,None], 0 )
+        recalls = np.where( label_counts_2[None,:] != 0, intersection_counts / label_counts_2[None,:], 0 )
+
+    return np.stack( [ intersection_counts, union_counts, precisions, recalls ], axis=2 ).astype('float32')
+
+
+def line_polygon_geometry( boundary: List[List[int]], page_wh: Optional[Tuple[int,int]]=None ) -> 'shapely.Geometry':
+    """
+    Build a valid, polygonal geometry from a line boundary: self-intersecting boundaries (as segmentation
+    models sometimes output) are repaired, and degenerate ones yield an empty polygon.
+
+    Args:
+        boundary (List[List[int]]): a list of (x,y) points.
+        page_wh (Tuple[int,int]): if provided, the page's (width, height), to clip the polygon to.
+
+    Output:
+        shapely.Geometry: a (multi-)polygon, possibly empty.
+    """
+    import shapely
+
+    if len( boundary ) < 3:
+        return shapely.Polygon()
+    polygon = shapely.Polygon( boundary )
+    if not polygon.is_valid:
+        # keep the polygonal parts only (repairs may yield lines or points)
+        parts = [ p for p in shapely.get_parts( shapely.make_valid( polygon )) if isinstance( p, (shapely.Polygon, shapely.MultiPolygon) ) ]
+        polygon = shapely.unary_union( parts ) if parts else shapely.Polygon()
+    if page_wh is not None:
+        polygon = shapely.intersection( polygon, shapely.box( 0, 0, page_wh[0], page_wh[1] ))
+    return polygon
+
+
+def polygon_overlay_faces( polygons: List['shapely.Geometry'] ) -> np.ndarray:
+    """
+    Overlay a set of polygons, i.e. split the plane they cover into elementary faces, so that
+    each face is either inside or outside any given polygon.
+
+    Args:
+        polygons (List[shapely.Geometry]): a list of (multi-)polygons.
+
+    Output:
+        np.ndarray: an array of polygons (the faces).
+    """
+    import shapely
+
+    boundaries = [ p.boundary for p in polygons if not p.is_empty ]
+    if not boundaries:
+        return np.array( [], dtype=object )
+    # noding: all boundaries are split at their intersections
+    noded_boundaries = shapely.unary_union( boundaries )
+    return shapely.get_parts( shapely.polygonize( shapely.get_parts( noded_boundaries )))
+
+
+def map_to_depth(map_chw: Tensor) -> Tensor:
+    """
+    Compute depth of each pixel in the input map, i.e. how many polygons intersect on this pixel.
+    Note: 0-valued pixels have depth 1.
+
+    Args:
+        map_chw (Tensor): the input tensor (4 channels)
+
+    Output:
+        Tensor: a tensor of integers, where each value represents the
+                number of intersecting polygons for the same position
+                in the input map.
+    """
+    depth_map = torch.sum( map_chw != 0, dim=0)
+    depth_map[ depth_map == 0 ]=1
+
+    return depth_map
+
+
+def polygon_pixel_metrics_to_line_based_scores( metrics: np.ndarray, threshold: float=.5 ) -> Tuple[float, float, float, float, float]:
+    """
+    Implement ICDAR 2017 evaluation metrics, as described in
     https://github.com/DIVA-DIA/DIVA_Line_Segmentation_Evaluator/releases/tag/v1.0.0
     (a Java implementation)
 
@@ -637,50 +1991,22 @@ def polygon_pixel_metrics_to_line_based_scores( metrics: np.ndarray, threshold:
     Out:
         tuple: a 5-tuple with the TP-, FP-, and FN-counts, as well as the Jaccard (aka. IoU) and F1 score at the line level.
     """
-    label_count_pred, label_count_gt = metrics.shape[:2]
-
-    # find all rows with non-empty intersection
-    possible_match_indices = metrics[:,:,0].nonzero()
-    match_rows_cols, possible_matches = np.transpose(possible_match_indices), metrics[ possible_match_indices ]
-    ious = possible_matches[:,0]/possible_matches[:,1]
-    structured_row_col_match_iou = np.array([
-        (match_rows_cols[i,0],
-         match_rows_cols[i,1],
-         possible_matches[i,0],
-         possible_matches[i,1],
-         possible_matches[i,2],
-         possible_matches[i,3],
-         ious[i]) for i in range(len(possible_matches))],
-         dtype=[('pred_polygon', 'int32'),
-                ('gt_polygon', 'int32'),
-                ('intersection', 'float32'),
-                ('union', 'float32'),
-                ('precision', 'float32'),
-                ('recall', 'float32'),
-                ('iou', 'float32')])
+    pred_indices, gt_indices = polygon_pixel_metrics_matches( metrics )
+    precisions, recalls = [ metrics[ pred_indices, gt_indices, c ].astype('float32') for c in (2,3) ]
+    # compare in float32, whether the threshold is a Python float or a NumPy float64
+    threshold = np.float32( threshold )
 
+    # (no match at all: Jaccard and F1 are undefined)
     TP, FP, FN = 0.0, 0.0, 0.0
-    
-    # sort candidate matches by ascending label order and descending IoU order
-    pred_label_iou_copy = structured_row_col_match_iou[['pred_polygon', 'iou']].copy()
-    pred_label_iou_copy['iou'] *= -1
-    I = np.argsort( pred_label_iou_copy, order=['pred_polygon', 'iou'])
-
-    # select one-to-one matches
-    pred2match = { i:False for i in possible_match_indices[0] }
-    for possible_match in structured_row_col_match_iou[I]:
-        # ensure that each predicted label is matched to at most one GT label
-        # (first hit is the one with highest IoU)
-        if not pred2match[possible_match['pred_polygon']]:
-            pred2match[possible_match['pred_polygon']]=True
-            precision, recall = possible_match[['precision', 'recall']]
-            TP += (precision >= threshold and recall >= threshold )
-            # a FP is a non-zero (Pred, GT) pair whose P < .75 or: the system detects
-            # a polygon that partially capture the GT, but too much of the rest also
-            FP += precision < threshold
-            # a FN is a non-zero (Pred, GT) pair whose R < .75 or: the system detects
-            # a polygon that matches the GT, but not enough of it
-            FN += recall < threshold
+    if len( pred_indices ):
+        # a TP is a matched (Pred, GT) pair whose P and R are both above the threshold
+        TP = np.float64( np.count_nonzero( (precisions >= threshold) & (recalls >= threshold) ))
+        # a FP is a non-zero (Pred, GT) pair whose P < .75 or: the system detects
+        # a polygon that partially capture the GT, but too much of the rest also
+        FP = np.float64( np.count_nonzero( precisions < threshold ))
+        # a FN is a non-zero (Pred, GT) pair whose R < .75 or: the system detects
+        # a polygon that matches the GT, but not enough of it
+        FN = np.float64( np.count_nonzero( recalls < threshold ))
 
     Jaccard = TP / (TP+FP+FN)
     F1 = 2*TP / (2*TP+FP+FN)
@@ -706,70 +2032,103 @@ def polygon_pixel_metrics_to_pixel_based_scores( metrics: np.ndarray) -> Tuple[f
     Out:
         tuple: a pair (Pixel IU, Matched Pixel IU)
     """
-    label_count_pred, label_count_gt = metrics.shape[:2]
-
-    # find all rows with non-empty intersection
-    possible_match_indices = metrics[:,:,0].nonzero()
-    match_rows_cols, possible_matches = np.transpose(possible_match_indices), metrics[ possible_match_indices ]
-    ious = possible_matches[:,0]/possible_matches[:,1]
-    structured_row_col_match_iou = np.array([
-        (match_rows_cols[i,0],
-         match_rows_cols[i,1],
-         possible_matches[i,0],
-         possible_matches[i,1],
-         possible_matches[i,2],
-         possible_matches[i,3],
-         ious[i]) for i in range(len(possible_matches))],
-         dtype=[('pred_polygon', 'int32'),
-                ('gt_polygon', 'int32'),
-                ('intersection', 'float32'),
-                ('union', 'float32'),
-                ('precision', 'float32'),
-                ('recall', 'float32'),
-                ('iou', 'float32')])
-
     # pixel-based, page-wide IoU (over all non-empty intersections)
-    intersection_count, union_count = [ np.sum(structured_row_col_match_iou[:][field]) for field in ('intersection', 'union') ]
+    possible_matches = metrics[ metrics[:,:,0].nonzero() ].astype('float32')
+    intersection_count, union_count = np.sum( possible_matches[:,0] ), np.sum( possible_matches[:,1] )
     pixel_iou = intersection_count / union_count
 
-    # pixel-based, page-wide IoU (over all matched pairs)
+    # pixel-based, page-wide IoU (over all matched pairs); sequential sums, in matching order
+    pred_indices, gt_indices = polygon_pixel_metrics_matches( metrics )
     matched_intersection_count, matched_union_count = 0, 0
-
-    # sort candidate matches by ascending label order and descending IoU order
-    pred_label_iou_copy = structured_row_col_match_iou[['pred_polygon', 'iou']].copy()
-    pred_label_iou_copy['iou'] *= -1
-    I = np.argsort( pred_label_iou_copy, order=['pred_polygon', 'iou'])
-
-    pred2match = { i:False for i in possible_match_indices[0] }
-    for possible_match in structured_row_col_match_iou[I]:
-        # ensure that each predicted label is matched to at most one GT label
-        if not pred2match[possible_match['pred_polygon']]:
-            pred2match[possible_match['pred_polygon']]=True
-            matched_intersection_count += possible_match['intersection']
-            matched_union_count += possible_match['union']
+    if len( pred_indices ):
+        matched_pairs = metrics[ pred_indices, gt_indices ].astype('float32')
+        matched_intersection_count, matched_union_count = np.cumsum( matched_pairs[:,0] )[-1], np.cumsum( matched_pairs[:,1] )[-1]
     matched_pixel_iou = matched_intersection_count / matched_union_count
 
     return (pixel_iou, matched_pixel_iou)
 
 
-#def metrics_to_precision_recall_curve( metrics: np.ndarray, threshold_range=np.linspace(0, 1, num=21)) -> np.ndarray:
-#    """
-#    Compute precision and recalls over a range of IoU thresholds, for plotting purpose.
-#
-#    Args:
-#        metrics (np.ndarray): a 4-channel table with GT labels in rows and predicted labels in columns, where
-#                              each entry is a [intersection_count, union_count, precision, recall] sequence.
-#        threshold_range: a series of threshold values, between 0 and 1 (default: [0, 0.05, 0.1, ..., 0.95, 1])
-#
-#    Output:
-#        np.ndarray: a 2D array, with precisions in row 0 and recalls in row 1.
-#
-#    """
-#    precisions_recalls = np.zeros((len(threshold_range), 2))
-#    for (i,t) in enumerate(threshold_range):
-#        precisions_recalls[i] = metrics_to_aggregate_scores(metrics, iou_threshold=t)[:2]
-#        #print(precisions_recalls[:,i])
-#    return np.moveaxis( precisions_recalls, 1, 0)
+def polygon_pixel_metrics_matches( metrics: np.ndarray ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One-to-one matching of predicted and GT polygons, for the line- and pixel-based scores: among
+    all pairs with a non-empty intersection, each predicted polygon is matched with the GT polygon
+    of highest IoU (ties go to the lowest GT label).
+
+    Args:
+        metrics (np.ndarray): metrics matrix, with indices [0..m-1, 0..n-1] for labels 1..m, where m and n are the max.
+                              labels of of the predicted and GT maps respectively. In the channels: intersection count,
+                              union count, precision, recall.
+    Output:
+        tuple: a pair of arrays (pred. indices, GT indices) of the matched pairs, by ascending pred. index.
+    """
+    # find all pairs with non-empty intersection
+    pred_indices, gt_indices = metrics[:,:,0].nonzero()
+    possible_matches = metrics[ pred_indices, gt_indices ]
+    ious = (possible_matches[:,0]/possible_matches[:,1]).astype('float32')
+
+    # sort candidate matches by ascending label order and descending IoU order
+    order = np.lexsort( (-ious, pred_indices) )
+    pred_indices, gt_indices = pred_indices[ order ], gt_indices[ order ]
+
+    # first hit for each predicted label is the one with highest IoU
+    first_hits = np.ones( len(pred_indices), dtype='bool' )
+    first_hits[1:] = pred_indices[1:] != pred_indices[:-1]
+
+    return (pred_indices[ first_hits ], gt_indices[ first_hits ])
+
+
+def polygon_pixel_metrics_to_line_based_counts( metrics: Union[np.ndarray, List[np.ndarray]], thresholds: Union[np.ndarray, List[float]] ) -> np.ndarray:
+    """
+    Same TP, FP, and FN counts as polygon_pixel_metrics_to_line_based_scores(), but for a whole range of thresholds
+    at once: the pairs are matched only once, and the counts for all thresholds are read from their sorted precision
+    and recall values.
+
+    Args:
+        metrics (Union[np.ndarray,List[np.ndarray]]): a metrics matrix, or a sequence of per-page metrics matrices (whose
+                                                      counts are summed).
+        thresholds (Union[np.ndarray,List[float]]): a series of threshold values, between 0 and 1.
+    Out:
+        np.ndarray: a (T,3) array, with the TP-, FP-, and FN-counts for each of the T thresholds.
+    """
+    metrics_list = [ metrics ] if isinstance( metrics, np.ndarray ) and metrics.ndim == 3 else metrics
+    # compare in float32, as the per-threshold scorer does (a float64 threshold such as 0.7 is not a float32)
+    thresholds = np.asarray( thresholds, dtype='float32' )
+
+    precisions, recalls = [], []
+    for page_metrics in metrics_list:
+        pred_indices, gt_indices = polygon_pixel_metrics_matches( page_metrics )
+        precisions.append( page_metrics[ pred_indices, gt_indices, 2 ].astype('float32') )
+        recalls.append( page_metrics[ pred_indices, gt_indices, 3 ].astype('float32') )
+    precisions = np.concatenate( precisions ) if precisions else np.zeros(0, dtype='float32')
+    recalls = np.concatenate( recalls ) if recalls else np.zeros(0, dtype='float32')
+
+    # for each threshold t: TP = #(min(P,R) >= t), FP = #(P < t), FN = #(R < t)
+    match_count = len( precisions )
+    TP = match_count - np.searchsorted( np.sort( np.minimum( precisions, recalls )), thresholds, side='left' )
+    FP = np.searchsorted( np.sort( precisions ), thresholds, side='left' )
+    FN = np.searchsorted( np.sort( recalls ), thresholds, side='left' )
+
+    return np.stack( [ TP, FP, FN ], axis=1 ).astype('float64')
+
+
+def metrics_to_precision_recall_curve( metrics: Union[np.ndarray, List[np.ndarray]], threshold_range: np.ndarray=np.linspace(0, 1, num=21)) -> np.ndarray:
+    """
+    Compute precision and recalls over a range of thresholds, for plotting purpose, at the cost of a single
+    scoring pass (see polygon_pixel_metrics_to_line_based_counts()). Line-based precision is TP/(TP+FP), recall
+    TP/(TP+FN); both are 0 when undefined.
+
+    Args:
+        metrics (Union[np.ndarray,List[np.ndarray]]): a metrics matrix, or a sequence of per-page metrics matrices.
+        threshold_range: a series of threshold values, between 0 and 1 (default: [0, 0.05, 0.1, ..., 0.95, 1])
+
+    Output:
+        np.ndarray: a 2D array, with precisions in row 0 and recalls in row 1.
+    """
+    TP, FP, FN = polygon_pixel_metrics_to_line_based_counts( metrics, threshold_range ).T
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        precisions = np.where( TP+FP > 0, TP / (TP+FP), 0 )
+        recalls = np.where( TP+FN > 0, TP / (TP+FN), 0 )
+    return np.stack( [ precisions, recalls ] )
 
 
 def recover_labels_from_map_value( px: int) -> list:
@@ -796,12 +2155,19 @@ def mask_from_polygon_map_functional( polygon_map: Tensor, test: Callable) -> Te
         mask_from_function( polygon_map, lambda m: m 
 
     Args:
-        polygon_map (Tensor): polygon set, encoded as a 4-channel, 8-bit tensor.
+        polygon_map (Tensor): polygon set, encoded as a 4-channel, 8-bit tensor; with a sparse map, 
+                              the test is applied to the labels only.
         test (Callable): a boolean function, to be applied to the map; a partial
                          function may be passed, if added parameters are needed.
     Output:
         Tensor: a boolean, flat mask.
     """
+    if is_sparse_polygon_map( polygon_map ):
+        mask_hw = torch.zeros( tuple(polygon_map['shape']), dtype=torch.bool )
+        for lbl, entry in polygon_map['labels'].items():
+            if bool( test( torch.tensor( [lbl], dtype=torch.uint8 ))[0] ):
+                mask_hw[ sparse_label_window( entry ) ] |= torch.from_numpy( entry['channels'] != 0 )
+        return mask_hw
     if polygon_map.dtype != torch.uint8:
         raise TypeError("First parameter should be a Tensor of uint8.")
     if len(polygon_map.shape) != 3 or polygon_map.shape[0]!=4:
@@ -810,6 +2176,233 @@ def mask_from_polygon_map_functional( polygon_map: Tensor, test: Callable) -> Te
     return torch.sum( test( polygon_map ), dim=0).type(torch.bool)
 
 
+# opt-in disk cache (see enable_cache())
+# 'size' is a running total of the cache size, as seen from this process: it is only checked against the disk
+# when it exceeds the maximum size
+_cache_config: Dict[str, Any] = { 'dir': None, 'max_size': 0, 'size': 0 }
+_cache_counters: Dict[str, int] = { 'hits': 0, 'misses': 0, 'evictions': 0 }
+
+
+def enable_cache( cache_dir: Union[str, Path], max_size: int=1<<30 ) -> None:
+    """
+    Enable the disk cache used by the file-based functions (*_from_img_json_files(), *_from_img_xml_files()):
+    polygon maps, masks and label statistics are stored under a key that hashes the image's bytes and the
+    (canonicalized) segmentation dictionary; when the cache grows beyond the maximum size, the least recently
+    used entries are evicted. The cache may be shared by several processes.
+
+    Args:
+        cache_dir (Union[str,Path]): cache folder (created if needed); preferably on a local disk.
+        max_size (int): maximum size of the cache, in bytes (default: 1 GiB).
+    """
+    Path( cache_dir ).mkdir( parents=True, exist_ok=True )
+    _cache_config['dir'], _cache_config['max_size'] = Path( cache_dir ), max_size
+    _cache_config['size'] = _cache_entries_size( _cache_entries() )
+
+
+def disable_cache() -> None:
+    """
+    Disable the disk cache (its content is kept).
+    """
+    _cache_config['dir'] = None
+
+
+def clear_cache() -> None:
+    """
+    Remove all entries from the disk cache, and reset the counters.
+    """
+    if _cache_config['dir'] is not None:
+        for entry_path in _cache_entries():
+            entry_path.unlink( missing_ok=True )
+    _cache_config['size'] = 0
+    for counter in _cache_counters:
+        _cache_counters[ counter ] = 0
+
+
+def cache_stats() -> Dict[str, Any]:
+    """
+    Disk cache counters (for the current process), and current cache size.
+
+    Output:
+        dict: a dictionary with 'enabled', 'hits', 'misses', 'evictions', 'entries' and 'size' (in bytes) entries.
+    """
+    stats: Dict[str, Any] = dict( _cache_counters, enabled=_cache_config['dir'] is not None, entries=0, size=0 )
+    if _cache_config['dir'] is not None:
+        entries = _cache_entries()
+        stats['entries'], stats['size'] = len( entries ), _cache_entries_size( entries )
+    return stats
+
+
+def cached_computation( kind: str, img: str, segmentation_dict: Optional[dict], compute: Callable, img_digest: Optional[str]=None ) -> Any:
+    """
+    Return the result of a computation on an image file and a segmentation dictionary, from the disk cache if
+    it is enabled and stores it; otherwise compute it (and store it, if the cache is enabled).
+
+    Args:
+        kind (str): the kind of result, that determines how it is serialized: 'polygon_map', 'line_mask',
+                    'binary_mask', or 'label_statistics'.
+        img (str): path of the image file.
+        segmentation_dict (dict): the segmentation dictionary (None if the result depends on the image only).
+        compute (Callable): a function with no argument, that computes the result.
+        img_digest (str): the image file's digest, if already known (see file_sha256()): callers that look up
+                          several results for the same image hash it only once.
+
+    Output:
+        Any: the result of the computation.
+    """
+    if _cache_config['dir'] is None:
+        return compute()
+
+    suffix, save, load = _CACHE_SERIALIZERS[ kind ]
+    key = hashlib.sha256( '|'.join( (__CACHE_VERSION__, kind, img_digest or file_sha256( img ),
+                                     _segmentation_dict_digest( segmentation_dict ) if segmentation_dict is not None else '') ).encode('utf-8') ).hexdigest()
+    entry_path = _cache_config['dir'].joinpath( key[:2], key + suffix )
+
+    if entry_path.exists():
+        try:
+            result = load( entry_path )
+            # recently used
+            os.utime( entry_path )
+            _cache_counters['hits'] += 1
+            return result
+        except (OSError, ValueError, KeyError, struct.error, zlib.error):
+            # evicted in the meantime, or unreadable: computed again
+            pass
+    _cache_counters['misses'] += 1
+    result = compute()
+
+    entry_path.parent.mkdir( exist_ok=True )
+    fd, tmp_path = tempfile.mkstemp( dir=entry_path.parent, prefix='.', suffix='.tmp' )
+    try:
+        with os.fdopen( fd, 'wb' ) as tmp_file:
+            save( result, tmp_file )
+            tmp_file.flush()
+            entry_size = os.fstat( tmp_file.fileno() ).st_size
+        os.replace( tmp_path, entry_path )
+    except BaseException:
+        if os.path.exists( tmp_path ):
+            os.unlink( tmp_path )
+        raise
+    _cache_config['size'] += entry_size
+    if _cache_config['size'] > _cache_config['max_size']:
+        _evict_cache_entries()
+    return result
+
+
+def _cache_entries() -> List[Path]:
+    """
+    List the entries of the disk cache (temporary files excluded).
+
+    Output:
+        List[Path]: entry paths.
+    """
+    return [ p for p in _cache_config['dir'].glob('*/*') if not p.name.startswith('.') ]
+
+
+def _cache_entries_size( entries: List[Path] ) -> int:
+    """
+    Total size of the given cache entries (those evicted in the meantime are ignored).
+
+    Args:
+        entries (List[Path]): entry paths.
+
+    Output:
+        int: a size, in bytes.
+    """
+    total_size = 0
+    for entry_path in entries:
+        try:
+            total_size += entry_path.stat().st_size
+        except OSError:
+            continue
+    return total_size
+
+
+def _evict_cache_entries() -> None:
+    """
+    Remove the least recently used entries of the disk cache, until its size is below the maximum. The
+    running total of the cache size is reset from the disk, that other processes may have written to.
+    """
+    entries = []
+    for entry_path in _cache_entries():
+        try:
+            entry_stat = entry_path.stat()
+            entries.append( (entry_stat.st_mtime, entry_stat.st_size, entry_path) )
+        except OSError:
+            continue
+    total_size = sum( e[1] for e in entries )
+    for _, size, entry_path in sorted( entries, key=lambda e: e[0] ):
+        if total_size <= _cache_config['max_size']:
+            break
+        entry_path.unlink( missing_ok=True )
+        total_size -= size
+        _cache_counters['evictions'] += 1
+    _cache_config['size'] = total_size
+
+
+def file_sha256( file_path: str ) -> str:
+    """
+    SHA-256 digest of a file's content.
+
+    Args:
+        file_path (str): a file path.
+
+    Output:
+        str: the hexadecimal digest.
+    """
+    h = hashlib.sha256()
+    with open( file_path, 'rb' ) as f:
+        for chunk in iter( lambda: f.read( 1 << 20 ), b'' ):
+            h.update( chunk )
+    return h.hexdigest()
+
+
+def _segmentation_dict_digest( segmentation_dict: dict ) -> str:
+    """
+    SHA-256 digest of the part of a segmentation dictionary that the cached results depend on: the line
+    boundaries, in line order (a line's label is its rank). Other entries (line ids, baselines, regions,
+    Kraken's 'script_detection', ...) are left out, so that the same lines, read from a JSON file or from
+    the equivalent PageXML file, yield the same key.
+
+    Args:
+        segmentation_dict (dict): a segmentation dictionary.
+
+    Output:
+        str: the hexadecimal digest.
+    """
+    boundaries = [ line['boundary'] for line in segmentation_dict['lines'] ]
+    # point arrays (from PageXML) serialize as lists
+    return hashlib.sha256( json.dumps( boundaries, separators=(',', ':'), default=lambda a: a.tolist() ).encode('utf-8') ).hexdigest()
+
+
+def _save_mask( mask_hw: Tensor, mask_file: BinaryIO ) -> None:
+    mask_np = mask_hw.numpy() if isinstance( mask_hw, Tensor ) else np.asarray( mask_hw )
+    np.savez_compressed( mask_file, shape=np.array( mask_np.shape ), bits=np.packbits( mask_np.astype('bool') ))
+
+
+def _load_mask( mask_path: Path ) -> Tensor:
+    with np.load( mask_path ) as mask_file:
+        shape = tuple( mask_file['shape'] )
+        return torch.from_numpy( np.unpackbits( mask_file['bits'], count=int(np.prod( shape )) ).reshape( shape ).astype('bool') )
+
+
+def _save_label_statistics( statistics: Dict[int, dict], statistics_file: BinaryIO ) -> None:
+    statistics_file.write( json.dumps( { str(lbl): stats for lbl, stats in statistics.items() } ).encode('utf-8') )
+
+
+def _load_label_statistics( statistics_path: Path ) -> Dict[int, dict]:
+    with open( statistics_path, 'r' ) as statistics_file:
+        return { int(lbl): dict( stats, bbox=tuple( stats['bbox'] )) for lbl, stats in json.load( statistics_file ).items() }
+
+
+# for each kind of cached result: file suffix, save and load functions
+_CACHE_SERIALIZERS: Dict[str, Tuple[str, Callable, Callable]] = {
+        'polygon_map': ('.pmap', save_polygon_map, load_polygon_map),
+        'line_mask': ('.npz', _save_mask, _load_mask),
+        'binary_mask': ('.npz', _save_mask, _load_mask),
+        'label_statistics': ('.json', _save_label_statistics, _load_label_statistics),
+}
+
+
 def dummy():
     """
     Just to check that the module is testable.
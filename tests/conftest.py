@@ -0,0 +1,43 @@
+#!/usr/env python3
+
+import pytest
+from pathlib import Path
+from PIL import Image
+import numpy as np
+import copy
+
+
+SEGMENTATION_DICT = { 'type': 'baselines',
+                      'lines': [ { 'line_id': 'l1', 'baseline': [[5,10],[50,10]], 'boundary': [[5,2],[50,2],[50,15],[5,15]] },
+                                 { 'line_id': 'l2', 'baseline': [[5,20],[50,20]], 'boundary': [[5,12],[50,12],[50,25],[5,25]] } ] }
+
+
+@pytest.fixture(scope="module")
+def data_path():
+    return Path( __file__ ).parent.joinpath('data')
+
+
+@pytest.fixture
+def segmentation_dict():
+    """
+    A segmentation dictionary with 2 (overlapping) lines, that fits a 40x60 page.
+    """
+    return copy.deepcopy( SEGMENTATION_DICT )
+
+
+@pytest.fixture
+def make_page():
+    """
+    A factory for small (40x60) pages of random pixels.
+
+    Args:
+        path (Path): where to save the image.
+        seed (int): seed of the random generator, for distinct (but reproducible) pages.
+
+    Output:
+        Path: the image path.
+    """
+    def make( path: Path, seed: int=0 ) -> Path:
+        Image.fromarray( np.random.default_rng( seed ).integers(0, 256, (40,60,3), dtype='uint8')).save( path )
+        return path
+    return make
@@ -0,0 +1,380 @@
+#!/usr/env python3
+
+import pytest
+from pathlib import Path
+from PIL import Image
+from types import SimpleNamespace
+import numpy as np
+import json
+import torch
+import multiprocessing
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import sys
+
+# Append app's root directory and the scripts' directory to the Python search path
+sys.path.append( str( Path(__file__).parents[1] ) )
+sys.path.append( str( Path(__file__).parents[1].joinpath('bin') ) )
+
+import ddp_line_detect
+import seglib
+
+
+MODEL_HASH = 'f' * 64
+
+@pytest.fixture
+def segmenter( monkeypatch, segmentation_dict ):
+    """
+    A stub for Kraken's segmentation, that returns a fixed segmentation dictionary (or raises, if told to),
+    and records the models it is called with.
+    """
+    stub = SimpleNamespace( models=[], error=None, segmentation_dict=segmentation_dict )
+    def segment( img, model=None ):
+        stub.models.append( model )
+        if stub.error is not None:
+            raise stub.error
+        return stub.segmentation_dict
+    monkeypatch.setattr( ddp_line_detect.blla, 'segment', segment )
+    # manifests cached by previous tests
+    ddp_line_detect._manifests.clear()
+    return stub
+
+
+@pytest.fixture
+def img_path( tmp_path, make_page ):
+    """
+    A small crop, in a 'seals' output folder.
+    """
+    crop_dir = tmp_path.joinpath('charter', 'd9ae9ea4.seals.crops')
+    crop_dir.mkdir( parents=True )
+    return str( make_page( crop_dir.joinpath('OldText.png') ))
+
+
+def make_args( output_format=('pt',), **kwargs ) -> SimpleNamespace:
+    args = dict( appname='lines', output_format=sorted( output_format ), just_show=False, pmap_uncompressed=False,
+                 img_paths=set(), img_list='', img_glob='' )
+    args.update( kwargs )
+    return SimpleNamespace( **args )
+
+
+def output_file( img_path: str, suffix: str ) -> Path:
+    """ The output of a crop, in its 'lines' folder. """
+    return Path( img_path ).parents[1].joinpath( 'd9ae9ea4.lines.lines', 'OldText' + suffix )
+
+
+def expected_map( img_path: str, segmentation_dict: dict ) -> torch.Tensor:
+    with Image.open( img_path ) as img:
+        return seglib.polygon_map_from_img_segmentation_dict( img, segmentation_dict )
+
+
+def test_load_model_missing_file( tmp_path ):
+    with pytest.raises( FileNotFoundError ):
+        ddp_line_detect.load_model( str( tmp_path.joinpath('missing.mlmodel') ))
+
+
+def test_segment_image_with_given_model( img_path, segmenter ):
+    """
+    A page is segmented with the model passed by the caller (loaded once per run), and its map stored.
+    """
+    model = object()
+    for _ in range(2):
+        assert ddp_line_detect.segment_image( img_path, model, make_args() ) > 0
+    assert segmenter.models == [ model, model ]
+    assert torch.equal( torch.load( output_file( img_path, '.pt' )), expected_map( img_path, segmenter.segmentation_dict ))
+
+
+def test_segment_image_just_show( img_path, segmenter, monkeypatch ):
+    """
+    With -just_show, an existing map is displayed, and the page is not segmented again (no model needed).
+    """
+    ddp_line_detect.segment_image( img_path, object(), make_args() )
+    shown = []
+    monkeypatch.setattr( Image.Image, 'show', lambda img: shown.append( img.size ))
+
+    ddp_line_detect.segment_image( img_path, None, make_args( just_show=True ))
+    assert len( segmenter.models ) == 1
+    assert shown == [ (60,40) ]
+
+
+def test_threads_per_worker( monkeypatch ):
+    """
+    The thread budget (default: one per core) is split among the workers, with at least one thread each.
+    """
+    monkeypatch.setattr( ddp_line_detect.os, 'cpu_count', lambda: 16 )
+    assert ddp_line_detect.threads_per_worker( 0, 4 ) == 4
+    assert ddp_line_detect.threads_per_worker( 8, 1 ) == 8
+    assert ddp_line_detect.threads_per_worker( 6, 4 ) == 1
+    assert ddp_line_detect.threads_per_worker( 2, 4 ) == 1
+
+
+def test_image_pixel_count( img_path, tmp_path ):
+    assert ddp_line_detect.image_pixel_count( img_path ) == 60*40
+    assert ddp_line_detect.image_pixel_count( str( tmp_path.joinpath('missing.png') )) == -1
+
+
+def test_segment_image_safe_reports_failure( img_path, segmenter ):
+    """
+    A failure is returned, not raised, so that the rest of the batch goes on.
+    """
+    segmenter.error = RuntimeError('out of memory')
+    assert ddp_line_detect.segment_image_safe( img_path, object(), make_args() ) == (img_path, None, 'RuntimeError: out of memory')
+
+
+def test_worker_pool( img_path, segmenter, monkeypatch ):
+    """
+    Each worker loads its own model in the pool initializer, and segments the pages it is sent
+    (workers are forked, so that they inherit the stubs).
+    """
+    monkeypatch.setattr( ddp_line_detect, 'load_model', lambda model_path: 'worker model' )
+    args = make_args( model_path='model.mlmodel' )
+    with ProcessPoolExecutor( 2, mp_context=multiprocessing.get_context('fork'), initializer=ddp_line_detect.init_worker, initargs=(args, 1) ) as executor:
+        results = [ executor.submit( ddp_line_detect.segment_image_safe, img_path ).result() ]
+
+    assert [ (path, error) for path, _, error in results ] == [ (img_path, None) ]
+    assert torch.equal( torch.load( output_file( img_path, '.pt' )), expected_map( img_path, segmenter.segmentation_dict ))
+
+
+def run_page( path: str, args, model_hash: str=MODEL_HASH ) -> bool:
+    """ Segment a page and record its status, as the script's main loop does; return True on success. """
+    input_hash = ddp_line_detect.seglib.file_sha256( path )
+    _, _, error = ddp_line_detect.segment_image_safe( path, object(), args )
+    ddp_line_detect.record_status( path, input_hash, model_hash, args, 'failed' if error is not None else 'done' )
+    return error is None
+
+
+def page_is_up_to_date( path: str, args, model_hash: str=MODEL_HASH ) -> bool:
+    output_dir, stem = ddp_line_detect.output_location( path, args.appname )
+    entry = ddp_line_detect.get_manifest( output_dir ).get( stem )
+    return ddp_line_detect.is_up_to_date( entry, output_dir, ddp_line_detect.seglib.file_sha256( path ), model_hash, args.output_format )
+
+
+def test_manifest_round_trip( img_path, segmenter ):
+    """
+    The manifest stored after a page is the one read back by a new run (empty cache).
+    """
+    args = make_args()
+    assert run_page( img_path, args )
+    output_dir, stem = ddp_line_detect.output_location( img_path, args.appname )
+    cached_manifest = ddp_line_detect.get_manifest( output_dir )
+
+    ddp_line_detect._manifests.clear()
+    manifest = ddp_line_detect.get_manifest( output_dir )
+    assert manifest == cached_manifest
+    assert manifest[ stem ]['status'] == 'done'
+    assert manifest[ stem ]['outputs'] == [ f'{stem}.pt' ]
+    assert manifest[ stem ]['model_sha256'] == MODEL_HASH
+
+
+def test_up_to_date_page_is_skipped( img_path, segmenter ):
+    """
+    A page segmented with the same input, the same model and the same format is up to date,
+    as well as for any subset of the formats produced.
+    """
+    assert not page_is_up_to_date( img_path, make_args() )
+    assert run_page( img_path, make_args( ('json', 'pt') ))
+
+    assert page_is_up_to_date( img_path, make_args( ('json', 'pt') ))
+    assert page_is_up_to_date( img_path, make_args( ('json',) ))
+
+
+def test_page_redone_on_input_change( img_path, segmenter ):
+    args = make_args()
+    assert run_page( img_path, args )
+    Image.fromarray( np.zeros((40,60,3), dtype='uint8')).save( img_path )
+    assert not page_is_up_to_date( img_path, args )
+
+
+def test_page_redone_on_model_change( img_path, segmenter ):
+    args = make_args()
+    assert run_page( img_path, args )
+    assert not page_is_up_to_date( img_path, args, model_hash='0' * 64 )
+
+
+def test_page_redone_on_format_change( img_path, segmenter ):
+    assert run_page( img_path, make_args( ('pt',) ))
+    assert not page_is_up_to_date( img_path, make_args( ('json', 'pt') ))
+
+
+def test_page_redone_on_missing_output( img_path, segmenter ):
+    args = make_args()
+    assert run_page( img_path, args )
+    output_file( img_path, '.pt' ).unlink()
+    assert not page_is_up_to_date( img_path, args )
+
+
+def test_failed_page_is_retried( img_path, segmenter ):
+    """
+    A failed page is recorded as such, with no output, and is not up to date: the next run retries it.
+    """
+    args = make_args()
+    segmenter.error = RuntimeError('out of memory')
+    assert not run_page( img_path, args )
+
+    output_dir, stem = ddp_line_detect.output_location( img_path, args.appname )
+    entry = ddp_line_detect.get_manifest( output_dir )[ stem ]
+    assert (entry['status'], entry['outputs']) == ('failed', [])
+    assert not page_is_up_to_date( img_path, args )
+
+    segmenter.error = None
+    assert run_page( img_path, args )
+    assert page_is_up_to_date( img_path, args )
+
+
+def test_atomic_output_no_partial_write( tmp_path ):
+    """
+    A write that raises leaves neither a partial output nor a temporary file behind, and the previous
+    output (if any) is kept.
+    """
+    output_path = tmp_path.joinpath('page.json')
+    with pytest.raises( RuntimeError ):
+        with ddp_line_detect.atomic_output( output_path ) as fp:
+            fp.write('{"lines": [')
+            raise RuntimeError('killed')
+    assert list( tmp_path.iterdir() ) == []
+
+    output_path.write_text('{}')
+    with pytest.raises( RuntimeError ):
+        with ddp_line_detect.atomic_output( output_path ) as fp:
+            fp.write('{"lines": [')
+            raise RuntimeError('killed')
+    assert list( tmp_path.iterdir() ) == [ output_path ]
+    assert output_path.read_text() == '{}'
+
+
+def test_segment_image_no_partial_output( img_path, segmenter, monkeypatch ):
+    """
+    A page whose output cannot be written fails, without any output file left in the output folder.
+    """
+    def save( obj, f ):
+        f.write( b'partial' )
+        raise OSError('No space left on device')
+    monkeypatch.setattr( ddp_line_detect.torch, 'save', save )
+
+    args = make_args()
+    assert not run_page( img_path, args )
+
+    output_dir, stem = ddp_line_detect.output_location( img_path, args.appname )
+    assert [ p.name for p in output_dir.iterdir() ] == [ ddp_line_detect.MANIFEST_NAME ]
+
+
+@pytest.fixture
+def img_tree( tmp_path ):
+    """
+    Crops of different sizes, in two charter folders; return their paths, largest first.
+    """
+    paths = []
+    for i, (height, width) in enumerate( ((40,80), (30,60), (20,40), (10,20)) ):
+        crop_dir = tmp_path.joinpath( 'charter{}'.format( i % 2 ), 'crop{}.seals.crops'.format( i ))
+        crop_dir.mkdir( parents=True )
+        path = crop_dir.joinpath('OldText.png')
+        Image.fromarray( np.zeros((height, width, 3), dtype='uint8')).save( path )
+        paths.append( str( path ))
+    return paths
+
+
+def test_iter_img_paths_list_file( img_tree, tmp_path ):
+    """
+    Paths are read from a list file, blank lines ignored.
+    """
+    list_path = tmp_path.joinpath('images.lst')
+    list_path.write_text( '\n'.join( img_tree ) + '\n\n' )
+    assert list( ddp_line_detect.iter_img_paths( make_args( img_list=str( list_path )))) == img_tree
+
+
+def test_iter_img_paths_stdin( img_tree, monkeypatch ):
+    monkeypatch.setattr( sys, 'stdin', io.StringIO( ''.join( f' {path}\n' for path in img_tree )))
+    assert list( ddp_line_detect.iter_img_paths( make_args( img_list='-' ))) == img_tree
+
+
+def test_iter_img_paths_glob( img_tree, tmp_path ):
+    """
+    The pattern is expanded (recursively) by the script itself.
+    """
+    paths = ddp_line_detect.iter_img_paths( make_args( img_glob=str( tmp_path.joinpath('**', '*.seals.crops', 'OldText.png'))))
+    assert sorted( paths ) == sorted( img_tree )
+
+
+def test_iter_img_paths_default( img_tree ):
+    """
+    With no list nor pattern, the -img_paths set is used.
+    """
+    assert sorted( ddp_line_detect.iter_img_paths( make_args( img_paths=set( img_tree )))) == sorted( img_tree )
+
+
+def test_largest_first_no_reordering( img_tree, monkeypatch ):
+    """
+    Without reordering, the paths are passed through, and no image is opened.
+    """
+    def image_pixel_count( path ):
+        raise AssertionError("Image opened: {}".format( path ))
+    monkeypatch.setattr( ddp_line_detect, 'image_pixel_count', image_pixel_count )
+    for lookahead in (0, 1):
+        assert list( ddp_line_detect.largest_first( img_tree[::-1], lookahead )) == img_tree[::-1]
+
+
+def test_largest_first_full_lookahead( img_tree, tmp_path ):
+    """
+    With a buffer as large as the input, paths are sorted by decreasing size; an unreadable image comes last.
+    """
+    missing_path = str( tmp_path.joinpath('missing.png') )
+    paths = [ img_tree[2], missing_path, img_tree[0], img_tree[3], img_tree[1] ]
+    assert list( ddp_line_detect.largest_first( paths, len( paths ))) == img_tree + [ missing_path ]
+
+
+def test_largest_first_lookahead( img_tree ):
+    """
+    The largest image is taken among the next <lookahead> queued paths only.
+    """
+    small, medium, large, largest = img_tree[::-1]
+    assert list( ddp_line_detect.largest_first( [small, large, medium, largest], 2 )) == [large, medium, largest, small]
+
+
+def test_largest_first_lazy( img_tree ):
+    """
+    Paths are yielded as they come: an endless input does not prevent the first paths from being dispatched.
+    """
+    paths = ddp_line_detect.largest_first( itertools.cycle( img_tree[::-1] ), 3 )
+    assert list( itertools.islice( paths, 2 )) == [ img_tree[1], img_tree[0] ]
+
+
+def test_segment_image_all_formats_single_pass( img_path, segmenter ):
+    """
+    All the output formats are written from a single segmentation.
+    """
+    model = object()
+    path, elapsed, error = ddp_line_detect.segment_image_safe( img_path, model, make_args( ('json', 'pt', 'pmap') ))
+
+    assert error is None and elapsed > 0
+    assert segmenter.models == [ model ]
+    assert json.loads( output_file( img_path, '.json' ).read_text()) == segmenter.segmentation_dict
+    assert torch.equal( torch.load( output_file( img_path, '.pt' )), expected_map( img_path, segmenter.segmentation_dict ))
+    assert seglib.is_compressed_polygon_map_file( output_file( img_path, '.pmap' ))
+    assert torch.equal( seglib.load_polygon_map( output_file( img_path, '.pmap' )), expected_map( img_path, segmenter.segmentation_dict ))
+
+
+def test_segment_image_just_show_pmap( img_path, segmenter, monkeypatch ):
+    """
+    With -just_show, a pmap container is displayed as well.
+    """
+    ddp_line_detect.segment_image( img_path, object(), make_args( ('pmap',) ))
+    shown = []
+    monkeypatch.setattr( Image.Image, 'show', lambda img: shown.append( img.size ))
+
+    ddp_line_detect.segment_image( img_path, None, make_args( just_show=True ))
+    assert len( segmenter.models ) == 1
+    assert shown == [ (60,40) ]
+
+
+def test_segment_image_uncompressed_pmap( img_path, segmenter ):
+    """
+    An uncompressed pmap output holds the same map, and can be memory-mapped.
+    """
+    assert ddp_line_detect.segment_image_safe( img_path, object(), make_args( ('pmap',), pmap_uncompressed=True ))[2] is None
+
+    map_path = output_file( img_path, '.pmap' )
+    assert not seglib.is_compressed_polygon_map_file( map_path )
+    assert torch.equal( seglib.load_polygon_map( map_path, mmap=True ), expected_map( img_path, segmenter.segmentation_dict ))
+    # only the requested format
+    assert sorted( p.name for p in map_path.parent.iterdir() ) == [ 'OldText.pmap' ]
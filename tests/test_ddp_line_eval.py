@@ -0,0 +1,183 @@
+#!/usr/env python3
+
+import pytest
+from pathlib import Path
+from PIL import Image
+import json
+import numpy as np
+import io
+import subprocess
+
+import sys
+
+# Append app's root directory and the scripts' directory to the Python search path
+sys.path.append( str( Path(__file__).parents[1] ) )
+sys.path.append( str( Path(__file__).parents[1].joinpath('bin') ) )
+
+import ddp_line_eval
+import seglib
+
+EVAL_SCRIPT = Path( __file__ ).parents[1].joinpath('bin', 'ddp_line_eval.py')
+
+# a prediction that overlaps the GT lines of conftest.SEGMENTATION_DICT (rows 2-15 and 12-25): the first line
+# is a good match, the second one spills over (low precision)
+OVERLAPPING_PREDICTION = { 'lines': [ { 'line_id': 'p1', 'baseline': [[5,12],[50,12]], 'boundary': [[5,4],[50,4],[50,15],[5,15]] },
+                                      { 'line_id': 'p2', 'baseline': [[5,30],[50,30]], 'boundary': [[5,14],[50,14],[50,34],[5,34]] } ] }
+
+
+@pytest.fixture
+def page_triplet( tmp_path, make_page, segmentation_dict ):
+    """
+    A small page image, with a GT segmentation of 2 lines, and an empty prediction.
+    """
+    img_path, gt_path, pred_path = [ tmp_path.joinpath( name ) for name in ('page.png', 'gt.json', 'pred.json') ]
+    make_page( img_path, seed=1 )
+    gt_path.write_text( json.dumps( segmentation_dict ))
+    pred_path.write_text( json.dumps( { 'lines': [] } ))
+    return (str(img_path), str(pred_path), str(gt_path))
+
+
+@pytest.mark.parametrize('mode', ['pixel', 'geometric'])
+def test_evaluate_page_empty_prediction( page_triplet, mode ):
+    """
+    A page with no predicted line is not reported as failed: as on any page, only intersecting pairs
+    are counted, so that it has no TP, FP nor FN, and undefined scores.
+    """
+    triplet, record, error = ddp_line_eval.evaluate_page( page_triplet, mode, .5 )
+
+    assert error is None
+    assert (record['lines_pred'], record['lines_gt']) == (0, 2)
+    assert (record['TP'], record['FP'], record['FN']) == (0, 0, 0)
+    assert all( np.isnan( record[ field ] ) for field in ('Jaccard', 'F1', 'pixel_IU', 'matched_pixel_IU') )
+
+
+@pytest.mark.parametrize('mode', ['pixel', 'geometric'])
+def test_evaluate_page_no_intersecting_pair( page_triplet, mode ):
+    """
+    A prediction that does not overlap the GT lines is scored the same as an empty one: the page counts
+    in the micro totals (with no TP, FP nor FN), but is left out of the macro averages.
+    """
+    img_path, pred_path, gt_path = page_triplet
+    Path( pred_path ).write_text( json.dumps( { 'lines': [ { 'line_id': 'p1', 'baseline': [[5,32],[50,32]], 'boundary': [[5,30],[50,30],[50,34],[5,34]] } ] } ))
+
+    triplet, record, error = ddp_line_eval.evaluate_page( page_triplet, mode, .5 )
+
+    assert error is None
+    assert (record['TP'], record['FP'], record['FN']) == (0, 0, 0)
+    assert np.isnan( record['Jaccard'] ) and np.isnan( record['F1'] )
+
+    # GT as prediction: a perfect page
+    triplet, perfect_record, error = ddp_line_eval.evaluate_page( (img_path, gt_path, gt_path), mode, .5 )
+    assert (perfect_record['TP'], perfect_record['FP'], perfect_record['FN'], perfect_record['F1']) == (2, 0, 0, 1)
+
+    totals = ddp_line_eval.CorpusTotals()
+    totals.add( record )
+    totals.add( perfect_record )
+    summary = totals.summary()
+    assert summary['pages'] == 2
+    assert summary['counts']['TP'] == 2 and summary['counts']['FN'] == 0
+    assert summary['micro']['F1'] == 1
+    assert summary['macro']['F1'] == 1
+
+
+@pytest.mark.parametrize('mode', ['pixel', 'geometric'])
+def test_evaluate_page_scores( page_triplet, mode ):
+    """
+    On a page where predicted and GT lines overlap, the page record holds the scores that seglib computes
+    from the page's metrics matrix.
+    """
+    img_path, pred_path, gt_path = page_triplet
+    Path( pred_path ).write_text( json.dumps( OVERLAPPING_PREDICTION ))
+
+    triplet, record, error = ddp_line_eval.evaluate_page( page_triplet, mode, .75 )
+
+    assert error is None
+    with Image.open( img_path ) as img:
+        if mode == 'geometric':
+            metrics = seglib.polygon_geometric_metrics_from_segmentation_dicts( OVERLAPPING_PREDICTION, json.loads( Path( gt_path ).read_text() ), img.size )
+        else:
+            metrics = seglib.polygon_pixel_metrics_from_img_segmentation_dict( img, OVERLAPPING_PREDICTION, json.loads( Path( gt_path ).read_text() ))
+    TP, FP, FN, Jaccard, F1 = seglib.polygon_pixel_metrics_to_line_based_scores( metrics, .75 )
+    pixel_iu, matched_pixel_iu = seglib.polygon_pixel_metrics_to_pixel_based_scores( metrics )
+
+    # every pred line intersects both GT lines; the spilling line is a FP
+    assert np.all( metrics[:,:,0] > 0 )
+    assert (record['TP'], record['FP'], record['FN']) == (TP, FP, FN) == (1, 1, 0)
+    assert record['Jaccard'] == pytest.approx( Jaccard ) and record['F1'] == pytest.approx( F1 )
+    assert record['pixel_IU'] == pytest.approx( pixel_iu ) and record['matched_pixel_IU'] == pytest.approx( matched_pixel_iu )
+    assert record['intersection'] / record['union'] == pytest.approx( pixel_iu )
+
+
+def test_corpus_totals_summary():
+    """
+    Micro-averaged scores come from the summed counts; macro-averaged scores are the mean of the
+    per-page scores, over the pages where they are defined.
+    """
+    nan = float('nan')
+    records = [ { 'TP': 2., 'FP': 0., 'FN': 1., 'Jaccard': 2/3, 'F1': .8, 'pixel_IU': .5, 'matched_pixel_IU': .6, 'intersection': 50., 'union': 100. },
+                { 'TP': 1., 'FP': 1., 'FN': 0., 'Jaccard': .5, 'F1': 2/3, 'pixel_IU': .25, 'matched_pixel_IU': .4, 'intersection': 25., 'union': 100. },
+                { 'TP': 0., 'FP': 0., 'FN': 0., 'Jaccard': nan, 'F1': nan, 'pixel_IU': nan, 'matched_pixel_IU': nan, 'intersection': 0., 'union': 0. } ]
+    totals = ddp_line_eval.CorpusTotals()
+    for record in records:
+        totals.add( record )
+
+    summary = totals.summary()
+    assert summary['pages'] == 3
+    assert summary['counts'] == { 'TP': 3, 'FP': 1, 'FN': 1, 'intersection': 75, 'union': 200 }
+    assert summary['micro'] == pytest.approx( { 'Jaccard': 3/5, 'F1': 6/8, 'pixel_IU': 75/200 } )
+    assert summary['macro'] == pytest.approx( { 'Jaccard': (2/3+.5)/2, 'F1': (.8+2/3)/2, 'pixel_IU': .375, 'matched_pixel_IU': .5 } )
+
+
+def test_corpus_totals_summary_no_page():
+    summary = ddp_line_eval.CorpusTotals().summary()
+    assert summary['pages'] == 0
+    assert all( np.isnan( v ) for averaging in ('micro', 'macro') for v in summary[ averaging ].values() )
+
+
+def test_write_row():
+    """
+    A row has the table's columns, in order: floats with 6 significant digits, undefined scores as 'nan'.
+    """
+    record = { 'page': 'page.png', 'lines_pred': 1, 'lines_gt': 2, 'TP': 1.0, 'FP': 1.0, 'FN': 0.0, 'Jaccard': .5, 'F1': 2/3,
+               'pixel_IU': .25, 'matched_pixel_IU': float('nan'), 'seconds': 0.1234567, 'intersection': 25., 'union': 100. }
+    output = io.StringIO()
+
+    ddp_line_eval.write_row( output, record )
+
+    assert output.getvalue() == 'page.png\t1\t2\t1\t1\t0\t0.5\t0.666667\t0.25\tnan\t0.123457\n'
+    assert len( output.getvalue().split('\t') ) == len( ddp_line_eval.COLUMNS )
+
+
+def run_eval( list_path: Path, output_dir: Path, workers: int ) -> subprocess.CompletedProcess:
+    output_dir.mkdir()
+    return subprocess.run( [ sys.executable, str(EVAL_SCRIPT), '-page_list={}'.format( list_path ), '-workers={}'.format( workers ),
+                             '-output_file={}'.format( output_dir.joinpath('eval.tsv') ), '-summary_file={}'.format( output_dir.joinpath('summary.json') ) ],
+                           capture_output=True, text=True )
+
+
+def test_eval_workers_same_output( tmp_path, make_page, segmentation_dict ):
+    """
+    The per-page table (but for row order and timings) and the corpus totals do not depend on the number of worker processes.
+    """
+    gt_path, pred_path = tmp_path.joinpath('gt.json'), tmp_path.joinpath('pred.json')
+    gt_path.write_text( json.dumps( segmentation_dict ))
+    pred_path.write_text( json.dumps( OVERLAPPING_PREDICTION ))
+    list_path = tmp_path.joinpath('pages.tsv')
+    list_path.write_text( ''.join( '{}\t{}\t{}\n'.format( make_page( tmp_path.joinpath('page{}.png'.format(p)), seed=p ), pred_path, gt_path ) for p in range(5) ))
+
+    single_dir, pool_dir = tmp_path.joinpath('single'), tmp_path.joinpath('pool')
+    assert run_eval( list_path, single_dir, 1 ).returncode == 0
+    assert run_eval( list_path, pool_dir, 2 ).returncode == 0
+
+    def rows( output_dir: Path ) -> list:
+        header, *rows = [ line.split('\t') for line in output_dir.joinpath('eval.tsv').read_text().splitlines() ]
+        assert header == list( ddp_line_eval.COLUMNS )
+        # timings left out
+        return sorted( row[:-1] for row in rows )
+
+    assert len( rows( single_dir )) == 5
+    assert rows( pool_dir ) == rows( single_dir )
+    summary, pool_summary = [ json.loads( output_dir.joinpath('summary.json').read_text() ) for output_dir in (single_dir, pool_dir) ]
+    assert pool_summary['pages'] == summary['pages'] == 5
+    for entry in ('counts', 'micro', 'macro'):
+        assert pool_summary[ entry ] == pytest.approx( summary[ entry ] )
@@ -0,0 +1,139 @@
+#!/usr/env python3
+
+import pytest
+from pathlib import Path
+import json
+import subprocess
+import tarfile
+
+import sys
+
+# Append app's root directory to the Python search path
+sys.path.append( str( Path(__file__).parents[1] ) )
+
+EXPORT_SCRIPT = Path( __file__ ).parents[1].joinpath('bin', 'ddp_line_export.py')
+
+
+def make_page_list( tmp_path: Path, make_page, segmentation_dict: dict, page_count: int ) -> tuple:
+    """
+    A list of small pages, each with a JSON segmentation of 2 lines.
+    """
+    pairs = []
+    for p in range( page_count ):
+        img_path, json_path = tmp_path.joinpath('page{}.png'.format(p)), tmp_path.joinpath('page{}.json'.format(p))
+        make_page( img_path, seed=p )
+        json_path.write_text( json.dumps( segmentation_dict ))
+        pairs.append( (img_path, json_path) )
+    list_path = tmp_path.joinpath('pages.tsv')
+    list_path.write_text( ''.join( '{}\t{}\n'.format( *pair ) for pair in pairs ))
+    return (list_path, pairs)
+
+
+@pytest.fixture
+def page_list( tmp_path, make_page, segmentation_dict ):
+    return make_page_list( tmp_path, make_page, segmentation_dict, 3 )
+
+
+@pytest.fixture
+def long_page_list( tmp_path, make_page, segmentation_dict ):
+    return make_page_list( tmp_path, make_page, segmentation_dict, 12 )
+
+
+def run_export( list_path: Path, output_dir: Path, shard_size: float=0.000001, workers: int=1 ) -> subprocess.CompletedProcess:
+    # default: a tiny shard size, for one shard per page
+    return subprocess.run( [ sys.executable, str(EXPORT_SCRIPT), '-page_list={}'.format( list_path ), '-output_dir={}'.format( output_dir ),
+                             '-shard_size={}'.format( shard_size ), '-workers={}'.format( workers ) ], capture_output=True, text=True )
+
+
+def exported_members( output_dir: Path ) -> dict:
+    members = {}
+    for shard_path in sorted( output_dir.glob('lines-*.tar') ):
+        with tarfile.open( shard_path ) as tar:
+            members.update( { m.name: tar.extractfile( m ).read() for m in tar.getmembers() } )
+    return members
+
+
+def index_records( output_dir: Path ) -> list:
+    return [ json.loads( line ) for line in output_dir.joinpath('index.jsonl').read_text().splitlines() ]
+
+
+def test_export_shard_size( long_page_list, tmp_path ):
+    """
+    Shards are filled with whole pages, up to the maximum size (tar padding included).
+    """
+    list_path, pairs = long_page_list
+    output_dir = tmp_path.joinpath('export')
+    assert run_export( list_path, output_dir, shard_size=0.03 ).returncode == 0
+
+    records = index_records( output_dir )
+    assert 1 < len( records ) < len( pairs )
+    assert [ p for r in records for p in r['pages'] ] == list( range( len( pairs )))
+    for record in records:
+        size = output_dir.joinpath( record['shard'] ).stat().st_size
+        assert size == record['size']
+        assert size <= 0.03 * 2**20
+
+
+def test_export_index_matches_shards( long_page_list, tmp_path ):
+    """
+    The index lists every shard, and the keys of every shard, in order; a key has 3 members.
+    """
+    list_path, pairs = long_page_list
+    output_dir = tmp_path.joinpath('export')
+    assert run_export( list_path, output_dir, shard_size=0.03 ).returncode == 0
+
+    records = index_records( output_dir )
+    assert [ r['shard'] for r in records ] == [ path.name for path in sorted( output_dir.glob('lines-*.tar') )]
+    for record in records:
+        with tarfile.open( output_dir.joinpath( record['shard'] )) as tar:
+            names = tar.getnames()
+        assert record['samples'] == len( record['keys'] ) == 2 * len( record['pages'] )
+        assert names == [ '{}.{}'.format( key, suffix ) for key in record['keys'] for suffix in ('img.png', 'mask.png', 'json') ]
+
+
+def test_export_workers_same_output( long_page_list, tmp_path ):
+    """
+    The shards and the index do not depend on the number of worker processes.
+    """
+    list_path, pairs = long_page_list
+    single_dir, pool_dir = tmp_path.joinpath('single'), tmp_path.joinpath('pool')
+    assert run_export( list_path, single_dir, shard_size=0.03, workers=1 ).returncode == 0
+    assert run_export( list_path, pool_dir, shard_size=0.03, workers=3 ).returncode == 0
+
+    assert pool_dir.joinpath('index.jsonl').read_text() == single_dir.joinpath('index.jsonl').read_text()
+    shards = sorted( path.name for path in single_dir.glob('lines-*.tar') )
+    assert sorted( path.name for path in pool_dir.glob('lines-*.tar') ) == shards
+    for shard in shards:
+        assert pool_dir.joinpath( shard ).read_bytes() == single_dir.joinpath( shard ).read_bytes()
+
+
+def test_export_resume_retries_failed_page( page_list, tmp_path ):
+    """
+    A page that fails is recorded as such, not as exported: once fixed, the next run exports its lines, and the
+    export ends up with the same samples as an export that never failed.
+    """
+    list_path, pairs = page_list
+    reference_dir, output_dir = tmp_path.joinpath('reference'), tmp_path.joinpath('export')
+    assert run_export( list_path, reference_dir ).returncode == 0
+
+    # page #1's image is missing
+    img_path = pairs[1][0]
+    img_path.rename( img_path.with_suffix('.bak') )
+    result = run_export( list_path, output_dir )
+    assert result.returncode == 1
+    records = index_records( output_dir )
+    assert [ r['pages'] for r in records ] == [[0], [2]]
+    assert [ p for r in records for p in r['failed'] ] == [1]
+    assert not any( key.startswith('00000001_') for r in records for key in r['keys'] )
+
+    # image restored: the failed page (and only it) is exported
+    img_path.with_suffix('.bak').rename( img_path )
+    result = run_export( list_path, output_dir )
+    assert result.returncode == 0
+    assert 'Exported 2 lines' in result.stderr
+    assert exported_members( output_dir ) == exported_members( reference_dir )
+
+    # nothing left to do
+    result = run_export( list_path, output_dir )
+    assert result.returncode == 0
+    assert 'Exported 0 lines' in result.stderr
@@ -0,0 +1,60 @@
+#!/usr/env python3
+
+import pytest
+from pathlib import Path
+import json
+import itertools
+import numpy as np
+
+import sys
+
+# Append app's root directory and the scripts' directory to the Python search path
+sys.path.append( str( Path(__file__).parents[1] ) )
+sys.path.append( str( Path(__file__).parents[1].joinpath('bin') ) )
+
+import ddp_segpack
+import seglib
+
+
+@pytest.fixture
+def named_files( tmp_path, segmentation_dict ):
+    """
+    (name, file) pairs for 20 JSON segmentation files, each with a distinct number of lines.
+    """
+    pairs = []
+    for p in range(20):
+        json_path = tmp_path.joinpath('page{}.json'.format(p))
+        json_path.write_text( json.dumps( dict( segmentation_dict, lines=segmentation_dict['lines'][:p % 3] )))
+        pairs.append( ('page{}'.format(p), str(json_path)) )
+    return pairs
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_iter_named_pages_input_order( named_files, workers ):
+    pages = list( ddp_segpack.iter_named_pages( named_files, workers, batch_size=3 ))
+
+    assert [ name for name, _ in pages ] == [ name for name, _ in named_files ]
+    assert [ len( segdict['lines'] ) for _, segdict in pages ] == [ p % 3 for p in range(20) ]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_iter_named_pages_lazy( named_files, workers ):
+    """
+    Pages come out as the list is read: an endless list does not prevent the first pages from being stored.
+    """
+    pages = ddp_segpack.iter_named_pages( itertools.cycle( named_files ), workers, batch_size=2 )
+    assert [ name for name, _ in itertools.islice( pages, 3 ) ] == ['page0', 'page1', 'page2']
+    pages.close()
+
+
+def test_iter_named_pages_store( named_files, tmp_path ):
+    """
+    A store packed from the parallel parser holds the same pages as one packed from the files, one at a time.
+    """
+    seglib.save_segmentation_store( tmp_path.joinpath('reference'), [ (name, seglib.segmentation_dict_from_file( f )) for name, f in named_files ] )
+    seglib.save_segmentation_store( tmp_path.joinpath('store'), ddp_segpack.iter_named_pages( named_files, 2 ))
+
+    reference, store = seglib.SegmentationStore( tmp_path.joinpath('reference') ), seglib.SegmentationStore( tmp_path.joinpath('store') )
+    assert store.page_names() == reference.page_names()
+    for name in store.page_names():
+        assert all( np.array_equal( l['boundary'], rl['boundary'] ) for l, rl in zip( store[name]['lines'], reference[name]['lines'] ))
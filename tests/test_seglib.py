@@ -9,6 +9,8 @@ from torch import Tensor
 import numpy as np
 import torch
 from functools import partial
+import skimage as ski
+import xml.etree.ElementTree as ET
 
 import sys
 
@@ -18,11 +20,6 @@ sys.path.append( str( Path(__file__).parents[1] ) )
 import seglib
 
 
-
-@pytest.fixture(scope="module")
-def data_path():
-    return Path( __file__ ).parent.joinpath('data')
-
 def test_dummy( data_path):
     """
     A dummy test, as a sanity check for the test framework.
@@ -60,6 +57,105 @@ def test_binary_mask_from_image_fg_bg():
     assert torch.sum(binary_map).item() == 1 # remaining pixels = F
 
 
+@pytest.mark.parametrize('thresholding_alg', ['otsu', 'sauvola'])
+def test_binary_mask_from_image_fg_bg_integer_methods( thresholding_alg ):
+    """
+    Integer-arithmetic methods: binary map should be 1 for FG pixels, 0 otherwise.
+    """
+    img_arr = np.full((15,15,3), 200, dtype=np.uint8 ) # background
+    img_arr[8,8]=5 # foreground = 1 pixel
+    binary_map = seglib.get_mask( Image.fromarray( img_arr), thresholding_alg )
+    assert binary_map.dtype == torch.bool
+    assert binary_map[8,8] == 1 # single FG pixel = T
+    assert torch.sum(binary_map).item() == 1 # remaining pixels = F
+
+
+def test_binary_mask_cached_per_image():
+    """
+    The same image is binarized only once, as long as the parameters are the same; every caller gets
+    its own copy of the mask.
+    """
+    img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (20,30,3), dtype='uint8'))
+    calls = []
+    def threshold_otsu( gray ):
+        calls.append( gray.shape )
+        return ski.filters.threshold_otsu( gray )
+    mask = seglib.get_mask( img, threshold_otsu )
+    expected = mask.clone()
+    mask[:] = True
+
+    assert torch.equal( seglib.get_mask( img, threshold_otsu ), expected )
+    assert len( calls ) == 1
+    assert torch.equal( seglib.get_mask( img.copy(), threshold_otsu ), expected )
+    assert len( calls ) == 2
+
+
+def test_binary_mask_grayscale_image():
+    """
+    On a grayscale page, the default threshold is on the same scale as the pixels.
+    """
+    img_arr = np.full((15,15), 200, dtype=np.uint8 ) # background
+    img_arr[8,8]=5 # foreground = 1 pixel
+    binary_map = seglib.get_mask( Image.fromarray( img_arr ))
+    assert binary_map[8,8] == 1
+    assert torch.sum(binary_map).item() == 1
+
+
+def test_grayscale_uint8():
+    """
+    Integer grayscale conversion is within rounding of ski.color.rgb2gray().
+    """
+    img_arr = np.random.default_rng(1).integers(0, 256, (20,30,3), dtype='uint8')
+
+    gray = seglib.grayscale_uint8( Image.fromarray( img_arr ))
+
+    assert gray.dtype == np.uint8
+    assert np.max( np.abs( gray - ski.color.rgb2gray( img_arr )*255 )) <= .51
+    assert np.array_equal( seglib.grayscale_uint8( Image.fromarray( gray )), gray )
+
+
+def test_otsu_threshold_same_as_skimage():
+    """
+    Histogram-based Otsu threshold is the same as skimage's; a subsampled histogram gives a close one.
+    """
+    rng = np.random.default_rng(1)
+    gray = np.clip( np.concatenate( [ rng.normal( 60, 20, 2000 ), rng.normal( 190, 15, 6000 ) ] ), 0, 255 ).astype('uint8').reshape(80,100)
+
+    assert seglib.otsu_threshold( gray ) == ski.filters.threshold_otsu( gray )
+    assert abs( seglib.otsu_threshold( gray, 2 ) - seglib.otsu_threshold( gray )) <= 5
+
+
+def test_sauvola_threshold_uneven_background():
+    """
+    Local thresholds find dark strokes on an uneven background, away from the page edges as well
+    as on them; they match skimage's thresholds away from the edges.
+    """
+    background = np.linspace( 120, 240, 100 )[None,:].repeat( 60, axis=0 )
+    gray = background.copy()
+    gray[20:23, 10:90] -= 80
+    gray = gray.astype('uint8')
+
+    thresholds = seglib.sauvola_threshold( gray, window_size=15 )
+
+    assert np.array_equal( gray <= thresholds, np.pad( np.ones((3,80), dtype='bool'), ((20,37),(10,10)) ))
+    assert thresholds.dtype == np.float32
+    assert np.allclose( thresholds[7:-7,7:-7], ski.filters.threshold_sauvola( gray, window_size=15 )[7:-7,7:-7], atol=.05 )
+
+
+def test_polygon_pixel_metrics_from_img_segmentation_dict_precomputed_mask():
+    """
+    A precomputed FG mask is used instead of the page's binarization.
+    """
+    img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (40,60,3), dtype='uint8'))
+    segdict = { 'lines': [ { 'line_id': 'l1', 'baseline': [[5,10],[50,10]], 'boundary': [[5,2],[50,2],[50,15],[5,15]] } ] }
+    full_mask = torch.ones((40,60), dtype=torch.bool)
+
+    metrics = seglib.polygon_pixel_metrics_from_img_segmentation_dict( img, segdict, segdict, binary_mask=full_mask )
+
+    # all pixels of the polygon count
+    assert metrics[0,0,0] == 46*14
+
+
 def test_line_binary_mask_from_img_segmentation_dict( data_path, ndarrays_regression ):
     """
     Provided an image and a segmentation dictionary, should return a boolean mask for all lines.
@@ -101,6 +197,30 @@ def test_line_images_from_img_segmentation_dict_image_content_checking( data_pat
         })
 
 
+@pytest.mark.parametrize('img_shape',[(16,20,3), (16,20)])
+def test_line_images_from_img_segmentation_dict_page_edges( img_shape ):
+    """
+    Crops and masks of polygons that extend past the page edges are clipped to the page: they match
+    the page-wide mask within the clipped bounding box.
+    """
+    input_img = Image.fromarray( np.random.default_rng(1).integers(0, 256, img_shape, dtype='uint8'))
+    polygons = [[[2,1],[12,3],[10,9],[3,7]], [[-4,-2],[6,1],[5,8],[-1,6]], [[15,8],[25,10],[22,20],[14,18]], [[30,30],[40,30],[40,40]]]
+    segmentation_dict = { 'lines': [ { 'boundary': polygon } for polygon in polygons ] }
+
+    imgs_and_masks = seglib.line_images_from_img_segmentation_dict( input_img, segmentation_dict )
+
+    img_array = np.asarray( input_img )
+    for polygon, (line_img, line_mask) in list( zip( polygons, imgs_and_masks ))[:3]:
+        full_mask = ski.draw.polygon2mask( img_shape[:2], np.array( polygon )[:,::-1] )
+        ys, xs = full_mask.nonzero()
+        window = (slice( max(0, min(p[1] for p in polygon)), max(ys)+1 ), slice( max(0, min(p[0] for p in polygon)), max(xs)+1 ))
+        assert np.array_equal( line_img, img_array[ window ] )
+        assert line_mask.shape == line_img.shape
+        assert np.array_equal( line_mask if line_mask.ndim == 2 else line_mask[:,:,0], full_mask[ window ] )
+    # out of the page
+    assert imgs_and_masks[3][0].size == 0 and imgs_and_masks[3][1].size == 0
+
+
 def test_line_images_from_img_polygon_map_type_checking( data_path ):
     """
     The elements in the pair (image and mask) should both be numpy arrays with shape (H,W,3).
@@ -130,6 +250,99 @@ def test_line_images_from_img_polygon_map_content_checking( data_path, ndarrays_
         'image4': imgs_and_masks[3][0], 'mask4': imgs_and_masks[3][1],
         })
 
+def test_line_images_from_img_polygon_map_single_pass():
+    """
+    Crops and masks cover each label's bounding box (labels missing from the map are skipped), whatever
+    the map's representation.
+    """
+    input_img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8'))
+    polygon_map_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+
+    imgs_and_masks = seglib.line_images_from_img_polygon_map( input_img, polygon_map_chw )
+    imgs_and_masks_sparse = seglib.line_images_from_img_polygon_map( input_img, seglib.polygon_map_to_sparse( polygon_map_chw ))
+
+    assert len(imgs_and_masks) == 3
+    assert np.array_equal( imgs_and_masks[1][0], np.asarray( input_img )[2:4,2:5] )
+    assert np.array_equal( imgs_and_masks[1][1][:,:,0], np.array([[1,1,0],[1,1,1]], dtype='bool'))
+    assert imgs_and_masks[2][1].shape == (4,4,3)
+    assert all( np.array_equal( d[0], s[0] ) and np.array_equal( d[1], s[1] ) for d, s in zip( imgs_and_masks, imgs_and_masks_sparse ))
+
+
+def test_line_images_from_img_polygon_map_grayscale_image():
+    """
+    Masks have 3 channels, whatever the image's; crops are taken from the image as it is.
+    """
+    input_img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6), dtype='uint8'))
+    polygon_map_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [0,0,0,0,0,0],
+                      [0,0,0,0,0,0],
+                      [0,0,0,0,0,0]], dtype='int32'))
+
+    (line_img, line_mask), = seglib.line_images_from_img_polygon_map( input_img, polygon_map_chw )
+
+    assert np.array_equal( line_img, np.asarray( input_img )[:3,:3] )
+    assert line_mask.shape == (3,3,3) and np.all( line_mask )
+
+
+def test_iter_labeled_line_images_from_img_segmentation_dict():
+    """
+    Lazily extracted lines are the same as in the list, with their labels and boxes; a label subset
+    selects lines (unknown labels are ignored).
+    """
+    input_img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (16,20,3), dtype='uint8'))
+    polygons = [[[2,1],[12,3],[10,9],[3,7]], [[-4,-2],[6,1],[5,8],[-1,6]], [[15,8],[25,10],[22,20],[14,18]]]
+    segmentation_dict = { 'lines': [ { 'boundary': polygon } for polygon in polygons ] }
+
+    expected = seglib.line_images_from_img_segmentation_dict( input_img, segmentation_dict )
+    actual = list( seglib.iter_labeled_line_images_from_img_segmentation_dict( input_img, segmentation_dict ))
+
+    assert [ a[0] for a in actual ] == [1,2,3]
+    assert [ a[1] for a in actual ] == [(1,2,9,12), (0,0,8,6), (8,14,15,19)]
+    assert all( np.array_equal( a[2], e[0] ) and np.array_equal( a[3], e[1] ) for a, e in zip( actual, expected ))
+    assert [ a[0] for a in seglib.iter_labeled_line_images_from_img_segmentation_dict( input_img, segmentation_dict, labels=[3,1,7] ) ] == [1,3]
+
+
+def test_iter_labeled_line_images_from_img_polygon_map():
+    """
+    Lazily extracted lines are the same as in the list, with their labels and boxes.
+    """
+    input_img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8'))
+    polygon_map_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+
+    expected = seglib.line_images_from_img_polygon_map( input_img, polygon_map_chw )
+    actual = list( seglib.iter_labeled_line_images_from_img_polygon_map( input_img, polygon_map_chw ))
+
+    assert [ (a[0], a[1]) for a in actual ] == [(2,(0,0,5,3)), (3,(2,2,3,4)), (4,(2,2,5,5))]
+    assert all( np.array_equal( a[2], e[0] ) and np.array_equal( a[3], e[1] ) for a, e in zip( actual, expected ))
+    assert [ a[0] for a in seglib.iter_labeled_line_images_from_img_polygon_map( input_img, polygon_map_chw, labels={1,4} ) ] == [4]
+
+
+def test_iter_labeled_line_images_from_img_json_files( synthetic_page ):
+    """
+    Lines extracted lazily from files are the same as in the list.
+    """
+    expected = seglib.line_images_from_img_json_files( *synthetic_page )
+    actual = list( seglib.iter_labeled_line_images_from_img_json_files( *synthetic_page ))
+
+    assert len(actual) == len(expected) == 2
+    assert all( np.array_equal( a[2], e[0] ) and np.array_equal( a[3], e[1] ) for a, e in zip( actual, expected ))
+
+
 @pytest.mark.parametrize('input_map,n,expected',
         [ ( torch.tensor([[1]]), 3, np.array([[[1,1,1]]])),
           ( torch.tensor([[1]]), 4, np.array([[[1,1,1,1]]])),
@@ -153,6 +366,73 @@ def test_expand_flat_tensor_to_n_channels( input_map, n, expected):
 
     
 
+@pytest.mark.parametrize('polygon',[
+    [[2,1],[12,3],[10,9],[3,7]],        # inside the map
+    [[-4,-2],[6,1],[5,8],[-1,6]],       # crossing the top-left corner
+    [[15,8],[25,10],[22,20],[14,18]],   # crossing the bottom-right corner
+    ])
+def test_polygon_bbox_mask_same_as_full_page_mask( polygon ):
+    """
+    A polygon rasterized within its bounding box should match the full-page mask in the window, with
+    no pixel lying out of the window.
+    """
+    map_shape = (16, 20)
+    full_mask = ski.draw.polygon2mask( map_shape, np.array( polygon )[:,::-1] )
+
+    window, mask = seglib.polygon_bbox_mask( polygon, map_shape )
+
+    assert mask.dtype == bool
+    assert np.array_equal( full_mask[ window ], mask )
+    assert full_mask.sum() == mask.sum()
+
+def test_polygon_bbox_mask_out_of_map():
+    """
+    A polygon that lies out of the map yields an empty mask.
+    """
+    window, mask = seglib.polygon_bbox_mask( [[30,30],[40,30],[40,40]], (16, 20) )
+    assert mask.size == 0
+    assert np.zeros((16,20))[ window ].size == 0
+
+
+def test_integer_polygon_mask_same_as_skimage():
+    """
+    Scanline rasterization of integer polygons matches ski.draw.polygon() exactly, boundary pixels included:
+    random polygons, degenerate and self-intersecting ones among them, partly out of the map.
+    """
+    rng = np.random.default_rng(0)
+    for i in range(500):
+        points = rng.integers(-5, 30, (rng.integers(2, 12), 2)) if i % 2 else rng.integers(0, 6, (rng.integers(2, 8), 2))
+        shape = tuple( rng.integers(1, 25, 2) )
+        expected = np.zeros( shape, dtype='bool' )
+        expected[ ski.draw.polygon( points[:,1], points[:,0], shape ) ] = True
+        assert np.array_equal( seglib.integer_polygon_mask( points[:,0], points[:,1], shape ), expected )
+
+
+def test_polygon_bbox_mask_scanline_same_as_skimage_path():
+    """
+    On integer polygons, polygon_bbox_mask() gives the same window and mask as its previous, skimage-based
+    implementation (still used for non-integer points): random polygons, partly out of the map.
+    """
+    rng = np.random.default_rng(1)
+    for i in range(300):
+        points = rng.integers(-10, 60, (rng.integers(3, 16), 2))
+        window, mask = seglib.polygon_bbox_mask( points, (40,50) )
+        skimage_window, skimage_mask = seglib.polygon_bbox_mask( points.astype('float64'), (40,50) )
+        assert window == skimage_window
+        assert np.array_equal( mask, skimage_mask )
+
+
+def test_polygon_bbox_mask_float_points():
+    """
+    Non-integer points are rasterized by skimage, with the same window.
+    """
+    polygon = np.array([[2.5,1.2],[12.1,3.],[10.,9.7],[3.3,7.]])
+    full_mask = ski.draw.polygon2mask( (16,20), polygon[:,::-1] )
+    window, mask = seglib.polygon_bbox_mask( polygon, (16,20) )
+    assert np.array_equal( full_mask[ window ], mask )
+    assert full_mask.sum() == mask.sum()
+
+
 def test_array_to_rgba_uint8_overflow():
     """
     Conversion of a map of 64-bit integers should raise an exception
@@ -507,6 +787,77 @@ def test_polygon_mask_to_polygon_map_32b_duplicate_label_different_channels( lab
         seglib.apply_polygon_mask_to_map( label_map, polygon_mask, 2)
 
 
+@pytest.mark.parametrize(('label'),[2, 0x402, 0x40102, 0x204, 0x20401])
+def test_polygon_mask_to_polygon_map_32b_duplicate_label_with_index( label ):
+    """
+    With a label index, a duplicate label is detected on a window of the map that does
+    not contain it.
+    """
+    label_map = np.array( [[1,1,1,0],
+                           [1,1,1,0],
+                           [1,label,1,0],
+                           [0,0,0,0]], dtype='int32')
+    label_index = seglib.array_label_index( label_map )
+
+    polygon_mask = np.array( [[1,1],
+                              [1,0]], dtype='int32')
+
+    with pytest.raises( ValueError ) as e:
+        seglib.apply_polygon_mask_to_map( label_map[2:,2:], polygon_mask, 2, label_index)
+
+def test_polygon_mask_to_polygon_map_32b_store_updates_index():
+    """
+    Storing a polygon with a label index keeps the index up to date.
+    """
+    label_map = np.zeros((4,4), dtype='int32')
+    label_index = np.zeros( 256, dtype='bool' )
+    polygon_mask = np.array( [[1,1],
+                              [1,0]], dtype='int32')
+
+    seglib.apply_polygon_mask_to_map( label_map[1:3,1:3], polygon_mask, 3, label_index )
+    seglib.apply_polygon_mask_to_map( label_map[2:,2:], polygon_mask, 5, label_index )
+
+    assert np.array_equal( label_map,
+                   np.array( [[0,0,0,0],
+                              [0,3,3,0],
+                              [0,3,5,5],
+                              [0,0,5,0]], dtype='int32'))
+    assert np.array_equal( label_index.nonzero()[0], [3,5] )
+    assert np.array_equal( label_index, seglib.array_label_index( label_map ))
+
+def test_polygon_mask_to_polygon_map_32b_store_maxed_out_window_reports_page_positions():
+    """
+    When storing on a window of the map, the maxed out positions in the error message are relative to the whole map.
+    """
+    label_map = np.zeros((4,4), dtype='int32')
+    label_map[3,2] = 0x1020304
+    label_index = seglib.array_label_index( label_map )
+    polygon_mask = np.array( [[1,1],
+                              [1,1]], dtype='int32')
+
+    with pytest.raises( ValueError, match=r'\(3, 2\)' ):
+        seglib.apply_polygon_mask_to_map( label_map[2:,1:3], polygon_mask, 5, label_index, (2,1))
+
+def test_polygon_mask_to_polygon_map_32b_store_too_large_a_label_with_index():
+    """
+    Trying to store a label larger than 255 causes an exception, whether an index is used or not.
+    """
+    label_map = np.zeros((6,6), dtype='int32')
+    polygon_mask = np.ones((6,6), dtype='int32')
+
+    with pytest.raises(OverflowError) as e:
+        seglib.apply_polygon_mask_to_map(label_map, polygon_mask, 256, np.zeros( 256, dtype='bool' ))
+
+def test_array_label_index():
+    """
+    The index lists all labels stored in the map, whatever their channel.
+    """
+    label_map = np.array( [[2,2,0x20304,0],
+                           [0,0,0x304,0xff],
+                           [0,0,0,0xfffefdfc-(1<<32)]], dtype='int32')
+    assert np.array_equal( seglib.array_label_index( label_map ).nonzero()[0], [2,3,4,0xfc,0xfd,0xfe,0xff] )
+
+
 def test_retrieve_polygon_mask_from_map_1():
     label_map = torch.tensor([[[2, 2, 2, 0, 0, 0],
                                [2, 2, 2, 0, 0, 0],
@@ -851,6 +1202,46 @@ def test_precision_recall_two_maps():
     assert np.all(np.isclose( intersection_union, expected_intersection_union, 1e-4 ))
     assert np.all(np.isclose( precision_recall, expected, 1e-4 ))
 
+def test_joint_label_histograms():
+    """
+    Joint histograms yield the depth-weighted intersection counts for every pair of labels, and the
+    depth-weighted pixel counts for every label.
+    """
+    map1 = seglib.array_to_rgba_uint8(np.array([[2,2,0],
+                                                [0x302,3,0]], dtype='int32'))
+    map2 = seglib.array_to_rgba_uint8(np.array([[2,0,0],
+                                                [0x502,5,5]], dtype='int32'))
+
+    intersection_counts, label_counts_1, label_counts_2 = seglib.joint_label_histograms( map1, map2 )
+
+    assert intersection_counts.shape == (256,256)
+    assert np.isclose( intersection_counts[2,2], 1.5 )
+    assert np.isclose( intersection_counts[3,2], .5 )
+    assert np.isclose( intersection_counts[2,5], .5 )
+    assert np.isclose( intersection_counts[3,5], 1.5 )
+    assert np.isclose( np.sum( intersection_counts ), 4 )
+    assert np.isclose( label_counts_1[2], 2.5 ) and np.isclose( label_counts_1[3], 1.5 )
+    assert np.isclose( label_counts_2[2], 1.5 ) and np.isclose( label_counts_2[5], 2.5 )
+    assert label_counts_1[0] == 0 and label_counts_2[0] == 0
+
+
+def test_precision_recall_two_maps_missing_label():
+    """
+    A label that is missing from a map's range has 0 precision (or recall) with every label of the other map.
+    """
+    map1 = seglib.array_to_rgba_uint8(np.array([[2,2,0],
+                                                [0,4,4]], dtype='int32'))
+    map2 = seglib.array_to_rgba_uint8(np.array([[2,2,0],
+                                                [0,4,0]], dtype='int32'))
+
+    metrics = seglib.polygon_pixel_metrics_two_maps( map1, map2 )
+
+    assert metrics.shape == (3,3,4)
+    assert np.all( metrics[1,:,2] == 0 )
+    assert np.all( metrics[:,1,3] == 0 )
+    assert np.allclose( metrics[2,2], [1, 2, .5, 1] )
+
+
 def test_get_polygon_pixel_metrics_wrong_pred_type():
     """
     First map should be a 4-channel tensor
@@ -1046,6 +1437,61 @@ def test_polygon_pixel_metrics_from_full_charter(  data_path, distance ):
     assert np.all( metrics[:,:,1] != 0 )
 
 
+def test_polygon_geometric_metrics_two_squares():
+    """
+    Geometric metrics of two overlapping squares.
+    """
+    pred = { 'lines': [ {'boundary': [[0,0],[10,0],[10,10],[0,10]]} ] }
+    gt = { 'lines': [ {'boundary': [[5,0],[15,0],[15,10],[5,10]]}, {'boundary': [[20,20],[30,20],[30,30],[20,30]]} ] }
+
+    metrics = seglib.polygon_geometric_metrics_from_segmentation_dicts( pred, gt )
+
+    assert metrics.shape == (1,2,4)
+    assert metrics.dtype == np.float32
+    assert np.allclose( metrics[0,0], [50, 150, .5, .5] )
+    assert np.allclose( metrics[0,1], [0, 200, 0, 0] )
+
+
+def test_polygon_geometric_metrics_depth_weighting():
+    """
+    Overlapping polygons within a set share the area they have in common.
+    """
+    pred = { 'lines': [ {'boundary': [[0,0],[10,0],[10,10],[0,10]]}, {'boundary': [[0,5],[10,5],[10,15],[0,15]]} ] }
+    gt = { 'lines': [ {'boundary': [[0,0],[10,0],[10,10],[0,10]]} ] }
+
+    metrics = seglib.polygon_geometric_metrics_from_segmentation_dicts( pred, gt )
+
+    # pred counts: 50 + 50/2 = 75 each; intersection (pred 1, GT 1): 50 + 50/2 = 75
+    assert np.allclose( metrics[:,0,0], [75, 25] )
+    assert np.allclose( metrics[:,0,1], [75+100-75, 75+100-25] )
+    assert np.allclose( metrics[:,0,2], [1, 1/3] )
+    assert np.allclose( metrics[:,0,3], [.75, .25] )
+
+
+def test_polygon_geometric_metrics_clipped_to_page():
+    """
+    With a page size, the polygons are clipped to the page.
+    """
+    pred = { 'lines': [ {'boundary': [[-10,0],[10,0],[10,10],[-10,10]]} ] }
+    gt = { 'lines': [ {'boundary': [[0,0],[10,0],[10,10],[0,10]]} ] }
+
+    assert np.allclose( seglib.polygon_geometric_metrics_from_segmentation_dicts( pred, gt, (20,20) )[0,0], [100, 100, 1, 1] )
+
+
+def test_polygon_geometric_metrics_close_to_pixel_metrics( data_path ):
+    """
+    On a real page, geometric and pixel-based metrics yield the same line-based scores.
+    """
+    with open( data_path.joinpath('segdict_NA-ACK_14201223_01485_r-r1+model_20.json'), 'r') as pred_file, open( data_path.joinpath('NA-ACK_14201223_01485_r-r1.json'), 'r') as gt_file:
+        pred, gt = json.load( pred_file ), json.load( gt_file )
+
+    metrics = seglib.polygon_geometric_metrics_from_segmentation_dicts( pred, gt )
+
+    assert metrics.shape == (len(pred['lines']), len(gt['lines']), 4)
+    assert np.all( metrics[:,:,1] != 0 )
+    assert seglib.polygon_pixel_metrics_to_line_based_scores( metrics )[3] > .9
+
+
 @pytest.mark.parametrize("thld,expected_scores", [ 
     (.1, (3.0, 0.0, 0.0 , 1.0, 1.0)),
     (.5, (3.0, 0.0, 0.0, 1.0, 1.0)),
@@ -1072,6 +1518,68 @@ def test_polygon_pixel_metrics_to_line_based_scores(thld, expected_scores):
     assert scores == expected_scores
 
 
+def test_polygon_pixel_metrics_to_line_based_counts():
+    """
+    Counts over a range of thresholds are the same as those obtained for each threshold in turn; per-page counts add up.
+    """
+    metrics = np.array([[[ 6.3333335 , 11.833334  ,  0.7169811 ,  0.67857146],
+                         [ 0.33333334, 10.833334  ,  0.03773585,  0.14285713],
+                         [ 0.8333334 , 17.333334  ,  0.09433962,  0.08928571],
+                         [ 0.        , 10.833334  ,  0.        ,  0.        ]],
+                        [[ 0.8333334 , 12.833333  ,  0.1923077 ,  0.08928572],
+                         [ 2.3333335 ,  4.3333335 ,  0.53846157,  1.        ],
+                         [ 3.3333335 , 10.333334  ,  0.7692308 ,  0.35714284],
+                         [ 0.5       ,  5.8333335 ,  0.11538461,  0.25      ]],
+                        [[ 1.8333334 , 16.333334  ,  0.20754716,  0.19642858],
+                         [ 2.3333335 ,  8.833334  ,  0.26415095,  1.        ],
+                         [ 7.3333335 , 10.833334  ,  0.83018863,  0.78571427],
+                         [ 0.        , 10.833334  ,  0.        ,  0.        ]]],
+                        dtype=np.float32)
+    thresholds = np.linspace(0, 1, num=51)
+
+    counts = seglib.polygon_pixel_metrics_to_line_based_counts( metrics, thresholds )
+
+    assert counts.shape == (51, 3)
+    for t, c in zip( thresholds, counts ):
+        assert tuple(c) == seglib.polygon_pixel_metrics_to_line_based_scores( metrics, threshold=t )[:3]
+    assert np.array_equal( seglib.polygon_pixel_metrics_to_line_based_counts( [metrics, metrics[:2]], thresholds ),
+                           counts + seglib.polygon_pixel_metrics_to_line_based_counts( metrics[:2], thresholds ))
+
+
+def test_polygon_pixel_metrics_to_line_based_counts_float32_thresholds():
+    """
+    Thresholds that are not exact float32 values (e.g. 0.7) are compared in float32 by both the batched and
+    the per-threshold counts: a match with P=R=7/10 is a TP at t=.7.
+    """
+    metrics = np.zeros((1,1,4), dtype='float32')
+    metrics[0,0] = [7, 10, 7/10, 7/10]
+    thresholds = np.linspace(0, 1, num=21)
+
+    counts = seglib.polygon_pixel_metrics_to_line_based_counts( metrics, thresholds )
+
+    for t, c in zip( thresholds, counts ):
+        assert tuple(c) == seglib.polygon_pixel_metrics_to_line_based_scores( metrics, threshold=float(t) )[:3]
+        assert tuple(c) == seglib.polygon_pixel_metrics_to_line_based_scores( metrics, threshold=t )[:3]
+    assert tuple( counts[14] ) == (1, 0, 0)
+    assert np.array_equal( seglib.metrics_to_precision_recall_curve( metrics )[:,14], [1, 1] )
+
+
+def test_metrics_to_precision_recall_curve():
+    """
+    Precision and recall curves, from a single matrix.
+    """
+    metrics = np.zeros((2,2,4), dtype='float32')
+    metrics[0,0] = [8, 10, .8, .9]
+    metrics[1,1] = [4, 10, .4, .6]
+
+    curve = seglib.metrics_to_precision_recall_curve( metrics, np.array([.3, .5, .85, .95]) )
+
+    assert curve.shape == (2, 4)
+    # t=.5: 1 TP, 1 FP (P=.4), no FN (R=.6)
+    assert np.allclose( curve[0], [1, 1/2, 0, 0] )
+    assert np.allclose( curve[1], [1, 1, 0, 0] )
+
+
 def test_polygon_pixel_metrics_to_pixel_based_scores():
     """
     Made-up matrix, constructed from the tests above.
@@ -1094,6 +1602,24 @@ def test_polygon_pixel_metrics_to_pixel_based_scores():
     assert np.all(np.isclose( scores, (0.23780487, 0.5925925788565435) ))
 
 
+def test_polygon_pixel_metrics_matches():
+    """
+    Each predicted polygon is matched with the intersecting GT polygon of highest IoU; a GT polygon
+    may be matched more than once, and predicted polygons without intersection are not matched.
+    """
+    metrics = np.zeros((4,3,4), dtype='float32')
+    metrics[:,:,1] = 10
+    metrics[0,:,0] = [2, 5, 0]
+    metrics[1,:,0] = [0, 4, 4]
+    metrics[2,:,0] = [0, 6, 1]
+
+    pred_indices, gt_indices = seglib.polygon_pixel_metrics_matches( metrics )
+
+    assert pred_indices.tolist() == [0, 1, 2]
+    # tie: lowest GT index
+    assert gt_indices.tolist() == [1, 1, 1]
+
+
 def test_polygon_pixel_metrics_to_line_based_scores_full_charter(  data_path ):
     """
     On an actual image, a sanity check
@@ -1116,6 +1642,391 @@ def test_polygon_pixel_metrics_to_pixel_based_scores_full_charter(  data_path ):
         assert scores[1] > .5 
 
 
+def test_polygon_map_to_sparse_round_trip():
+    """
+    Conversion to a sparse map and back should yield the original map, including the channel
+    in which each overlapping label is stored.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0x502,0x304,0x304,0x304,4],
+                      [5,0x405,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+
+    sparse_map = seglib.polygon_map_to_sparse( polygon_map )
+
+    assert sparse_map['shape'] == (6,6)
+    assert sorted( sparse_map['labels'] ) == [2,3,4,5]
+    # label 3 is stored on channel 1 everywhere
+    assert sparse_map['labels'][3]['bbox'] == (2,2,3,4)
+    assert np.array_equal( sparse_map['labels'][3]['channels'], np.array([[2,2,0],
+                                                                         [2,2,2]], dtype='uint8'))
+    # label 2 is stored on channel 0 or 2
+    assert np.array_equal( sparse_map['labels'][2]['channels'][2], np.array([1,1,3,0], dtype='uint8'))
+    assert torch.equal( seglib.sparse_to_polygon_map( sparse_map ), polygon_map )
+
+
+def test_polygon_map_to_sparse_wrong_type():
+    """
+    Only 4-channel maps of unsigned bytes can be converted.
+    """
+    with pytest.raises( TypeError ):
+        seglib.polygon_map_to_sparse( torch.zeros((3,5,5), dtype=torch.uint8) )
+
+
+def test_retrieve_polygon_mask_from_sparse_map():
+    """
+    A label's mask retrieved from a sparse map is the same as from the dense map.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    sparse_map = seglib.polygon_map_to_sparse( polygon_map )
+
+    for lbl in (2,3,4,7):
+        assert torch.equal( seglib.retrieve_polygon_mask_from_map( sparse_map, lbl ),
+                            seglib.retrieve_polygon_mask_from_map( polygon_map, lbl ))
+
+
+def test_sparse_polygon_map_depths():
+    """
+    Depths computed from a sparse map match the depth map of the dense map.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,4,0,0]], dtype='int32'))
+    sparse_map = seglib.polygon_map_to_sparse( polygon_map )
+    depth_map = seglib.map_to_depth( polygon_map ).numpy()
+
+    depths = seglib.sparse_polygon_map_depths( sparse_map )
+
+    for lbl, entry in sparse_map['labels'].items():
+        covered = entry['channels'] != 0
+        assert np.array_equal( depths[lbl][ covered ], depth_map[ seglib.sparse_label_window( entry ) ][ covered ] )
+
+
+@pytest.mark.parametrize("label_distance", [0, 1])
+def test_polygon_pixel_metrics_two_sparse_maps_same_as_dense( label_distance ):
+    """
+    Metrics computed on sparse maps are the same as with the dense maps.
+    """
+    map1 = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0x502,0x304,0x304,0x304,4],
+                      [5,0x405,4,4,4,0], 
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    map2 = seglib.array_to_rgba_uint8(np.array(
+                     [[0,2,2,0,0,0],
+                      [2,2,4,2,2,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,3,0x304,0x304,0x304,4],
+                      [0,0,3,4,4,0],
+                      [0,0,0x204,4,0,0]], dtype='int32'))
+
+    expected = seglib.polygon_pixel_metrics_two_maps( map1, map2, label_distance )
+    actual = seglib.polygon_pixel_metrics_two_maps( seglib.polygon_map_to_sparse( map1 ), seglib.polygon_map_to_sparse( map2 ), label_distance )
+
+    assert actual.dtype == np.float32
+    assert np.all( np.isclose( actual, expected ))
+
+
+def test_polygon_pixel_metrics_from_sparse_maps_and_mask():
+    """
+    With a FG mask, metrics computed on sparse maps are the same as with the dense maps.
+    """
+    map1 = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    map2 = seglib.array_to_rgba_uint8(np.array(
+                     [[0,2,2,0,0,0],
+                      [2,2,4,2,2,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,3,0x304,0x304,0x304,4],
+                      [0,0,3,4,4,0],
+                      [0,0,0x204,4,0,0]], dtype='int32'))
+    binary_mask = torch.tensor([[1,1,0,0,0,0],
+                                [1,1,1,0,0,0],
+                                [1,0,1,1,1,0],
+                                [0,1,1,0,1,1],
+                                [0,0,1,1,1,0],
+                                [0,0,1,1,0,0]], dtype=torch.bool)
+
+    expected = seglib.polygon_pixel_metrics_from_polygon_maps_and_mask( map1, map2, binary_mask )
+    actual = seglib.polygon_pixel_metrics_from_polygon_maps_and_mask( seglib.polygon_map_to_sparse( map1 ), seglib.polygon_map_to_sparse( map2 ), binary_mask )
+
+    assert np.all( np.isclose( actual, expected ))
+
+
+def test_line_images_from_img_sparse_polygon_map():
+    """
+    Line crops and masks from a sparse map are the same as from the dense map.
+    """
+    input_img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8'))
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    polygon_map[ polygon_map == 1 ] = 0
+    # map with labels 1..4, as expected by the dense version
+    polygon_map[ polygon_map == 4 ] = 1
+
+    expected = seglib.line_images_from_img_polygon_map( input_img, polygon_map )
+    actual = seglib.line_images_from_img_polygon_map( input_img, seglib.polygon_map_to_sparse( polygon_map ))
+
+    assert len(actual) == len(expected) == 3
+    for (img_1, mask_1), (img_2, mask_2) in zip( actual, expected ):
+        assert np.array_equal( img_1, img_2 )
+        assert np.array_equal( mask_1, mask_2 )
+
+
+def test_candidate_label_pairs_two_sets():
+    """
+    Only pairs of labels whose boxes overlap are returned.
+    """
+    bboxes_1 = { 1: (0,0,10,100), 2: (12,0,20,100), 3: (30,0,40,10) }
+    bboxes_2 = { 7: (5,50,15,150), 8: (30,20,40,30), 9: (40,10,45,12) }
+
+    assert sorted( seglib.candidate_label_pairs( bboxes_1, bboxes_2 )) == [(1,7), (2,7), (3,9)]
+
+
+def test_candidate_label_pairs_single_set():
+    """
+    Within a single set, every overlapping pair is returned once, lowest label first.
+    """
+    bboxes = { 4: (0,0,10,100), 2: (5,50,15,150), 3: (30,0,40,10), 1: (40,10,45,12) }
+
+    assert sorted( seglib.candidate_label_pairs( bboxes )) == [(1,3), (2,4)]
+
+
+def test_polygon_pixel_metrics_two_sparse_maps_reading_order():
+    """
+    With sparse maps, intersections are found whatever the distance between the labels' numbers.
+    """
+    map1 = seglib.array_to_rgba_uint8(np.array([[1,1,0,0],
+                                                [0,0,0,0],
+                                                [0,0,9,9]], dtype='int32'))
+    map2 = seglib.array_to_rgba_uint8(np.array([[9,9,0,0],
+                                                [0,0,0,0],
+                                                [0,0,1,1]], dtype='int32'))
+
+    metrics = seglib.polygon_pixel_metrics_two_maps( seglib.polygon_map_to_sparse( map1 ), seglib.polygon_map_to_sparse( map2 ), label_distance=0 )
+
+    assert np.allclose( metrics[0,8], [2,2,1,1] )
+    assert np.allclose( metrics[8,0], [2,2,1,1] )
+    assert np.allclose( metrics[0,0], [0,4,0,0] )
+    assert np.allclose( metrics, seglib.polygon_pixel_metrics_two_maps( map1, map2, label_distance=0 ))
+
+
+def test_save_load_polygon_map_round_trip( tmp_path ):
+    """
+    A map stored into a container should be read back identical, in dense or sparse form.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0x502,0x304,0x304,0x304,4],
+                      [5,0x405,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pmap')
+    seglib.save_polygon_map( polygon_map, map_path )
+
+    assert seglib.is_polygon_map_file( map_path )
+    assert torch.equal( seglib.load_polygon_map( map_path ), polygon_map )
+    sparse_map = seglib.load_polygon_map( map_path, sparse=True )
+    assert sparse_map['shape'] == (6,6)
+    assert sorted( sparse_map['labels'] ) == [2,3,4,5]
+
+
+def test_save_polygon_map_header( tmp_path ):
+    """
+    The header stores the shape, the label count and the label boxes.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pmap')
+    seglib.save_polygon_map( polygon_map, map_path )
+
+    with open( map_path, 'rb' ) as map_file:
+        header = seglib.read_polygon_map_header( map_file )
+    assert header['shape'] == [6,6]
+    assert header['label_count'] == 3
+    assert [ (e['label'], e['bbox']) for e in header['labels'] ] == [(2,[0,0,5,3]), (3,[2,2,3,4]), (4,[2,2,5,5])]
+
+
+def test_load_polygon_map_label( tmp_path ):
+    """
+    A single label's mask read from a container is the same as from the dense map.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0,0x304,0x304,0x304,4],
+                      [0,0,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pmap')
+    seglib.save_polygon_map( polygon_map, map_path )
+
+    assert seglib.load_polygon_map_label( map_path, 3 )['bbox'] == (2,2,3,4)
+    assert seglib.load_polygon_map_label( map_path, 7 ) is None
+    for lbl in (2,3,4,7):
+        assert torch.equal( seglib.retrieve_polygon_mask_from_file( map_path, lbl ),
+                            seglib.retrieve_polygon_mask_from_map( polygon_map, lbl ))
+
+
+def test_load_polygon_map_legacy_tensor( tmp_path ):
+    """
+    Maps pickled with torch.save() are still readable.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,0],
+                      [0,0x302,3]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pt')
+    torch.save( polygon_map, map_path )
+
+    assert not seglib.is_polygon_map_file( map_path )
+    assert torch.equal( seglib.load_polygon_map( map_path ), polygon_map )
+    assert sorted( seglib.load_polygon_map( map_path, sparse=True )['labels'] ) == [2,3]
+
+
+def test_save_load_uncompressed_polygon_map( tmp_path ):
+    """
+    An uncompressed map is read back identical, whether it is read or memory-mapped, and its
+    data block starts on a page boundary.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20304,0x304,4,0],
+                      [0,0x502,0x304,0x304,0x304,4],
+                      [5,0x405,4,4,4,0],
+                      [0,0,4,0x402,0,0]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pmap')
+    seglib.save_polygon_map( polygon_map, map_path, compressed=False )
+
+    with open( map_path, 'rb' ) as map_file:
+        assert seglib.read_polygon_map_header( map_file )['data_offset'] % 4096 == 0
+    assert torch.equal( seglib.load_polygon_map( map_path ), polygon_map )
+    assert torch.equal( seglib.load_polygon_map( map_path, mmap=True ), polygon_map )
+    assert np.array_equal( seglib.load_polygon_map_label( map_path, 4 )['channels'],
+                           seglib.polygon_map_to_sparse( polygon_map )['labels'][4]['channels'] )
+
+
+def test_is_compressed_polygon_map_file( tmp_path ):
+    """
+    Only compressed containers are told apart: uncompressed containers and pickled tensors store a dense map.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,0],
+                      [0,0x302,3]], dtype='int32'))
+    compressed_path, uncompressed_path, tensor_path = [ tmp_path.joinpath( name ) for name in ('c.pmap', 'u.pmap', 'map.pt') ]
+    seglib.save_polygon_map( polygon_map, compressed_path )
+    seglib.save_polygon_map( polygon_map, uncompressed_path, compressed=False )
+    torch.save( polygon_map, tensor_path )
+
+    assert seglib.is_compressed_polygon_map_file( compressed_path )
+    assert not seglib.is_compressed_polygon_map_file( uncompressed_path )
+    assert not seglib.is_compressed_polygon_map_file( tensor_path )
+
+
+def test_load_polygon_map_mmap_copy_on_write( tmp_path ):
+    """
+    Writing into a memory-mapped map does not alter the file.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,0],
+                      [0,0x302,3]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pmap')
+    seglib.save_polygon_map( polygon_map, map_path, compressed=False )
+
+    mapped_map = seglib.load_polygon_map( map_path, mmap=True )
+    mapped_map[0,0,0] = 7
+
+    assert torch.equal( seglib.load_polygon_map( map_path ), polygon_map )
+
+
+def test_load_polygon_map_mmap_legacy_tensor( tmp_path ):
+    """
+    Maps pickled with torch.save() can be memory-mapped as well.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,0],
+                      [0,0x302,3]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pt')
+    torch.save( polygon_map, map_path )
+
+    assert torch.equal( seglib.load_polygon_map( map_path, mmap=True ), polygon_map )
+
+
+def test_load_polygon_map_mmap_legacy_serialization( tmp_path ):
+    """
+    Maps pickled with the legacy (non-zip) serialization cannot be mapped: with mmap=True, they are read.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,0],
+                      [0,0x302,3]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pt')
+    torch.save( polygon_map, map_path, _use_new_zipfile_serialization=False )
+
+    assert torch.equal( seglib.load_polygon_map( map_path, mmap=True ), polygon_map )
+
+
+def test_load_polygon_map_mmap_torch_without_mmap( tmp_path, monkeypatch ):
+    """
+    With a Torch version whose load() has no mmap keyword (< 2.1), mmap=True falls back on reading the map.
+    """
+    polygon_map = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,0],
+                      [0,0x302,3]], dtype='int32'))
+    map_path = tmp_path.joinpath('map.pt')
+    torch.save( polygon_map, map_path )
+
+    torch_load = torch.load
+    def load( f, **kwargs ):
+        if 'mmap' in kwargs:
+            raise TypeError("load() got an unexpected keyword argument 'mmap'")
+        return torch_load( f, **kwargs )
+    monkeypatch.setattr( seglib.torch, 'load', load )
+
+    assert torch.equal( seglib.load_polygon_map( map_path, mmap=True ), polygon_map )
+
+
+def test_read_polygon_map_header_not_a_container( tmp_path ):
+    """
+    Reading the header of a file that is not a container raises an exception.
+    """
+    map_path = tmp_path.joinpath('map.pmap')
+    map_path.write_bytes( b'not a map' )
+    with pytest.raises( ValueError ):
+        with open( map_path, 'rb' ) as map_file:
+            seglib.read_polygon_map_header( map_file )
+
+
 def test_map_to_depth():
     """
     Provided a polygon map with compound pixels (intersections), the matrix representing
@@ -1152,6 +2063,284 @@ def test_segmentation_dict_from_xml(  data_path ):
     assert [ len(l['baseline']) for l in segdict['lines'] ] == [21, 21, 21, 21] 
 
 
+def test_segmentation_dict_from_xml_points_arrays(  data_path ):
+    """
+    On demand, points are read as (N,2) integer arrays.
+    """
+    pagexml = str(data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml'))
+
+    segdict = seglib.segmentation_dict_from_xml( pagexml, as_arrays=True )
+
+    assert segdict['text_direction'] == 'horizontal-lr'
+    assert all( l['boundary'].ndim == 2 and l['boundary'].shape[1] == 2 for l in segdict['lines'] )
+    assert segdict['lines'][0]['boundary'][:2].tolist() == [[0,175],[222,169]]
+    assert [ l['boundary'].tolist() for l in segdict['lines'] ] == [ l['boundary'] for l in seglib.segmentation_dict_from_xml( pagexml )['lines'] ]
+
+
+def test_segmentation_dict_from_xml_json_round_trip(  data_path ):
+    """
+    By default, the dictionary read from a PageXML file is plain JSON: points are lists of [x,y] pairs.
+    """
+    pagexml = str(data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml'))
+
+    segdict = seglib.segmentation_dict_from_xml( pagexml )
+
+    assert json.loads( json.dumps( segdict )) == segdict
+    assert segdict['lines'][0]['boundary'][:2] == [[0,175],[222,169]]
+
+
+def test_segmentation_dict_from_xml_any_namespace(  data_path, tmp_path ):
+    """
+    Lines are found whatever the version of the PAGE schema.
+    """
+    pagexml = data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml')
+    pagexml_2019 = tmp_path.joinpath('page_2019.xml')
+    pagexml_2019.write_text( pagexml.read_text().replace('2013-07-15', '2019-07-15'))
+
+    segdict = seglib.segmentation_dict_from_xml( str(pagexml) )
+    segdict_2019 = seglib.segmentation_dict_from_xml( str(pagexml_2019) )
+
+    assert len(segdict_2019['lines']) == 4
+    assert [ l['boundary'] for l in segdict['lines'] ] == [ l['boundary'] for l in segdict_2019['lines'] ]
+
+
+def test_points_to_array_malformed():
+    """
+    A points attribute that is not a sequence of integer pairs raises an exception.
+    """
+    assert seglib.points_to_array('1,2 3,4').tolist() == [[1,2],[3,4]]
+    with pytest.raises( ValueError ):
+        seglib.points_to_array('1,2 3,x')
+
+
+def test_segmentation_dicts_from_xml_files(  data_path, tmp_path ):
+    """
+    Files parsed in parallel come out in the input order.
+    """
+    pagexml = data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml')
+    pagexml_short = tmp_path.joinpath('page_short.xml')
+    root = ET.parse( pagexml ).getroot()
+    for region in root.iter('{http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15}TextRegion'):
+        for line in region.findall('{http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15}TextLine')[1:]:
+            region.remove( line )
+    ET.ElementTree( root ).write( pagexml_short )
+
+    segdicts = list( seglib.segmentation_dicts_from_xml_files( [ str(pagexml), str(pagexml_short) ] * 3, workers=2 ))
+
+    assert [ len(d['lines']) for d in segdicts ] == [4, 1] * 3
+
+
+def test_segmentation_dict_from_file(  data_path ):
+    """
+    Segmentation files are read according to their suffix.
+    """
+    segdict_xml = seglib.segmentation_dict_from_file( str(data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml')))
+    segdict_json = seglib.segmentation_dict_from_file( str(data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.json')))
+
+    assert len(segdict_xml['lines']) == 4
+    assert len(segdict_json['lines']) == 4
+
+
+def test_segmentation_store_round_trip( data_path, tmp_path ):
+    """
+    Pages read from a segmentation store have the same lines as the original dictionaries.
+    """
+    segdict_xml = seglib.segmentation_dict_from_xml( str(data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml')))
+    with open( data_path.joinpath('segdict_NA-ACK_14201223_01485_r-r1+model_20_reduced.json'), 'r') as json_file:
+        segdict_json = json.load( json_file )
+    empty = { 'type': 'baselines', 'lines': [] }
+
+    assert seglib.save_segmentation_store( tmp_path.joinpath('store'), [('xml', segdict_xml), ('empty', empty), ('json', segdict_json)] ) == 3
+    assert seglib.is_segmentation_store( tmp_path.joinpath('store') )
+
+    store = seglib.SegmentationStore( tmp_path.joinpath('store') )
+    assert len(store) == 3
+    assert store.page_names() == ['xml', 'empty', 'json']
+    assert store['empty']['lines'] == []
+    assert store['xml']['text_direction'] == 'horizontal-lr'
+    for page, segdict in (('xml', segdict_xml), (2, segdict_json)):
+        lines = store[page]['lines']
+        assert [ l['line_id'] for l in lines ] == [ l.get('line_id') for l in segdict['lines'] ]
+        assert all( np.array_equal( l['boundary'], ol['boundary'] ) and np.array_equal( l['baseline'], ol['baseline'] ) for l, ol in zip( lines, segdict['lines'] ))
+
+
+def test_segmentation_store_duplicate_names( tmp_path ):
+    """
+    Page names must be unique.
+    """
+    segdict = { 'lines': [ { 'line_id': 'l1', 'baseline': [[5,10],[50,10]], 'boundary': [[5,2],[50,2],[50,15],[5,15]] } ] }
+    with pytest.raises( ValueError ):
+        seglib.save_segmentation_store( tmp_path.joinpath('store'), [('p', segdict), ('p', segdict)] )
+
+
+def test_segmentation_store_fractional_coordinates( tmp_path ):
+    """
+    Fractional coordinates are rounded, not truncated.
+    """
+    segdict = { 'lines': [ { 'line_id': 'l1', 'baseline': [[5.4,10.6],[49.5,10.5]], 'boundary': [[4.9,2.2],[50.7,2.],[50.,14.99],[5,15]] } ] }
+    seglib.save_segmentation_store( tmp_path.joinpath('store'), [('p', segdict)] )
+    line = seglib.SegmentationStore( tmp_path.joinpath('store') )['p']['lines'][0]
+
+    assert line['baseline'].tolist() == [[5,11],[50,10]]
+    assert line['boundary'].tolist() == [[5,2],[51,2],[50,15],[5,15]]
+
+
+def test_segmentation_store_page_rasterization( tmp_path ):
+    """
+    A page from a store can be rendered directly, with the same result as the original dictionary.
+    """
+    img = Image.fromarray( np.random.default_rng(1).integers(0, 256, (40,60,3), dtype='uint8'))
+    segdict = { 'lines': [ { 'line_id': 'l1', 'baseline': [[5,10],[50,10]], 'boundary': [[5,2],[50,2],[50,15],[5,15]] },
+                           { 'line_id': 'l2', 'baseline': [[5,20],[50,20]], 'boundary': [[5,12],[50,12],[50,25],[5,25]] } ] }
+    seglib.save_segmentation_store( tmp_path.joinpath('store'), [('p', segdict)] )
+    store_page = seglib.SegmentationStore( tmp_path.joinpath('store') )['p']
+
+    assert torch.equal( seglib.polygon_map_from_img_segmentation_dict( img, store_page ), seglib.polygon_map_from_img_segmentation_dict( img, segdict ))
+    assert np.array_equal( seglib.polygon_pixel_metrics_from_img_segmentation_dict( img, store_page, segdict ),
+                           seglib.polygon_pixel_metrics_from_img_segmentation_dict( img, segdict, segdict ))
+
+
+@pytest.fixture
+def synthetic_page( tmp_path ):
+    """
+    A small page image, with a JSON segmentation of 2 overlapping lines.
+    """
+    img_path, json_path = tmp_path.joinpath('page.png'), tmp_path.joinpath('page.json')
+    Image.fromarray( np.random.default_rng(1).integers(0, 256, (40,60,3), dtype='uint8')).save( img_path )
+    segdict = { 'lines': [ { 'line_id': 'l1', 'baseline': [[5,10],[50,10]], 'boundary': [[5,2],[50,2],[50,15],[5,15]] },
+                           { 'line_id': 'l2', 'baseline': [[5,20],[50,20]], 'boundary': [[5,12],[50,12],[50,25],[5,25]] } ] }
+    json_path.write_text( json.dumps( segdict ))
+    return (str(img_path), str(json_path))
+
+
+@pytest.fixture
+def disk_cache( tmp_path ):
+    cache_dir = tmp_path.joinpath('cache')
+    seglib.enable_cache( cache_dir )
+    seglib.clear_cache()
+    yield cache_dir
+    seglib.disable_cache()
+
+
+def test_cache_disabled_by_default( synthetic_page ):
+    """
+    Without a cache, results are computed every time and nothing is counted.
+    """
+    seglib.polygon_map_from_img_json_files( *synthetic_page )
+    assert seglib.cache_stats()['enabled'] == False
+    assert seglib.cache_stats()['entries'] == 0
+
+
+def test_cache_polygon_map_hit( synthetic_page, disk_cache ):
+    """
+    A second call with the same image and segmentation is served from the cache, with the same result.
+    """
+    expected = seglib.polygon_map_from_img_json_files( *synthetic_page )
+    actual = seglib.polygon_map_from_img_json_files( *synthetic_page )
+
+    assert torch.equal( actual, expected )
+    stats = seglib.cache_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_cache_key_depends_on_segmentation( synthetic_page, disk_cache ):
+    """
+    A modified segmentation is a cache miss.
+    """
+    img_path, json_path = synthetic_page
+    seglib.line_binary_mask_from_img_json_files( img_path, json_path )
+    segdict = json.loads( Path( json_path ).read_text())
+    segdict['lines'] = segdict['lines'][:1]
+    Path( json_path ).write_text( json.dumps( segdict ))
+    mask = seglib.line_binary_mask_from_img_json_files( img_path, json_path )
+
+    assert seglib.cache_stats()['misses'] == 2
+    assert torch.equal( mask, seglib.line_binary_mask_from_img_json_files( img_path, json_path ))
+    assert seglib.cache_stats()['hits'] == 1
+
+
+def test_cache_key_same_for_json_and_xml( synthetic_page, disk_cache, data_path ):
+    """
+    The same lines, read from a JSON file or from the equivalent PageXML file, share a cache entry,
+    although the dictionaries' other entries differ.
+    """
+    img_path = synthetic_page[0]
+    expected = seglib.polygon_map_from_img_json_files( img_path, str( data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.json')))
+    actual = seglib.polygon_map_from_img_xml_files( img_path, str( data_path.joinpath('NA-ACK_14201223_01485_r-r1_reduced.xml')))
+
+    assert torch.equal( actual, expected )
+    stats = seglib.cache_stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_cache_metrics_hash_image_once( synthetic_page, disk_cache, monkeypatch ):
+    """
+    Computing the metrics looks up 3 cache entries for the same image, which is hashed only once.
+    """
+    img_path, json_path = synthetic_page
+    segdict = json.loads( Path( json_path ).read_text())
+    digests = []
+    file_digest = seglib.file_sha256
+    monkeypatch.setattr( seglib, 'file_sha256', lambda f: digests.append( f ) or file_digest( f ))
+
+    seglib.polygon_pixel_metrics_from_img_file_and_segmentation_dicts( img_path, segdict, segdict )
+
+    assert len( digests ) == 1
+    assert seglib.cache_stats()['entries'] == 2
+
+
+def test_cache_label_statistics( synthetic_page, disk_cache ):
+    """
+    Label statistics read from the cache are those computed from the polygon map.
+    """
+    expected = seglib.polygon_map_label_statistics( seglib.polygon_map_from_img_json_files( *synthetic_page ))
+    seglib.label_statistics_from_img_json_files( *synthetic_page )
+    actual = seglib.label_statistics_from_img_json_files( *synthetic_page )
+
+    assert actual == expected
+    assert expected[1]['pixel_count'] == expected[2]['pixel_count']
+    # overlapping rows weigh 1/2
+    assert expected[1]['weighted_count'] < expected[1]['pixel_count']
+
+
+def test_cache_eviction( synthetic_page, disk_cache ):
+    """
+    When the cache exceeds its maximum size, the least recently used entries are removed.
+    """
+    seglib.enable_cache( disk_cache, max_size=1 )
+    seglib.polygon_map_from_img_json_files( *synthetic_page )
+    seglib.line_binary_mask_from_img_json_files( *synthetic_page )
+
+    stats = seglib.cache_stats()
+    assert stats['evictions'] == 2
+    assert stats['entries'] == 0
+
+
+def test_cache_size_running_total( synthetic_page, disk_cache, monkeypatch ):
+    """
+    Cache misses do not list the cache folder as long as the running size is below the maximum; the
+    running size is initialized from the disk when the cache is enabled.
+    """
+    scans = []
+    cache_entries = seglib._cache_entries
+    monkeypatch.setattr( seglib, '_cache_entries', lambda: scans.append( 1 ) or cache_entries() )
+
+    seglib.polygon_map_from_img_json_files( *synthetic_page )
+    seglib.line_binary_mask_from_img_json_files( *synthetic_page )
+    assert scans == []
+
+    size = seglib.cache_stats()['size']
+    assert seglib._cache_config['size'] == size
+    seglib.enable_cache( disk_cache )
+    assert seglib._cache_config['size'] == size
+
+    # beyond the maximum size: the folder is listed, and the entries evicted
+    seglib.enable_cache( disk_cache, max_size=size )
+    seglib.label_statistics_from_img_json_files( *synthetic_page )
+    assert seglib.cache_stats()['evictions'] > 0
+    assert seglib._cache_config['size'] <= size
+
+
 @pytest.mark.parametrize(
         'label,expected',[
             (0, []), 
@@ -14,10 +14,7 @@ sys.path.append( str( Path(__file__).parents[1] ) )
 
 
 import vizlib
-
-@pytest.fixture(scope="module")
-def data_path():
-    return Path( __file__ ).parent.joinpath('data')
+import seglib
 
 
 def test_get_n_color_palette_default():
@@ -87,6 +84,106 @@ def test_display_two_polygon_sets( data_path, ndarrays_regression ):
 
 
 
+def test_display_polygon_set_sparse_map():
+    """
+    Rendering a sparse map yields the same image as rendering the dense map.
+    """
+    input_img_hw = Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8'))
+    polygons_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20301,0x301,1,0],
+                      [0,0,0x301,0x301,0x301,1],
+                      [0,0,1,1,1,0],
+                      [0,0,1,0x102,0,0]], dtype='int32'))
+
+    expected = vizlib.display_polygon_set( input_img_hw, polygons_chw )
+    actual = vizlib.display_polygon_set( input_img_hw, seglib.polygon_map_to_sparse( polygons_chw ))
+
+    assert np.array_equal( actual, expected )
+
+def test_display_two_polygon_sets_sparse_maps():
+    """
+    Rendering two sparse maps yields the same image as rendering the dense maps.
+    """
+    input_img_hw = Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8'))
+    polygons_1_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20301,0x301,1,0],
+                      [0,0,0x301,0x301,0x301,1],
+                      [0,0,1,1,1,0],
+                      [0,0,1,0x102,0,0]], dtype='int32'))
+    polygons_2_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[0,2,2,0,0,0],
+                      [2,2,1,2,2,0],
+                      [2,2,0x20301,0x301,1,0],
+                      [0,3,0x301,0x301,0x301,1],
+                      [0,0,3,1,1,0],
+                      [0,0,0x201,1,0,0]], dtype='int32'))
+
+    expected = vizlib.display_two_polygon_sets( input_img_hw, polygons_1_chw, polygons_2_chw )
+    actual = vizlib.display_two_polygon_sets( input_img_hw, seglib.polygon_map_to_sparse( polygons_1_chw ), seglib.polygon_map_to_sparse( polygons_2_chw ))
+
+    assert np.array_equal( actual, expected )
+
+
+@pytest.mark.parametrize('compressed', [True, False])
+def test_display_polygon_set_from_img_and_tensor_files( tmp_path, compressed ):
+    """
+    Rendering from a polygon map container (compressed, or uncompressed and memory-mapped) yields the
+    same image as rendering the map itself.
+    """
+    img_path, map_path = tmp_path.joinpath('page.png'), tmp_path.joinpath('map.pmap')
+    Image.fromarray( np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8')).save( img_path )
+    polygons_chw = seglib.array_to_rgba_uint8(np.array(
+                     [[2,2,2,0,0,0],
+                      [2,2,2,0,0,0],
+                      [2,2,0x20301,0x301,1,0],
+                      [0,0,0x301,0x301,0x301,1],
+                      [0,0,1,1,1,0],
+                      [0,0,1,0x102,0,0]], dtype='int32'))
+    seglib.save_polygon_map( polygons_chw, map_path, compressed=compressed )
+
+    with Image.open( img_path ) as input_img_hw:
+        expected = vizlib.display_polygon_set( input_img_hw, polygons_chw )
+        expected_two_sets = vizlib.display_two_polygon_sets( input_img_hw, polygons_chw, polygons_chw, .75 )
+
+    assert np.array_equal( vizlib.display_polygon_set_from_img_and_tensor_files( str(img_path), str(map_path) ), expected )
+    assert np.array_equal( vizlib.display_two_polygon_sets_from_img_and_tensor_files( str(img_path), str(map_path), str(map_path) ), expected_two_sets )
+
+
+@pytest.mark.parametrize('alpha', [.75, .5, .3])
+def test_display_polygon_set_same_as_float_blending( alpha ):
+    """
+    Fixed-point rendering yields the same image as float blending (within rounding), overlapping
+    polygons adding up their colors.
+    """
+    input_img_hwc = np.random.default_rng(1).integers(0, 256, (6,6,3), dtype='uint8')
+    label_map_hw = np.array([[2,2,2,0,0,0],
+                             [2,2,2,0,0,0],
+                             [2,2,0x20301,0x301,1,0],
+                             [0,0,0x301,0x301,0x301,1],
+                             [0,0,1,1,1,0],
+                             [0,0,1,0x102,0,0]], dtype='int32')
+    polygons_chw = seglib.array_to_rgba_uint8( label_map_hw )
+    colors = vizlib.get_n_color_palette( 3 )
+
+    fg_masked_hwc = np.zeros( input_img_hwc.shape )
+    for p in range(1,4):
+        fg_masked_hwc[ seglib.mask_from_polygon_map_functional( polygons_chw, lambda m: m == p ) ] += colors[ p % 3 ]
+    alphas = np.where( fg_masked_hwc != 0, alpha, 1.0 )
+    expected = ((input_img_hwc * alphas ) + fg_masked_hwc * (1-alpha)).astype('int')
+
+    actual = vizlib.display_polygon_set( Image.fromarray( input_img_hwc ), polygons_chw, alpha=alpha )
+
+    assert actual.dtype == np.uint8
+    # (sums beyond 255 wrap around in both)
+    difference = (actual.astype('int') - expected) % 256
+    assert np.max( np.minimum( difference, 256-difference )) <= 1
+    assert np.array_equal( actual[0,3:], input_img_hwc[0,3:] )
+
+
 def Dtest_segmentation_dict_to_polygons_lines():
         """
         To be removed (visualization code)
@@ -16,12 +16,13 @@ def display_polygon_set_from_img_and_tensor_files( img_file: str, polygon_file:
 
     Args:
         img_file (str): path to the original manuscript image.
-        polygon_file (str): path to the pickled polygon set, encoded as a 4-channel, 8-bit tensor.
+        polygon_file (str): path to the polygon set, stored as a polygon map container or as a pickled 4-channel, 8-bit tensor.
     Output:
         np.ndarray: a RGB image (H,W,3), 8-bit unsigned integers.
     """
     with Image.open(img_file) as input_img_hw:
-        polygons_chw = torch.load( polygon_file ) 
+        # a dense map is memory-mapped, and only read as it is rendered; a compressed one is decompressed label by label
+        polygons_chw = seglib.load_polygon_map( polygon_file, sparse=seglib.is_compressed_polygon_map_file( polygon_file ), mmap=True )
         return display_polygon_set( input_img_hw, polygons_chw, color_count, alpha )
 
 def display_two_polygon_sets_from_img_and_tensor_files( img_file: str, polygon_file_1: str, polygon_file_2: str, bg_alpha=.75) -> np.ndarray:
@@ -30,52 +31,56 @@ def display_two_polygon_sets_from_img_and_tensor_files( img_file: str, polygon_f
    
     Args:
         img_file (str): path to the original manuscript image.
-        polygon_file_1 (str): path to the first pickled polygon set, encoded as a 4-channel, 8-bit tensor.
-        polygon_file_2 (str): path to the second pickled polygon set, encoded as a 4-channel, 8-bit tensor.
+        polygon_file_1 (str): path to the first polygon set, stored as a polygon map container or as a pickled 4-channel, 8-bit tensor.
+        polygon_file_2 (str): path to the second polygon set, stored as a polygon map container or as a pickled 4-channel, 8-bit tensor.
     Output:
         np.ndarray: a RGB image (H,W,3), 8-bit unsigned integers.
     """
     with Image.open(img_file) as input_img_hw:
-        polygons_1_chw = torch.load( polygon_file_1 )
-        polygons_2_chw = torch.load( polygon_file_2 )
+        polygons_1_chw, polygons_2_chw = [ seglib.load_polygon_map( f, sparse=seglib.is_compressed_polygon_map_file( f ), mmap=True ) for f in (polygon_file_1, polygon_file_2) ]
         return display_two_polygon_sets( input_img_hw, polygons_1_chw, polygons_2_chw, bg_alpha )
 
 def display_polygon_set( input_img_hw: Image.Image, polygons_chw: Tensor, color_count=0, alpha=.75 ) -> np.ndarray:
     """
     Render a single set of polygons using two colors (alternate between odd- and even-numbered lines).
 
+    The map is read in a single pass: each channel is mapped to colors through a 256-entry lookup table,
+    colors of overlapping polygons add up, and only the covered pixels are blended into the image, in
+    fixed-point arithmetic.
+
     Args:
         input_img_hw (Image.Image): the original manuscript image, as opened with PIL.
-        polygons_chw (Tensor): polygon set, encoded as a 4-channel, 8-bit tensor.
+        polygons_chw (Tensor): polygon set, encoded as a 4-channel, 8-bit tensor (or as a sparse map).
     Output:
         np.ndarray: a RGB image (H,W,3), 8-bit unsigned integers.
     """
 
     input_img_hwc = np.asarray( input_img_hw )
-    polygon_count = torch.max( polygons_chw )
+    is_sparse = seglib.is_sparse_polygon_map( polygons_chw )
+    polygon_count = max( polygons_chw['labels'], default=0 ) if is_sparse else int( torch.max( polygons_chw ))
 
     colors = get_n_color_palette( color_count ) if color_count else get_n_color_palette(int( polygon_count ))
 
-    fg_masked_hwc = np.zeros( input_img_hwc.shape ) 
-
-    output_img = input_img_hwc.copy()
-    
-    for p in range(1, polygon_count+1 ):
-        # flat binary mask
-        polygon_mask_hw = seglib.mask_from_polygon_map_functional( polygons_chw, lambda m: m == p )
-        fg_masked_hwc[ polygon_mask_hw ] += colors[ p % len(colors) ]
-
-    # in original image, transparency applies only to the polygon pixels
-    alpha_mask = fg_masked_hwc != 0
-    alphas = np.full( alpha_mask.shape, 1.0 )
-    alphas[ alpha_mask ] = alpha
+    # label -> color (label 0 = no color)
+    color_lut = np.zeros( (256, 3), dtype='uint16' )
+    if polygon_count:
+        color_lut[1:] = np.array( colors, dtype='uint16' )[ np.arange(1, 256) % len(colors) ]
 
-    # combine: BG + FG
-    # use this statement instead to make the polygons more visible
-    #output_img = (input_img_hwc * alpha ) + fg_masked_hwc * (1-alpha)
-    output_img = (input_img_hwc * alphas ) + fg_masked_hwc * (1-alpha)
+    if is_sparse:
+        # only the polygons' boxes are touched
+        fg_masked_hwc = np.zeros( input_img_hwc.shape, dtype='uint16' )
+        for p, entry in polygons_chw['labels'].items():
+            fg_masked_hwc[ seglib.sparse_label_window( entry ) ][ entry['channels'] != 0 ] += color_lut[ p ]
+        covered_hw = np.any( fg_masked_hwc, axis=2 )
+        fg_colors = fg_masked_hwc[ covered_hw ]
+    else:
+        map_chw = polygons_chw.numpy()
+        # channel 0 stores the most recent label of any labeled pixel
+        covered_hw = map_chw[0] != 0
+        label_codes = map_chw[:, covered_hw]
+        fg_colors = color_lut[ label_codes[0] ] + color_lut[ label_codes[1] ] + color_lut[ label_codes[2] ] + color_lut[ label_codes[3] ]
 
-    return output_img.astype('uint8')
+    return blend_colors( input_img_hwc, covered_hw, fg_colors, alpha )
 
 
 def display_two_polygon_sets( input_img_hw: Image.Image, polygons_1_chw: Tensor, polygons_2_chw: Tensor, bg_alpha=.5 ) -> np.ndarray:
@@ -84,38 +89,49 @@ def display_two_polygon_sets( input_img_hw: Image.Image, polygons_1_chw: Tensor,
 
     Args:
         input_img (Image.Image): the original manuscript image, as opened with PIL.
-        polygons_1_chw (Tensor): polygon set #1, encoded as a 4-channel, 8-bit tensor.
-        polygons_2_chw (Tensor): polygon set #2, encoded as a 4-channel, 8-bit tensor.
+        polygons_1_chw (Tensor): polygon set #1, encoded as a 4-channel, 8-bit tensor (or as a sparse map).
+        polygons_2_chw (Tensor): polygon set #2, encoded as a 4-channel, 8-bit tensor (or as a sparse map).
     Output:
         np.ndarray: a RGB image (H,W,3), 8-bit unsigned integers.
     """
     input_img_hwc = np.asarray( input_img_hw )
-    polygon_count_1 = torch.max( polygons_1_chw )
-    polygon_count_2 = torch.max( polygons_2_chw )
 
     #colors = (255,0,0), (0,0,255)
-    colors = get_n_color_palette( 2, s=.99, v=.99 )
+    colors = np.array( get_n_color_palette( 2, s=.99, v=.99 ), dtype='uint16' )
 
-    fg_masked_hwc = np.zeros( input_img_hwc.shape ) 
-
-    output_img = input_img_hwc.copy()
-    
     # create a single mask for each set
-    mask_1_hw = seglib.mask_from_polygon_map_functional( polygons_1_chw, lambda m: m != 0 )
-    mask_2_hw = seglib.mask_from_polygon_map_functional( polygons_2_chw, lambda m: m != 0 )
+    mask_1_hw = seglib.mask_from_polygon_map_functional( polygons_1_chw, lambda m: m != 0 ).numpy()
+    mask_2_hw = seglib.mask_from_polygon_map_functional( polygons_2_chw, lambda m: m != 0 ).numpy()
+
+    covered_hw = mask_1_hw | mask_2_hw
+    fg_colors = mask_1_hw[ covered_hw ][:,None] * colors[0] + mask_2_hw[ covered_hw ][:,None] * colors[1]
+
+    return blend_colors( input_img_hwc, covered_hw, fg_colors, bg_alpha )
 
-    fg_masked_hwc[ mask_1_hw ] = colors[0]
-    fg_masked_hwc[ mask_2_hw ] += colors[1]
 
-    # in original image, transparency applies only to the polygon pixels
-    alpha_mask = fg_masked_hwc != 0
-    alphas = np.full( alpha_mask.shape, 1.0 )
-    alphas[ alpha_mask ] = bg_alpha
+def blend_colors( input_img_hwc: np.ndarray, covered_hw: np.ndarray, fg_colors: np.ndarray, alpha: float ) -> np.ndarray:
+    """
+    Blend colors into the covered pixels of an image, in fixed-point arithmetic (8 fractional bits):
+    out = img * alpha + color * (1-alpha), truncated, for every non-zero color component; other
+    components keep the image's value. As with float blending, sums beyond 255 wrap around.
+
+    Args:
+        input_img_hwc (np.ndarray): the image, (H,W,3), 8-bit unsigned integers.
+        covered_hw (np.ndarray): a boolean (H,W) mask of the pixels to be colored.
+        fg_colors (np.ndarray): a (N,3) array of colors (16-bit integers), one for each covered pixel.
+        alpha (float): opacity of the image, in covered pixels.
+
+    Output:
+        np.ndarray: a RGB image (H,W,3), 8-bit unsigned integers.
+    """
+    output_img = input_img_hwc.copy()
+    img_alpha = int( round( alpha * 256 ))
+    bg_colors = input_img_hwc[ covered_hw ].astype('uint32')
+    blended = (bg_colors * img_alpha + fg_colors * (256-img_alpha)) >> 8
+    # in original image, transparency applies only to the (non-zero) color components
+    output_img[ covered_hw ] = np.where( fg_colors != 0, blended, bg_colors ).astype('uint8')
+    return output_img
 
-    # combine: BG + FG
-    output_img = (input_img_hwc * alphas ) + fg_masked_hwc * (1-bg_alpha)
-    
-    return output_img.astype('uint8')
 
 def get_n_color_palette(n: int, s=.85, v=.95) -> list:
     """